@@ -2,8 +2,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
-import cv2
 import os
+from .weights import load_pretrained
 
 
 __all__ = ['darknet19']
@@ -117,11 +117,10 @@ def darknet19(pretrained=False, hr=False, **kwargs):
     model = DarkNet_19()
     if pretrained:
         print('Loading the pretrained model ...')
-        path_to_dir = os.path.dirname(os.path.abspath(__file__))
         if hr:
             print('Loading the hi-res darknet19-448 ...')
-            model.load_state_dict(torch.load(path_to_dir + '/weights/darknet19_hr_75.52_92.73.pth', map_location='cuda'), strict=False)
+            load_pretrained(model, 'darknet19_hr_75.52_92.73.pth')
         else:
             print('Loading the darknet19 ...')
-            model.load_state_dict(torch.load(path_to_dir + '/weights/darknet19_72.96.pth', map_location='cuda'), strict=False)
+            load_pretrained(model, 'darknet19_72.96.pth')
     return model
\ No newline at end of file
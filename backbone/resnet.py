@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
-import torch.utils.model_zoo as model_zoo
+import os
+from .weights import load_pretrained
 
 
 __all__ = ['ResNet', 'resnet18', 'resnet34', 'resnet50', 'resnet101',
@@ -165,9 +166,9 @@ def resnet18(pretrained=False, hr_pretrained=False, **kwargs):
         # strict = False as we don't need fc layer params.
         if hr_pretrained:
             print('Loading the high resolution pretrained model ...')
-            model.load_state_dict(torch.load("backbone/weights/resnet18_hr_10.pth"), strict=False)
+            load_pretrained(model, 'resnet18_hr_10.pth')
         else:
-            model.load_state_dict(model_zoo.load_url(model_urls['resnet18']), strict=False)
+            load_pretrained(model, os.path.basename(model_urls['resnet18']), model_urls['resnet18'])
     return model
 
 def resnet34(pretrained=False, **kwargs):
@@ -178,7 +179,7 @@ def resnet34(pretrained=False, **kwargs):
     """
     model = ResNet(BasicBlock, [3, 4, 6, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(model_urls['resnet34']), strict=False)
+        load_pretrained(model, os.path.basename(model_urls['resnet34']), model_urls['resnet34'])
     return model
 
 def resnet50(pretrained=False, **kwargs):
@@ -189,7 +190,7 @@ def resnet50(pretrained=False, **kwargs):
     """
     model = ResNet(Bottleneck, [3, 4, 6, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(model_urls['resnet50']), strict=False)
+        load_pretrained(model, os.path.basename(model_urls['resnet50']), model_urls['resnet50'])
     return model
 
 def resnet101(pretrained=False, **kwargs):
@@ -200,7 +201,7 @@ def resnet101(pretrained=False, **kwargs):
     """
     model = ResNet(Bottleneck, [3, 4, 23, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(model_urls['resnet101']), strict=False)
+        load_pretrained(model, os.path.basename(model_urls['resnet101']), model_urls['resnet101'])
     return model
 
 def resnet152(pretrained=False, **kwargs):
@@ -211,7 +212,7 @@ def resnet152(pretrained=False, **kwargs):
     """
     model = ResNet(Bottleneck, [3, 8, 36, 3], **kwargs)
     if pretrained:
-        model.load_state_dict(model_zoo.load_url(model_urls['resnet152']))
+        load_pretrained(model, os.path.basename(model_urls['resnet152']), model_urls['resnet152'], strict=True)
     return model
 
 if __name__=='__main__':
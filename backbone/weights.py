@@ -0,0 +1,38 @@
+"""Pretrained backbone weights, resolved from a local cache directory.
+
+The weight files are looked up in WEIGHTS_DIR (backbone/weights, or the
+YOLO_WEIGHTS_DIR environment variable) and then in the torch hub cache,
+where model_zoo used to download them. A file that is missing from both
+and has a url is downloaded into WEIGHTS_DIR once, so later runs work
+offline. The models only load these when they are built for training.
+"""
+import os
+import torch
+from utils.checkpoint import load_file
+
+
+WEIGHTS_DIR = os.environ.get('YOLO_WEIGHTS_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights'))
+
+
+def weights_path(filename, url=None):
+    """Local path of a weight file, downloaded first if needed and possible."""
+    for directory in (WEIGHTS_DIR, os.path.join(torch.hub.get_dir(), 'checkpoints')):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            return path
+    path = os.path.join(WEIGHTS_DIR, filename)
+    if url is None:
+        raise FileNotFoundError('Pretrained weights {:s} not found in {:s} (see YOLO_WEIGHTS_DIR)'.format(
+            filename, WEIGHTS_DIR))
+    if not os.path.isdir(WEIGHTS_DIR):
+        os.makedirs(WEIGHTS_DIR)
+    print('Downloading {:s} to {:s} ...'.format(url, path))
+    torch.hub.download_url_to_file(url, path)
+    return path
+
+
+def load_pretrained(model, filename, url=None, strict=False):
+    """Load the weight file `filename` into `model`, on the cpu."""
+    model.load_state_dict(load_file(weights_path(filename, url), map_location='cpu'), strict=strict)
+    return model
@@ -0,0 +1,233 @@
+"""Latency benchmark of the detectors.
+
+For every version / backbone / input size / thread count / batch size this
+reports warmed-up p50/p95/p99 latency of the backbone, the head, box decoding,
+the device-to-host copy and NMS (see utils/profiler.py), plus images/sec, and
+writes everything to a JSON file so runs on different commits can be compared.
+
+    python benchmark.py -v yolo_v1 yolo_anchor -bk r18 d19 --batch_sizes 1 8 --threads 1 4
+"""
+import os
+import time
+import json
+import socket
+import argparse
+import platform
+import subprocess
+from collections import defaultdict
+import numpy as np
+import torch
+from data import config, VOC_CLASSES
+from utils import profiler
+from utils.checkpoint import load_weights
+from utils.fold_bn import fold_bn
+from utils.quantize import quantize_detector
+from utils.nms import NMS_TYPES
+from models import factory
+
+
+SUPPORTED = {version: entry['backbones'] for version, entry in config.MODELS.items()}
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Detection Benchmark')
+parser.add_argument('-v', '--versions', nargs='+', default=list(SUPPORTED.keys()),
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbones', nargs='+', default=['r18', 'd19'],
+                    help='r18, r50, d19')
+parser.add_argument('--input_sizes', nargs='+', type=int, default=None,
+                    help='Square input sizes (default: the training size of each version)')
+parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1],
+                    help='Batch sizes to run the network with')
+parser.add_argument('--threads', nargs='+', type=int, default=[torch.get_num_threads()],
+                    help='Intra-op thread counts to sweep')
+parser.add_argument('--warmup', type=int, default=10,
+                    help='Untimed iterations before measuring')
+parser.add_argument('--iters', type=int, default=50,
+                    help='Timed iterations')
+parser.add_argument('--trained_model', type=str, default=None,
+                    help='Optional state_dict, so NMS sees realistic candidates')
+parser.add_argument('--precisions', nargs='+', default=['fp32'],
+                    help='fp32, int8 (post-training static quantization, cpu only)')
+parser.add_argument('--calib_images', type=int, default=10,
+                    help='Random inputs the int8 models are calibrated on')
+parser.add_argument('--nms', nargs='+', default=['nms'], choices=NMS_TYPES,
+                    help='Suppression methods of the postprocess to time')
+parser.add_argument('--top_k', type=int, default=None,
+                    help='Candidates decoded per image, by score (default: all)')
+parser.add_argument('--fold_bn', action='store_true', default=False,
+                    help='Fold BatchNorm into the convolutions before timing')
+parser.add_argument('--cuda', action='store_true', default=False,
+                    help='Benchmark on cuda:0')
+parser.add_argument('--output', type=str, default='benchmark.json',
+                    help='JSON file the results are written to')
+
+args = parser.parse_args()
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+# profiler stage -> benchmark stage; conv_set*, branch* and pred* make up the head,
+# and postprocess (thresholding + suppression) includes nms
+STAGES = {'backbone': 'backbone', 'decode_boxes': 'decode', 'd2h': 'd2h',
+          'postprocess': 'postprocess', 'nms': 'nms'}
+
+
+def stage_of(name):
+    if name in STAGES:
+        return STAGES[name]
+    if name.startswith(('conv_set', 'branch', 'pred')):
+        return 'head'
+    return None
+
+
+def summarize(times):
+    ms = np.array(times) * 1000.
+    return {'p50': float(np.percentile(ms, 50)),
+            'p95': float(np.percentile(ms, 95)),
+            'p99': float(np.percentile(ms, 99)),
+            'mean': float(ms.mean())}
+
+
+def build_model(version, backbone, input_size, device):
+    net, _ = factory.build_model(version, device, 'VOC', backbone=backbone, num_classes=len(VOC_CLASSES),
+                                 input_size=input_size, conf_thresh=0.01)
+    if args.trained_model is not None:
+        load_weights(net, args.trained_model, device)
+    net = net.to(device).eval()
+    net.top_k = args.top_k
+    if args.fold_bn:
+        net = fold_bn(net)
+    return net
+
+
+def count_flops(net, x):
+    try:
+        from thop import profile
+    except ImportError:
+        return None
+    trainable = net.trainable
+    net.trainable = True
+    flops, _ = profile(net, inputs=(x, ), verbose=False)
+    net.trainable = trainable
+    return float(flops)
+
+
+def run(net, x, raw):
+    """Time `args.iters` forwards. With `raw` only backbone + head are run."""
+    device = x.device
+    net.trainable = raw
+    records = defaultdict(list)
+    profiler.enable(sync=device.type == 'cuda')
+    with torch.no_grad():
+        for i in range(args.warmup + args.iters):
+            profiler.reset()
+            sync(device)
+            t0 = time.perf_counter()
+            net(x)
+            sync(device)
+            t1 = time.perf_counter()
+            if i >= args.warmup:
+                current = defaultdict(float)
+                for e in profiler.events():
+                    stage = stage_of(e['name'])
+                    if stage is not None:
+                        current[stage] += e['dur'] / 1e6
+                for stage, t in current.items():
+                    records[stage].append(t)
+                records['total'].append(t1 - t0)
+    profiler.disable()
+    net.trainable = False
+    return {stage: summarize(times) for stage, times in records.items()}
+
+
+def benchmark_config(version, backbone, input_size, precision, device):
+    net = build_model(version, backbone, input_size, device)
+    params = sum(p.numel() for p in net.parameters())
+    flops = count_flops(net, torch.randn(1, 3, input_size[0], input_size[1], device=device))
+    if precision == 'int8':
+        # the latency of int8 kernels does not depend on the calibration data
+        net = quantize_detector(net, [torch.randn(1, 3, input_size[0], input_size[1])
+                                      for _ in range(args.calib_images)])
+    profiler.attach(net)
+    results = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, 3, input_size[0], input_size[1], device=device)
+            # decode + nms only run on the first image of a batch, so the full
+            # pipeline is timed at batch size 1 and the network alone otherwise
+            raw = batch_size > 1
+            for nms_type in (args.nms[:1] if raw else args.nms):
+                net.nms_type = nms_type
+                stages = run(net, x, raw=raw)
+                result = {'version': version,
+                          'backbone': backbone,
+                          'input_size': input_size,
+                          'threads': threads,
+                          'batch_size': batch_size,
+                          'params': params,
+                          'flops': flops,
+                          'precision': precision,
+                          'fold_bn': args.fold_bn,
+                          'nms': nms_type,
+                          'top_k': args.top_k,
+                          'stages': stages,
+                          'images_per_sec': batch_size * 1000. / stages['total']['mean']}
+                print('{:s} {:s} {:s} {:d}x{:d} threads={:d} batch={:d} nms={:s} | '.format(
+                          version, backbone, precision, input_size[0], input_size[1], threads, batch_size, nms_type) +
+                      ' '.join('{:s}: {:.2f}ms'.format(s, v['p50']) for s, v in stages.items()) +
+                      ' | {:.1f} img/s'.format(result['images_per_sec']))
+                results.append(result)
+    profiler.detach()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    device = torch.device('cuda:0' if args.cuda and torch.cuda.is_available() else 'cpu')
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    results = []
+    for version in args.versions:
+        for backbone in args.backbones:
+            if backbone not in SUPPORTED[version]:
+                print('Skip {:s} with {:s}: not supported.'.format(version, backbone))
+                continue
+            if args.input_sizes is None:
+                input_sizes = [config.get_cfg(version, 'VOC')['min_dim']]
+            else:
+                input_sizes = [[s, s] for s in args.input_sizes]
+            for input_size in input_sizes:
+                for precision in args.precisions:
+                    if precision == 'int8' and device.type == 'cuda':
+                        print('Skip int8: quantized kernels only run on cpu.')
+                        continue
+                    results += benchmark_config(version, backbone, input_size, precision, device)
+
+    report = {'meta': {'commit': git_commit(),
+                       'host': socket.gethostname(),
+                       'platform': platform.platform(),
+                       'torch': torch.__version__,
+                       'device': str(device),
+                       'warmup': args.warmup,
+                       'iters': args.iters,
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Saved benchmark results to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
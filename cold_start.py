@@ -0,0 +1,95 @@
+"""Cold-start time of a detector: from a new python process to its first detection.
+
+Every run starts a fresh process, which times importing torch and the model,
+building it for inference (no pretrained backbone is loaded), loading the
+trained weights (mmap, mapped straight to the device), and the first and a
+second, warm detection. The time to the first detection is measured from
+the launch of the process, so it includes the interpreter start-up.
+
+    python cold_start.py -v yolo_v1 -bk r18 --trained_model weights.pth --runs 5
+"""
+import time
+import os
+import sys
+import json
+import argparse
+import importlib
+import subprocess
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Cold-start Benchmark')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbone', type=str, default=None,
+                    help='r18, r50, d19 (default: the backbone of data/config.py)')
+parser.add_argument('--trained_model', type=str, default=None,
+                    help='Trained state_dict file path to open')
+parser.add_argument('--runs', type=int, default=5,
+                    help='Number of cold starts')
+parser.add_argument('--cuda', action='store_true', default=False,
+                    help='Run on cuda:0')
+parser.add_argument('--launched', type=float, default=None,
+                    help=argparse.SUPPRESS)
+
+args = parser.parse_args()
+
+STAGES = ('import', 'build', 'load', 'to_device', 'first_detection', 'second_detection')
+
+
+def child():
+    """One cold start, in this process. Prints the stage times as json."""
+    times = {}
+    t = time.perf_counter()
+    import torch
+    from data import config, VOC_CLASSES
+    from models.factory import build_model
+    importlib.import_module(config.MODELS[args.version]['module'])
+    from utils.checkpoint import load_weights
+    times['import'] = time.perf_counter() - t
+
+    device = torch.device('cuda:0' if args.cuda and torch.cuda.is_available() else 'cpu')
+    t = time.perf_counter()
+    net, cfg = build_model(args.version, device, 'VOC', backbone=args.backbone,
+                           num_classes=len(VOC_CLASSES), conf_thresh=0.01)
+    times['build'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if args.trained_model is not None:
+        load_weights(net, args.trained_model, device)
+    times['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    net = net.to(device).eval()
+    times['to_device'] = time.perf_counter() - t
+
+    x = torch.zeros(1, 3, cfg['min_dim'][0], cfg['min_dim'][1], device=device)
+    for stage in ('first_detection', 'second_detection'):
+        t = time.perf_counter()
+        with torch.no_grad():
+            net(x)
+        times[stage] = time.perf_counter() - t
+        if stage == 'first_detection':
+            times['to_first_detection'] = time.time() - args.launched
+    print(json.dumps(times))
+
+
+def main():
+    cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+    runs = []
+    for i in range(args.runs):
+        out = subprocess.check_output(cmd + ['--launched', repr(time.time())],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(out.decode().strip().splitlines()[-1]))
+        print('run {:d}: {:.3f}s to the first detection'.format(i + 1, runs[-1]['to_first_detection']))
+
+    print('{:<20s}{:>12s}{:>12s}'.format('stage', 'median(ms)', 'max(ms)'))
+    for stage in STAGES + ('to_first_detection',):
+        values = sorted(r[stage] * 1000. for r in runs)
+        print('{:<20s}{:>12.1f}{:>12.1f}'.format(stage, values[len(values) // 2], values[-1]))
+
+
+if __name__ == '__main__':
+    if args.launched is not None:
+        child()
+    else:
+        main()
@@ -1,7 +1,9 @@
 from .voc0712 import VOCDetection, VOCAnnotationTransform, VOC_CLASSES, VOC_ROOT
+from .coco import COCODetection, COCO_CLASSES, COCO_ROOT
 from .config import *
+from .preprocess import Preprocess
+from .sampler import GroupedBatchSampler, RectCollate, pad_batch, fit_size
 import torch
-import cv2
 import numpy as np
 
 def detection_collate(batch):
@@ -25,17 +27,38 @@ def detection_collate(batch):
     return torch.stack(imgs, 0), targets
 
 
-def base_transform(image, size, mean):
-    x = cv2.resize(image, (size[1], size[0])).astype(np.float32)
-    x -= mean
-    x = x.astype(np.float32)
-    return x
+def build_dataset(name, train=True, root=None, image_set=None, transform=None):
+    """
+        Input:
+            name : str -> 'VOC' or 'COCO'.
+            train : bool -> the train set of config.DATASETS, else the eval set; the
+                    eval sets keep every image, also those without a box.
+            root : str -> default: VOC_ROOT or COCO_ROOT.
+            image_set -> default: the set of config.DATASETS, e.g. [['2007', 'test']] or 'val2017'.
+    """
+    if name not in DATASETS:
+        raise ValueError('Unknown dataset: {}'.format(name))
+    if image_set is None:
+        image_set = DATASETS[name]['train_set' if train else 'eval_set']
+    if name == 'COCO':
+        return COCODetection(root or COCO_ROOT, image_set, transform, keep_empty=not train)
+    return VOCDetection(root or VOC_ROOT, [tuple(s) for s in image_set], transform, VOCAnnotationTransform())
+
+
+def base_transform(image, size, mean, keep_ratio=False):
+    import cv2
+    if keep_ratio:
+        # fit in size, the batch is padded to its shape afterwards (pad_batch)
+        size = fit_size(image.shape[0], image.shape[1], size)
+    # resize in uint8, then convert and subtract the mean in one pass
+    return np.subtract(cv2.resize(image, (size[1], size[0])), mean, dtype=np.float32)
 
 
 class BaseTransform:
-    def __init__(self, size, mean):
+    def __init__(self, size, mean, keep_ratio=False):
         self.size = size
         self.mean = np.array(mean, dtype=np.float32)
+        self.keep_ratio = keep_ratio
 
     def __call__(self, image, boxes=None, labels=None):
-        return base_transform(image, self.size, self.mean), boxes, labels
+        return base_transform(image, self.size, self.mean, self.keep_ratio), boxes, labels
@@ -0,0 +1,168 @@
+"""Cached VOC annotations for evaluation.
+
+Annotations are parsed in parallel and stored column-wise (one flat array per
+field plus per-image offsets, and the size of every image) in an ``.npz``
+file whose name is derived from the image-set content and the mtimes of the
+annotation files it references. Evaluating another split, or editing an
+annotation, therefore never reuses a stale cache.
+"""
+import os
+import sys
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+if sys.version_info[0] == 2:
+    import xml.etree.cElementTree as ET
+else:
+    import xml.etree.ElementTree as ET
+
+
+# cache file path -> columns, so that the per-class calls of voc_eval only load once
+_loaded = {}
+# part of the cache key, bumped when the columns change
+CACHE_VERSION = b'2'
+
+
+def parse_rec(filename):
+    """ Parse a PASCAL VOC xml file """
+    return parse_objects(ET.parse(filename))
+
+
+def parse_objects(tree):
+    objects = []
+    for obj in tree.findall('object'):
+        obj_struct = {}
+        obj_struct['name'] = obj.find('name').text
+        obj_struct['pose'] = obj.find('pose').text
+        obj_struct['truncated'] = int(obj.find('truncated').text)
+        obj_struct['difficult'] = int(obj.find('difficult').text)
+        bbox = obj.find('bndbox')
+        obj_struct['bbox'] = [int(bbox.find('xmin').text),
+                              int(bbox.find('ymin').text),
+                              int(bbox.find('xmax').text),
+                              int(bbox.find('ymax').text)]
+        objects.append(obj_struct)
+
+    return objects
+
+
+def _parse_columns(filename):
+    tree = ET.parse(filename)
+    objects = parse_objects(tree)
+    names = [obj['name'] for obj in objects]
+    difficult = [obj['difficult'] for obj in objects]
+    bbox = [obj['bbox'] for obj in objects]
+    size = tree.find('size')
+    return names, difficult, bbox, (int(size.find('height').text), int(size.find('width').text))
+
+
+def cache_key(annopath, imagenames, imageset_bytes):
+    """
+        Input:
+            annopath : str -> annotation path template, e.g. '.../Annotations/%s.xml'.
+            imagenames : list -> image ids listed in the image-set file.
+            imageset_bytes : bytes -> raw content of the image-set file.
+        Output:
+            key : str -> hex digest of the image-set content and annotation mtimes.
+    """
+    h = hashlib.sha1(imageset_bytes)
+    h.update(CACHE_VERSION)
+    h.update(annopath.encode())
+    for imagename in imagenames:
+        h.update(str(os.stat(annopath % imagename).st_mtime_ns).encode())
+    return h.hexdigest()[:16]
+
+
+def build_columns(annopath, imagenames, num_workers=None):
+    """Parse every annotation of the image set into flat column arrays."""
+    paths = [annopath % imagename for imagename in imagenames]
+    print('Reading annotations for {:d} images ...'.format(len(paths)))
+    if num_workers == 0:
+        records = list(map(_parse_columns, paths))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            records = list(pool.map(_parse_columns, paths, chunksize=64))
+
+    counts = np.array([len(names) for names, _, _, _ in records], dtype=np.int64)
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    all_names = [name for names, _, _, _ in records for name in names]
+    classes, cls = np.unique(np.array(all_names, dtype=np.str_), return_inverse=True)
+    difficult = np.array([d for _, diffs, _, _ in records for d in diffs], dtype=np.bool_)
+    bbox = np.array([b for _, _, boxes, _ in records for b in boxes], dtype=np.int32).reshape(-1, 4)
+    size = np.array([s for _, _, _, s in records], dtype=np.int32).reshape(-1, 2)
+
+    return {'imagenames': np.array(imagenames, dtype=np.str_),
+            'offsets': offsets,
+            'classes': classes,
+            'cls': cls.astype(np.int32),
+            'difficult': difficult,
+            'bbox': bbox,
+            'size': size}
+
+
+def load_annotations(annopath, imagesetfile, cachedir, num_workers=None):
+    """
+        Load the annotation columns of an image set, building and caching them on a miss.
+        Input:
+            annopath : str -> annotation path template, e.g. '.../Annotations/%s.xml'.
+            imagesetfile : str -> text file with one image id per line.
+            cachedir : str -> directory holding the keyed cache files.
+            num_workers : int -> parser processes (None: one per cpu, 0: parse serially).
+        Output:
+            columns : dict -> 'imagenames', 'offsets', 'classes', 'cls', 'difficult', 'bbox',
+                      and 'size', the (height, width) of every image.
+    """
+    with open(imagesetfile, 'rb') as f:
+        imageset_bytes = f.read()
+    imagenames = [x.strip() for x in imageset_bytes.decode().splitlines()]
+    imagenames = [x for x in imagenames if x]
+
+    key = cache_key(annopath, imagenames, imageset_bytes)
+    cachefile = os.path.join(cachedir, 'annots_{:s}.npz'.format(key))
+    if cachefile in _loaded:
+        return _loaded[cachefile]
+
+    if os.path.isfile(cachefile):
+        with np.load(cachefile) as f:
+            columns = {k: f[k] for k in f.files}
+    else:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        columns = build_columns(annopath, imagenames, num_workers)
+        print('Saving cached annotations to {:s}'.format(cachefile))
+        tmpfile = cachefile + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(tmpfile, cachefile)
+
+    _loaded[cachefile] = columns
+    return columns
+
+
+def class_records(columns, classname):
+    """
+        Gather the gt objects of one class in the per-image layout used by voc_eval.
+        Output:
+            class_recs : dict -> imagename -> {'bbox', 'difficult', 'det'}.
+            npos : int -> number of non-difficult gt objects of the class.
+    """
+    cls_ind = np.searchsorted(columns['classes'], classname)
+    if cls_ind < len(columns['classes']) and columns['classes'][cls_ind] == classname:
+        mask = columns['cls'] == cls_ind
+    else:
+        mask = np.zeros(len(columns['cls']), dtype=np.bool_)
+    offsets = columns['offsets']
+    bbox = columns['bbox']
+    difficult = columns['difficult']
+
+    class_recs = {}
+    for i, imagename in enumerate(columns['imagenames'].tolist()):
+        start, end = offsets[i], offsets[i + 1]
+        m = mask[start:end]
+        class_recs[imagename] = {'bbox': bbox[start:end][m],
+                                 'difficult': difficult[start:end][m],
+                                 'det': [False] * int(m.sum())}
+    npos = int(np.count_nonzero(mask & ~difficult))
+    return class_recs, npos
@@ -1,20 +1,27 @@
-from .config import HOME
+"""COCO Dataset Classes
+
+The instances json of an image set is read once into an index of flat
+arrays (one row per image and one per annotation, the annotations sorted by
+image, with per-image offsets), which is cached next to the json as an .npz
+keyed by its size and mtime. pycocotools is not needed, and pull_item only
+slices the arrays of its image.
+"""
 import os
 import os.path as osp
-import sys
+import json
 import torch
 import torch.utils.data as data
-import torchvision.transforms as transforms
-import cv2
 import numpy as np
+from .voc0712 import imread
 
-COCO_ROOT = osp.join(HOME, 'object-detection/myYOLO/data/coco/')
+# note: if you used our download scripts with this directory, this should be right
+path_to_dir = osp.dirname(osp.abspath(__file__))
+COCO_ROOT = path_to_dir + "/coco/"
 IMAGES = 'images'
 ANNOTATIONS = 'annotations'
-COCO_API = 'PythonAPI'
 INSTANCES_SET = 'instances_{}.json'
 COCO_CLASSES = ('person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus',
-                'train', 'truck', 'boat', 'traffic light', 'fire', 'hydrant',
+                'train', 'truck', 'boat', 'traffic light', 'fire hydrant',
                 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog',
                 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra',
                 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie',
@@ -25,75 +32,117 @@ COCO_CLASSES = ('person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus',
                 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza',
                 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed',
                 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote',
-                'keyboard', 'cell phone', 'microwave oven', 'toaster', 'sink',
+                'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
                 'refrigerator', 'book', 'clock', 'vase', 'scissors',
                 'teddy bear', 'hair drier', 'toothbrush')
 
 
-def get_label_map(label_file):
-    label_map = {}
-    labels = open(label_file, 'r')
-    for line in labels:
-        ids = line.split(',')
-        label_map[int(ids[0])] = int(ids[1])
-    return label_map
-
-
-class COCOAnnotationTransform(object):
-    """Transforms a COCO annotation into a Tensor of bbox coords and label index
-    Initilized with a dictionary lookup of classnames to indexes
+def build_index(annotation_file):
     """
-    def __init__(self):
-        self.label_map = get_label_map(osp.join(COCO_ROOT, 'coco_labels.txt'))
-
-    def __call__(self, target, width, height):
-        """
-        Args:
-            target (dict): COCO target json annotation as a python dict
-            height (int): height
-            width (int): width
-        Returns:
-            a list containing lists of bounding boxes  [bbox coords, class idx]
-        """
-        scale = np.array([width, height, width, height])
-        res = []
-        for obj in target:
-            if 'bbox' in obj:
-                bbox = obj['bbox']
-                bbox[2] += bbox[0]
-                bbox[3] += bbox[1]
-                label_idx = self.label_map[obj['category_id']] - 1
-                final_box = list(np.array(bbox)/scale)
-                final_box.append(label_idx)
-                res += [final_box]  # [xmin, ymin, xmax, ymax, label_idx]
-            else:
-                print("no bbox problem!")
-
-        return res  # [[xmin, ymin, xmax, ymax, label_idx], ... ]
+        Input:
+            annotation_file : str -> a COCO instances json.
+        Output:
+            index : dict of ndarrays ->
+                'image_id', 'file_name', 'width', 'height' : [I,] per image.
+                'category_id', 'category_name' : [C,] sorted by id, the label of a
+                    category is its position.
+                'offsets' : [I + 1,] the annotations of image i are offsets[i]:offsets[i + 1].
+                'bbox' : [N, 4] (xmin, ymin, xmax, ymax) in pixels.
+                'label', 'iscrowd', 'area' : [N,]
+    """
+    with open(annotation_file, 'r') as f:
+        dataset = json.load(f)
+    images = dataset['images']
+    categories = sorted(dataset['categories'], key=lambda c: c['id'])
+    anns = dataset['annotations']
+
+    image_id = np.array([img['id'] for img in images], dtype=np.int64)
+    category_id = np.array([c['id'] for c in categories], dtype=np.int64)
+    ann_image_id = np.array([a['image_id'] for a in anns], dtype=np.int64)
+    bbox = np.array([a['bbox'] for a in anns], dtype=np.float32).reshape(-1, 4)
+    bbox[:, 2:] += bbox[:, :2]
+    label = np.searchsorted(category_id, np.array([a['category_id'] for a in anns], dtype=np.int64))
+    iscrowd = np.array([a.get('iscrowd', 0) for a in anns], dtype=np.bool_)
+    area = np.array([a.get('area', 0.) for a in anns], dtype=np.float32)
+
+    # the position of the image of every annotation, then group them by image
+    image_order = np.argsort(image_id, kind='stable')
+    ann_image = image_order[np.searchsorted(image_id[image_order], ann_image_id)]
+    order = np.argsort(ann_image, kind='stable')
+    offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ann_image, minlength=len(images)), out=offsets[1:])
+
+    return {'image_id': image_id,
+            'file_name': np.array([img['file_name'] for img in images], dtype=np.str_),
+            'width': np.array([img['width'] for img in images], dtype=np.int32),
+            'height': np.array([img['height'] for img in images], dtype=np.int32),
+            'category_id': category_id,
+            'category_name': np.array([c['name'] for c in categories], dtype=np.str_),
+            'offsets': offsets,
+            'bbox': bbox[order],
+            'label': label[order].astype(np.int32),
+            'iscrowd': iscrowd[order],
+            'area': area[order]}
+
+
+def load_index(annotation_file):
+    """build_index, cached in <annotation_file>.npz until the json changes."""
+    stat = os.stat(annotation_file)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cachefile = osp.splitext(annotation_file)[0] + '.npz'
+    if osp.isfile(cachefile):
+        with np.load(cachefile) as f:
+            if np.array_equal(f['source'], source):
+                return {k: f[k] for k in f.files if k != 'source'}
+
+    print('Indexing {:s} ...'.format(annotation_file))
+    index = build_index(annotation_file)
+    try:
+        tmpfile = cachefile + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, source=source, **index)
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        # a read-only dataset directory: index again next time
+        pass
+    return index
 
 
 class COCODetection(data.Dataset):
     """`MS Coco Detection <http://mscoco.org/dataset/#detections-challenge2016>`_ Dataset.
     Args:
-        root (string): Root directory where images are downloaded to.
-        set_name (string): Name of the specific set of COCO images.
+        root (string): Root directory of the images/ and annotations/ folders.
+        image_set (string): Name of the specific set of COCO images, the images are
+                            in images/<image_set>/ and the annotations in
+                            annotations/instances_<image_set>.json.
         transform (callable, optional): A function/transform that augments the
                                         raw images`
-        target_transform (callable, optional): A function/transform that takes
-        in the target (bbox) and transforms it.
+        keep_empty (bool): Also keep the images without any box (for evaluation);
+                           crowd boxes are never trained on.
     """
 
-    def __init__(self, root, image_set='trainval35k', transform=None,
-                 target_transform=COCOAnnotationTransform(), dataset_name='MS COCO'):
-        sys.path.append(osp.join(root, COCO_API))
-        from pycocotools.coco import COCO
-        self.root = osp.join(root, IMAGES, image_set)
-        self.coco = COCO(osp.join(root, ANNOTATIONS,
-                                  INSTANCES_SET.format(image_set)))
-        self.ids = list(self.coco.imgToAnns.keys())
+    def __init__(self, root=COCO_ROOT, image_set='trainval35k', transform=None,
+                 keep_empty=False, dataset_name='COCO'):
+        self.root = root
+        self.image_set = image_set
         self.transform = transform
-        self.target_transform = target_transform
         self.name = dataset_name
+        self._imgpath = osp.join(root, IMAGES, image_set, '%s')
+        self.index = load_index(osp.join(root, ANNOTATIONS, INSTANCES_SET.format(image_set)))
+        self.class_names = tuple(self.index['category_name'].tolist())
+
+        # [xmin, ymin, xmax, ymax, label] of the trained boxes, normalized by the
+        # image size, in one array sliced per image
+        index = self.index
+        ann_image = np.repeat(np.arange(len(index['image_id'])), np.diff(index['offsets']))
+        bbox = index['bbox']
+        keep = ~index['iscrowd'] & (bbox[:, 2] > bbox[:, 0]) & (bbox[:, 3] > bbox[:, 1])
+        scale = np.stack([index['width'], index['height']] * 2, axis=1)[ann_image].astype(np.float32)
+        self.targets = np.hstack((bbox / scale, index['label'][:, None].astype(np.float32)))[keep]
+        counts = np.bincount(ann_image[keep], minlength=len(index['image_id']))
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.ids = np.arange(len(counts)) if keep_empty else np.nonzero(counts)[0]
 
     def __getitem__(self, index):
         """
@@ -101,7 +150,7 @@ class COCODetection(data.Dataset):
             index (int): Index
         Returns:
             tuple: Tuple (image, target).
-                   target is the object returned by ``coco.loadAnns``.
+                   target is the [N, 5] array of boxes and labels.
         """
         im, gt, h, w = self.pull_item(index)
         return im, gt
@@ -115,31 +164,29 @@ class COCODetection(data.Dataset):
             index (int): Index
         Returns:
             tuple: Tuple (image, target, height, width).
-                   target is the object returned by ``coco.loadAnns``.
+                   target is the [N, 5] array of boxes and labels.
         """
-        img_id = self.ids[index]
-        target = self.coco.imgToAnns[img_id]
-        ann_ids = self.coco.getAnnIds(imgIds=img_id)
-
-        target = self.coco.loadAnns(ann_ids)
-        path = osp.join(self.root, self.coco.loadImgs(img_id)[0]['file_name'])
-        assert osp.exists(path), 'Image path does not exist: {}'.format(path)
-        img = cv2.imread(osp.join(self.root, path))
+        i = self.ids[index]
+        # a copy: the transforms scale the boxes in place
+        target = self.targets[self.offsets[i]:self.offsets[i + 1]].copy()
+        img = imread(self._imgpath % self.index['file_name'][i])
         height, width, _ = img.shape
-        if self.target_transform is not None:
-            target = self.target_transform(target, width, height)
         if self.transform is not None:
-            target = np.array(target)
-            img, boxes, labels = self.transform(img, target[:, :4],
-                                                target[:, 4])
+            img, boxes, labels = self.transform(img, target[:, :4], target[:, 4])
             # to rgb
             img = img[:, :, (2, 1, 0)]
 
             target = np.hstack((boxes, np.expand_dims(labels, axis=1)))
         return torch.from_numpy(img).permute(2, 0, 1), target, height, width
 
+    def image_sizes(self):
+        '''Returns the [N, 2] (height, width) of the images, in the order of
+        the dataset, from the index.
+        '''
+        return np.stack([self.index['height'], self.index['width']], axis=1)[self.ids]
+
     def pull_image(self, index):
-        '''Returns the original image object at index in PIL form
+        '''Returns the original image object at index in cv2 form
         Note: not using self.__getitem__(), as any transformations passed in
         could mess up this functionality.
         Argument:
@@ -147,9 +194,7 @@ class COCODetection(data.Dataset):
         Return:
             cv2 img
         '''
-        img_id = self.ids[index]
-        path = self.coco.loadImgs(img_id)[0]['file_name']
-        return cv2.imread(osp.join(self.root, path), cv2.IMREAD_COLOR)
+        return imread(self._imgpath % self.index['file_name'][self.ids[index]])
 
     def pull_anno(self, index):
         '''Returns the original annotation of image at index
@@ -158,19 +203,19 @@ class COCODetection(data.Dataset):
         Argument:
             index (int): index of img to get annotation of
         Return:
-            list:  [img_id, [(label, bbox coords),...]]
-                eg: ('001718', [('dog', (96, 13, 438, 332))])
+            list:  [img_id, [[xmin, ymin, xmax, ymax, label_ind], ...]] in pixels
         '''
-        img_id = self.ids[index]
-        ann_ids = self.coco.getAnnIds(imgIds=img_id)
-        return self.coco.loadAnns(ann_ids)
+        i = self.ids[index]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        scale = np.array([self.index['width'][i], self.index['height'][i]] * 2, dtype=np.float32)
+        target = self.targets[start:end].copy()
+        target[:, :4] *= scale
+        return int(self.index['image_id'][i]), target.tolist()
 
     def __repr__(self):
         fmt_str = 'Dataset ' + self.__class__.__name__ + '\n'
         fmt_str += '    Number of datapoints: {}\n'.format(self.__len__())
         fmt_str += '    Root Location: {}\n'.format(self.root)
         tmp = '    Transforms (if any): '
-        fmt_str += '{0}{1}\n'.format(tmp, self.transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
-        tmp = '    Target Transforms (if any): '
-        fmt_str += '{0}{1}'.format(tmp, self.target_transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
-        return fmt_str
\ No newline at end of file
+        fmt_str += '{0}{1}'.format(tmp, self.transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
+        return fmt_str
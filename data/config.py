@@ -1,5 +1,10 @@
 # config.py
+# Every entry point builds its models and datasets from the registries at the
+# end of this file. A json file named by the YOLO_CONFIG environment variable
+# overrides any of the values here, e.g. {"voc_af": {"max_epoch": 100},
+# "RUNTIME": {"num_workers": 4}}.
 import os.path
+import json
 
 
 # for making bounding boxes pretty
@@ -39,6 +44,84 @@ voc_ab = {
     'name': 'VOC',
 }
 
+# the same models on COCO
+coco_af = {
+    'num_classes': 80,
+    'lr_epoch': (100, 130, 150),
+    'max_epoch': 150,
+    'min_dim': [448, 448],
+    'scale_thresh':[[0, 0.046], [0.046, 0.227], [0.227, 1.0]], 
+    'clip': True,
+    'name': 'COCO',
+}
+
+coco_ab = {
+    'num_classes': 80,
+    'lr_epoch': (100, 130, 150),
+    'max_epoch': 150,
+    'min_dim': [416, 416],
+    'stride': 32,
+    'strides': [16, 32],
+    'clip': True,
+    'name': 'COCO',
+}
+
+# the models: the module of their class (imported when one is built), their
+# config on each dataset, whether they use the anchor boxes, and their backbones
+MODELS = {
+    'yolo_v1': {'module': 'models.yolo_v1', 'cfg': {'VOC': voc_af, 'COCO': coco_af},
+                'anchor': False, 'backbones': ('r18', 'r50', 'd19')},
+    'yolo_anchor': {'module': 'models.yolo_anchor', 'cfg': {'VOC': voc_ab, 'COCO': coco_ab},
+                    'anchor': True, 'backbones': ('r18', 'r50', 'd19')},
+    'yolo_v1_ms': {'module': 'models.yolo_v1_ms', 'cfg': {'VOC': voc_af, 'COCO': coco_af},
+                   'anchor': False, 'backbones': ('r18', 'd19')},
+}
+
+# the datasets and their default image sets
+DATASETS = {
+    'VOC': {'num_classes': 20,
+            'train_set': [['2007', 'trainval'], ['2012', 'trainval']],
+            'eval_set': [['2007', 'test']]},
+    'COCO': {'num_classes': 80,
+             'train_set': 'trainval35k',
+             'eval_set': 'val2017'},
+}
+
+# performance knobs every entry point starts from; the command line overrides them
+RUNTIME = {
+    'backbone': 'r18',
+    'batch_size': 64,           # training batch size
+    'num_workers': 8,           # DataLoader workers of training
+    'anno_workers': None,       # processes parsing the annotations (None: one per cpu, 0: serially)
+    'precision': 'fp32',        # fp32 or int8 (post-training quantization, cpu only)
+    'threads': None,            # intra-op threads on cpu (None: the tuned or torch default)
+    'interop_threads': None,    # inter-op threads on cpu
+}
+
+
+def get_cfg(version, dataset='VOC'):
+    """The config dict of a model version on a dataset."""
+    if version not in MODELS:
+        raise ValueError('Unknown version: {}'.format(version))
+    if dataset not in DATASETS:
+        raise ValueError('Unknown dataset: {}'.format(dataset))
+    return MODELS[version]['cfg'][dataset]
+
+
+def load_overrides(path):
+    """Update the values of this file from a json file: dicts are updated key by
+    key, anything else is replaced."""
+    with open(path, 'r') as f:
+        overrides = json.load(f)
+    for key, value in overrides.items():
+        if key not in globals():
+            raise KeyError('{}: unknown config {}'.format(path, key))
+        if isinstance(globals()[key], dict) and isinstance(value, dict):
+            globals()[key].update(value)
+        else:
+            globals()[key] = value
+
+
 imagenet = {
     'batch_size': 64,
     'resize': 448,
@@ -46,4 +129,8 @@ imagenet = {
     'lr': 1e-3,
     'data_path': "/home/k545/object-detection/myYOLO/backbone/imagenet/",
     'model_name': 'resnet18'
-}
\ No newline at end of file
+}
+
+
+if os.environ.get('YOLO_CONFIG'):
+    load_overrides(os.environ['YOLO_CONFIG'])
@@ -0,0 +1,109 @@
+"""Single-pass preprocessing of uint8 BGR images for inference.
+
+BaseTransform returns an HWC float image that callers still flip to RGB and
+permute. `Preprocess` resizes the uint8 image and then converts it to float,
+subtracts the mean, reorders the channels and changes the layout in one
+pass, written straight into a preallocated [3, H, W] buffer, or into row i of
+a [B, 3, H, W] tensor with `batch`. With `letterbox` the aspect ratio is kept
+and the border is padded with the mean; `to_image_boxes` maps the boxes of
+the model back to the original image in both modes.
+
+    preprocess = Preprocess(net.input_size, config.MEANS, letterbox=True)
+    x, meta = preprocess(img)
+    bboxes, scores, cls_inds = net(x.unsqueeze(0))
+    bboxes = preprocess.to_image_boxes(bboxes, meta)
+"""
+import numpy as np
+import torch
+from .sampler import fit_size
+
+
+class Preprocess(object):
+    def __init__(self, size, mean, letterbox=False, rgb=True):
+        """
+            Input:
+                size : list -> [H, W] input size of the model.
+                mean : tuple -> BGR mean, as for BaseTransform.
+                letterbox : bool -> keep the aspect ratio and pad instead of stretching.
+                rgb : bool -> output RGB channels, as the models are trained on.
+        """
+        self.size = size
+        self.letterbox = letterbox
+        self.rgb = rgb
+        mean = np.array(mean, dtype=np.float32)
+        self.mean = mean[::-1].copy() if rgb else mean
+
+    def _resize(self, image):
+        import cv2
+        h, w = image.shape[:2]
+        H, W = self.size
+        if not self.letterbox:
+            return cv2.resize(image, (W, H)), (W / w, H / h, 0, 0)
+        scale = min(H / h, W / w)
+        nh, nw = fit_size(h, w, self.size)
+        return cv2.resize(image, (nw, nh)), (scale, scale, (W - nw) // 2, (H - nh) // 2)
+
+    def fill(self, image, out):
+        """
+            Write the normalized image into `out`.
+            Input:
+                image : ndarray -> [h, w, 3] uint8 BGR image.
+                out : ndarray -> [3, H, W] float32 array, may be strided (e.g. a channels_last view).
+            Output:
+                meta : tuple -> (scale_x, scale_y, pad_left, pad_top, w, h) for to_image_boxes.
+        """
+        h, w = image.shape[:2]
+        resized, (sx, sy, left, top) = self._resize(image)
+        nh, nw = resized.shape[:2]
+        dst = out.transpose(1, 2, 0)
+        if self.letterbox:
+            # the padding is the mean, i.e. 0 after normalization
+            dst[:top] = 0.
+            dst[top + nh:] = 0.
+            dst[top:top + nh, :left] = 0.
+            dst[top:top + nh, left + nw:] = 0.
+            dst = dst[top:top + nh, left:left + nw]
+        src = resized[:, :, ::-1] if self.rgb else resized
+        np.subtract(src, self.mean, out=dst)
+        return sx, sy, left, top, w, h
+
+    def __call__(self, image, channels_last=False):
+        """
+            Output:
+                x : tensor -> [3, H, W] float32, channels_last strided if asked for.
+                meta : tuple -> see fill.
+        """
+        H, W = self.size
+        if channels_last:
+            buf = np.empty((H, W, 3), dtype=np.float32)
+            meta = self.fill(image, buf.transpose(2, 0, 1))
+            return torch.from_numpy(buf).permute(2, 0, 1), meta
+        buf = np.empty((3, H, W), dtype=np.float32)
+        meta = self.fill(image, buf)
+        return torch.from_numpy(buf), meta
+
+    def batch(self, images, out=None, channels_last=False):
+        """
+            Fill a [B, 3, H, W] tensor with `images`, in place if `out` is given.
+            Output:
+                out : tensor -> [B, 3, H, W] float32.
+                metas : list -> meta of every image.
+        """
+        H, W = self.size
+        if out is None:
+            memory_format = torch.channels_last if channels_last else torch.contiguous_format
+            out = torch.empty(len(images), 3, H, W, memory_format=memory_format)
+        array = out.numpy()
+        metas = [self.fill(image, array[i]) for i, image in enumerate(images)]
+        return out, metas
+
+    def to_image_boxes(self, bboxes, meta):
+        """Map [N, 4] boxes normalized to the model input, as the models return them,
+        to pixels of the original image, clipped to it."""
+        sx, sy, left, top, w, h = meta
+        H, W = self.size
+        boxes = bboxes * np.array([W, H, W, H]) - np.array([left, top, left, top])
+        boxes = boxes / np.array([sx, sy, sx, sy])
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0., w - 1)
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0., h - 1)
+        return boxes
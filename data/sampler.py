@@ -0,0 +1,126 @@
+"""Aspect-ratio grouped batches of rectangular, letterboxed images.
+
+Instead of stretching every image to the square input size, the images are
+resized to fit in it with their aspect ratio kept (fit_size), and a batch is
+padded to the smallest multiple of the stride that holds all of its images
+(pad_batch). The models are fully convolutional and build their grids per
+input size, so they run on these shapes as they are.
+
+To keep the padding small, GroupedBatchSampler only batches images of similar
+aspect ratio, read from the image sizes of the annotation index of the
+dataset (image_sizes), so no image is opened for it. The padding is at the
+right and the bottom, and is 0, i.e. the mean after normalization.
+
+    sampler = GroupedBatchSampler(dataset.image_sizes(), 32, shuffle=True)
+    loader = data.DataLoader(dataset, batch_sampler=sampler, collate_fn=RectCollate(32))
+"""
+import numpy as np
+import torch
+
+
+def fit_size(height, width, size):
+    """(h, w) of an image of `height` x `width` resized to fit in `size` [H, W] with its aspect ratio kept."""
+    H, W = size
+    scale = min(H / height, W / width)
+    return min(int(round(height * scale)), H), min(int(round(width * scale)), W)
+
+
+def group_ids(sizes, num_groups=3):
+    """
+        Input:
+            sizes : ndarray -> [N, 2] (height, width) of the images.
+            num_groups : int -> groups on each side of the square, by log2 of the
+                         height / width ratio between 1/2 and 2.
+        Output:
+            groups : ndarray -> [N,] group of every image.
+    """
+    bins = 2. ** np.linspace(-1, 1, 2 * num_groups + 1)
+    return np.digitize(sizes[:, 0] / sizes[:, 1], bins)
+
+
+class GroupedBatchSampler(object):
+    """Batches of the indices of images with a similar aspect ratio.
+
+    With `shuffle` the images are drawn in a random order (from `generator`)
+    and a batch is yielded as soon as one of the groups holds `batch_size` of
+    them; the rest of every group ends the epoch as smaller batches, unless
+    `drop_last`. Without it, the images are sorted by aspect ratio and cut
+    into batches in that order, which gives the tightest shapes for evaluation.
+    """
+
+    def __init__(self, sizes, batch_size, shuffle=True, drop_last=False, generator=None, num_groups=3):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        self.ratios = sizes[:, 0] / sizes[:, 1]
+        self.groups = group_ids(sizes, num_groups)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __iter__(self):
+        if not self.shuffle:
+            order = np.argsort(self.ratios, kind='mergesort')
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    yield batch.tolist()
+            return
+        buffers = {}
+        for i in torch.randperm(len(self.groups), generator=self.generator).tolist():
+            buffer = buffers.setdefault(self.groups[i], [])
+            buffer.append(i)
+            if len(buffer) == self.batch_size:
+                yield buffer
+                buffers[self.groups[i]] = []
+        if not self.drop_last:
+            for group in sorted(buffers):
+                if buffers[group]:
+                    yield buffers[group]
+
+    def __len__(self):
+        if not self.shuffle:
+            counts = [len(self.ratios)]
+        else:
+            counts = np.bincount(self.groups)
+        if self.drop_last:
+            return int(sum(c // self.batch_size for c in counts))
+        return int(sum((c + self.batch_size - 1) // self.batch_size for c in counts))
+
+
+def pad_batch(images, stride=32):
+    """
+        Input:
+            images : list -> [3, h, w] tensors, of any size.
+            stride : int -> the largest stride of the model.
+        Output:
+            x : tensor -> [B, 3, H, W], H and W the smallest multiples of `stride`
+                that hold every image, each image at the top left.
+            sizes : list -> (h, w) of every image.
+    """
+    sizes = [tuple(im.shape[-2:]) for im in images]
+    H = -(-max(h for h, _ in sizes) // stride) * stride
+    W = -(-max(w for _, w in sizes) // stride) * stride
+    x = images[0].new_zeros(len(images), 3, H, W)
+    for i, im in enumerate(images):
+        x[i, :, :im.shape[1], :im.shape[2]] = im
+    return x, sizes
+
+
+class RectCollate(object):
+    """Collate fn of the training images resized with the aspect ratio kept: pads
+    them to one shape with pad_batch and maps their boxes, normalized to the
+    image, to that shape. Otherwise like detection_collate."""
+
+    def __init__(self, stride=32):
+        self.stride = stride
+
+    def __call__(self, batch):
+        images, sizes = pad_batch([sample[0] for sample in batch], self.stride)
+        H, W = images.shape[-2:]
+        targets = []
+        for (_, target), (h, w) in zip(batch, sizes):
+            target = torch.FloatTensor(target)
+            if len(target):
+                target[:, :4] *= torch.tensor([w / W, h / H, w / W, h / H])
+            targets.append(target)
+        return images, targets
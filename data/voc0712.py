@@ -9,8 +9,8 @@ import os.path as osp
 import sys
 import torch
 import torch.utils.data as data
-import cv2
 import numpy as np
+from .anno_cache import load_annotations
 if sys.version_info[0] == 2:
     import xml.etree.cElementTree as ET
 else:
@@ -28,6 +28,12 @@ path_to_dir = osp.dirname(osp.abspath(__file__))
 VOC_ROOT = path_to_dir + "/VOCdevkit/"
 
 
+def imread(path):
+    # cv2 is only needed once images are read
+    import cv2
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+
 class VOCAnnotationTransform(object):
     """Transforms a VOC annotation into a Tensor of bbox coords and label index
     Initilized with a dictionary lookup of classnames to indexes
@@ -123,7 +129,7 @@ class VOCDetection(data.Dataset):
         img_id = self.ids[index]
 
         target = ET.parse(self._annopath % img_id).getroot()
-        img = cv2.imread(self._imgpath % img_id)
+        img = imread(self._imgpath % img_id)
         height, width, channels = img.shape
 
         if self.target_transform is not None:
@@ -139,6 +145,20 @@ class VOCDetection(data.Dataset):
         return torch.from_numpy(img).permute(2, 0, 1), target, height, width
         # return torch.from_numpy(img), target, height, width
 
+    def image_sizes(self, num_workers=None):
+        '''Returns the [N, 2] (height, width) of the images, in the order of
+        the dataset, from the annotation cache of each image set (built on a
+        miss, as for the evaluation), so no image is opened.
+        '''
+        sizes = []
+        for (year, name) in self.image_set:
+            rootpath = osp.join(self.root, 'VOC' + year)
+            columns = load_annotations(osp.join(rootpath, 'Annotations', '%s.xml'),
+                                       osp.join(rootpath, 'ImageSets', 'Main', name + '.txt'),
+                                       osp.join(rootpath, 'annotations_cache'), num_workers)
+            sizes.append(columns['size'])
+        return np.concatenate(sizes)
+
     def pull_image(self, index):
         '''Returns the original image object at index in PIL form
 
@@ -151,7 +171,7 @@ class VOCDetection(data.Dataset):
             PIL img
         '''
         img_id = self.ids[index]
-        return cv2.imread(self._imgpath % img_id, cv2.IMREAD_COLOR)
+        return imread(self._imgpath % img_id)
 
     def pull_anno(self, index):
         '''Returns the original annotation of image at index
@@ -8,9 +8,20 @@ from __future__ import print_function
 import torch
 import torch.nn as nn
 import torch.backends.cudnn as cudnn
-from torch.autograd import Variable
-from data import VOC_ROOT, VOCAnnotationTransform, VOCDetection, BaseTransform, config
+from data import VOC_ROOT, BaseTransform, config, build_dataset, GroupedBatchSampler, pad_batch
 from data import VOC_CLASSES as labelmap
+from data import COCO_ROOT, COCO_CLASSES
+from models.factory import build_model
+from data.anno_cache import load_annotations, class_records
+from utils.fold_bn import fold_bn
+from utils.checkpoint import load_weights
+from utils.quantize import quantize_detector, calibration_inputs
+from utils.cpu_mode import setup_cpu
+from utils.tta import TTA, tta_sizes
+from utils.nms import NMS_TYPES
+from utils.coco_eval import coco_eval
+from utils.detect import detect_batch
+from utils import profiler
 import torch.utils.data as data
 import sys
 import os
@@ -20,11 +31,6 @@ import numpy as np
 import pickle
 import cv2
 
-if sys.version_info[0] == 2:
-    import xml.etree.cElementTree as ET
-else:
-    import xml.etree.ElementTree as ET
-
 
 def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
@@ -34,7 +40,9 @@ parser = argparse.ArgumentParser(
     description='Single Shot MultiBox Detector Evaluation')
 parser.add_argument('-v', '--version', default='yolo_v1',
                     help='yolo_v1, yolo_anchor, yolo_v1_ms.')
-parser.add_argument('-d', '--dataset', default='VOC',
+parser.add_argument('-bk', '--backbone', default=config.RUNTIME['backbone'], type=str,
+                    help='r18, r50 or d19')
+parser.add_argument('-d', '--dataset', default='VOC', choices=list(config.DATASETS),
                     help='VOC or COCO dataset')
 parser.add_argument('--trained_model',
                     default='weights_yolo_v1/resnet-18/yolo_v1_VOC_250.pth', type=str,
@@ -44,15 +52,52 @@ parser.add_argument('--save_folder', default='eval/', type=str,
 parser.add_argument('--confidence_threshold', default=0.01, type=float,
                     help='Detection confidence threshold')
 parser.add_argument('--top_k', default=200, type=int,
-                    help='Further restrict the number of predictions to parse')
+                    help='Candidates decoded per image, by score, before thresholding and NMS (0: all)')
 parser.add_argument('--cuda', default=True, type=str2bool,
                     help='Use cuda to train model')
 parser.add_argument('--voc_root', default=VOC_ROOT,
                     help='Location of VOC root directory')
+parser.add_argument('--coco_root', default=COCO_ROOT,
+                    help='Location of COCO root directory')
+parser.add_argument('--coco_set', default=config.DATASETS['COCO']['eval_set'], type=str,
+                    help='COCO image set to evaluate on')
 parser.add_argument('--cleanup', default=True, type=str2bool,
                     help='Cleanup and remove results files following eval')
+parser.add_argument('--fold_bn', default=False, type=str2bool,
+                    help='Fold BatchNorm into the convolutions before inference')
+parser.add_argument('--quantize', default=False, type=str2bool,
+                    help='Evaluate the int8 post-training quantized model (cpu only)')
+parser.add_argument('--calib_images', default=100, type=int,
+                    help='Number of VOC2007 trainval images to calibrate the quantized model on')
+parser.add_argument('--cpu_mode', default=False, type=str2bool,
+                    help='Run on cpu with channels_last and tuned threads (see tune_cpu.py)')
+parser.add_argument('--threads', default=config.RUNTIME['threads'], type=int,
+                    help='Intra-op threads in cpu mode (default: the tuned or torch default)')
+parser.add_argument('--interop_threads', default=config.RUNTIME['interop_threads'], type=int,
+                    help='Inter-op threads in cpu mode')
+parser.add_argument('--tta', default=False, type=str2bool,
+                    help='Test-time augmentation: several resolutions and the flipped image')
+parser.add_argument('--tta_scales', default=[0.75, 1.0, 1.25], type=float, nargs='+',
+                    help='Resolutions of the TTA, relative to the input size of the model')
+parser.add_argument('--tta_flip', default=True, type=str2bool,
+                    help='Also run the horizontally flipped image in TTA')
+parser.add_argument('--tta_merge', default='wbf', type=str,
+                    help='How the TTA views are merged: wbf or nms')
+parser.add_argument('--batch_size', default=1, type=int,
+                    help='Images per forward (not with --tta)')
+parser.add_argument('--rect', default=False, type=str2bool,
+                    help='Keep the aspect ratio of the images and batch those of similar ratio in rectangular shapes')
+parser.add_argument('--num_workers', default=config.RUNTIME['anno_workers'], type=int,
+                    help='Processes used to parse annotations (0: parse serially)')
+parser.add_argument('--nms', default='nms', choices=NMS_TYPES,
+                    help='Suppression of the postprocess: ' + ', '.join(NMS_TYPES))
 
 args = parser.parse_args()
+if args.dataset == 'COCO':
+    labelmap = COCO_CLASSES
+if args.quantize or args.cpu_mode:
+    # both run on cpu: quantized kernels have no cuda backend
+    args.cuda = False
 if args.cuda:
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 else:
@@ -85,21 +130,27 @@ imgsetpath = os.path.join(args.voc_root, 'VOC2007', 'ImageSets', 'Main', set_typ
 
 
 class Timer(object):
-    """A simple timer."""
-    def __init__(self):
+    """A simple timer. With `sync`, pending cuda work is waited for at tic
+    and toc so the measured time is device time rather than launch time."""
+    def __init__(self, sync=False):
         self.total_time = 0.
         self.calls = 0
         self.start_time = 0.
         self.diff = 0.
         self.average_time = 0.
+        self.sync = sync
 
     def tic(self):
-        # using time.time instead of time.clock because time time.clock
+        # using perf_counter instead of time.clock because time.clock
         # does not normalize for multithreading
-        self.start_time = time.time()
+        if self.sync:
+            torch.cuda.synchronize()
+        self.start_time = time.perf_counter()
 
     def toc(self, average=True):
-        self.diff = time.time() - self.start_time
+        if self.sync:
+            torch.cuda.synchronize()
+        self.diff = time.perf_counter() - self.start_time
         self.total_time += self.diff
         self.calls += 1
         self.average_time = self.total_time / self.calls
@@ -109,26 +160,6 @@ class Timer(object):
             return self.diff
 
 
-def parse_rec(filename):
-    """ Parse a PASCAL VOC xml file """
-    tree = ET.parse(filename)
-    objects = []
-    for obj in tree.findall('object'):
-        obj_struct = {}
-        obj_struct['name'] = obj.find('name').text
-        obj_struct['pose'] = obj.find('pose').text
-        obj_struct['truncated'] = int(obj.find('truncated').text)
-        obj_struct['difficult'] = int(obj.find('difficult').text)
-        bbox = obj.find('bndbox')
-        obj_struct['bbox'] = [int(bbox.find('xmin').text),
-                              int(bbox.find('ymin').text),
-                              int(bbox.find('xmax').text),
-                              int(bbox.find('ymax').text)]
-        objects.append(obj_struct)
-
-    return objects
-
-
 def get_output_dir(name, phase):
     """Return the directory where experimental artifacts are placed.
     If the directory does not exist, it is created.
@@ -158,7 +189,7 @@ def write_voc_results_file(all_boxes, dataset):
         with open(filename, 'wt') as f:
             for im_ind, index in enumerate(dataset.ids):
                 dets = all_boxes[cls_ind][im_ind]
-                if dets == []:
+                if len(dets) == 0:
                     continue
                 # the VOCdevkit expects 1-based indices
                 for k in range(dets.shape[0]):
@@ -180,12 +211,14 @@ def do_python_eval(output_dir='output', use_07=True):
         filename = get_voc_results_file_template(set_type, cls)
         rec, prec, ap = voc_eval(
            filename, annopath, imgsetpath, cls, cachedir,
-           ovthresh=0.5, use_07_metric=use_07_metric)
+           ovthresh=0.5, use_07_metric=use_07_metric,
+           num_workers=args.num_workers)
         aps += [ap]
         print('AP for {} = {:.4f}'.format(cls, ap))
         with open(os.path.join(output_dir, cls + '_pr.pkl'), 'wb') as f:
             pickle.dump({'rec': rec, 'prec': prec, 'ap': ap}, f)
     print('Mean AP = {:.4f}'.format(np.mean(aps)))
+    print('NMS: {:s}'.format(args.nms))
     print('~~~~~~~~')
     print('Results:')
     for ap in aps:
@@ -239,43 +272,13 @@ def voc_eval(detpath,
              classname,
              cachedir,
              ovthresh=0.5,
-             use_07_metric=True):
-    if not os.path.isdir(cachedir):
-        os.mkdir(cachedir)
-    cachefile = os.path.join(cachedir, 'annots.pkl')
-    # read list of images
-    with open(imagesetfile, 'r') as f:
-        lines = f.readlines()
-    imagenames = [x.strip() for x in lines]
-    if not os.path.isfile(cachefile):
-        # load annots
-        recs = {}
-        for i, imagename in enumerate(imagenames):
-            recs[imagename] = parse_rec(annopath % (imagename))
-            if i % 100 == 0:
-                print('Reading annotation for {:d}/{:d}'.format(
-                   i + 1, len(imagenames)))
-        # save
-        print('Saving cached annotations to {:s}'.format(cachefile))
-        with open(cachefile, 'wb') as f:
-            pickle.dump(recs, f)
-    else:
-        # load
-        with open(cachefile, 'rb') as f:
-            recs = pickle.load(f)
+             use_07_metric=True,
+             num_workers=None):
+    # the cache is keyed by the image set and the annotation mtimes
+    annots = load_annotations(annopath, imagesetfile, cachedir, num_workers)
 
     # extract gt objects for this class
-    class_recs = {}
-    npos = 0
-    for imagename in imagenames:
-        R = [obj for obj in recs[imagename] if obj['name'] == classname]
-        bbox = np.array([x['bbox'] for x in R])
-        difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-        det = [False] * len(R)
-        npos = npos + sum(~difficult)
-        class_recs[imagename] = {'bbox': bbox,
-                                 'difficult': difficult,
-                                 'det': det}
+    class_recs, npos = class_records(annots, classname)
 
     # read dets
     detfile = detpath.format(classname)
@@ -346,8 +349,15 @@ def voc_eval(detpath,
     return rec, prec, ap
 
 
-def test_net(save_folder, net, cuda, dataset, transform, top_k, thresh=0.05):
+def test_net(save_folder, net, cuda, dataset, transform, top_k, thresh=0.05, channels_last=False, tta=None,
+             batches=None):
+    """`batches` lists the indices of the images run together, padded to one shape
+    with pad_batch. By default the images are run one by one, as they are."""
     num_images = len(dataset)
+    pad = batches is not None
+    if batches is None:
+        batches = [[i] for i in range(num_images)]
+    stride = int(np.max(net.stride))
     # all detections are collected into:
     #    all_boxes[cls][image] = N x 5 array of detections in
     #    (x1, y1, x2, y2, score)
@@ -355,38 +365,77 @@ def test_net(save_folder, net, cuda, dataset, transform, top_k, thresh=0.05):
                  for _ in range(len(labelmap))]
 
     # timers
-    _t = {'im_detect': Timer(), 'misc': Timer()}
+    sync = device.type == 'cuda'
+    _t = {'im_detect': Timer(sync), 'misc': Timer(sync)}
     output_dir = get_output_dir('eval/', set_type)
     det_file = os.path.join(output_dir, 'detections.pkl')
 
-    for i in range(num_images):
-        im, gt, h, w = dataset.pull_item(i)
-
-        x = Variable(im.unsqueeze(0)).to(device)
-        if args.cuda:
+    # time the postprocess (thresholding + suppression) and its nms over all images
+    profiler.reset()
+    profiler.enable()
+    done = 0
+    for batch in batches:
+        if tta is not None:
+            img = dataset.pull_image(batch[0])
+            h, w = img.shape[:2]
+            _t['im_detect'].tic()
+            detections = [tta(img)]
+            detect_time = _t['im_detect'].toc(average=False)
+            image_sizes = [(h, w)]
+            scales = [np.array([[w, h, w, h]])]
+        else:
+            items = [dataset.pull_item(i) for i in batch]
+            if pad:
+                x, sizes = pad_batch([im for im, _, _, _ in items], stride)
+            else:
+                # one image of the input size, run as it is without padding
+                x = items[0][0].unsqueeze(0)
+                sizes = [tuple(x.shape[-2:])]
+            if channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
             x = x.to(device)
-        _t['im_detect'].tic()
-        detections = net(x)
-        detect_time = _t['im_detect'].toc(average=False)
-        bboxes, scores, cls_inds = detections
-        scale = np.array([[w, h, w, h]])
-        bboxes *= scale
-
-        for j in range(len(labelmap)):
-            inds = np.where(cls_inds == j)[0]
-            if len(inds) == 0:
-                all_boxes[j][i] = np.empty([0, 5], dtype=np.float32)
-                continue
-            c_bboxes = bboxes[inds]
-            c_scores = scores[inds]
-            c_dets = np.hstack((c_bboxes,
-                                c_scores[:, np.newaxis])).astype(np.float32,
-                                                                copy=False)
-            all_boxes[j][i] = c_dets
-
-        print('im_detect: {:d}/{:d} {:.3f}s'.format(i + 1,
+            H, W = x.shape[-2:]
+            if [H, W] != list(net.input_size):
+                # a rectangular batch, the grids are cached per shape
+                net.set_input_size([H, W])
+            _t['im_detect'].tic()
+            detections = [net(x)] if len(batch) == 1 else detect_batch(net, x)
+            detect_time = _t['im_detect'].toc(average=False)
+            # the boxes are normalized to the batch, each image is its top left
+            # h x w, resized from the original height x width
+            image_sizes = [(height, width) for _, _, height, width in items]
+            scales = [np.array([[W * width / w, H * height / h, W * width / w, H * height / h]])
+                      for (height, width), (h, w) in zip(image_sizes, sizes)]
+
+        for i, (bboxes, scores, cls_inds), scale, (h, w) in zip(batch, detections, scales, image_sizes):
+            bboxes *= scale
+            # clip what reaches into the padding of a rectangular batch
+            np.clip(bboxes[:, 0::2], 0., w, out=bboxes[:, 0::2])
+            np.clip(bboxes[:, 1::2], 0., h, out=bboxes[:, 1::2])
+
+            for j in range(len(labelmap)):
+                inds = np.where(cls_inds == j)[0]
+                if len(inds) == 0:
+                    all_boxes[j][i] = np.empty([0, 5], dtype=np.float32)
+                    continue
+                c_bboxes = bboxes[inds]
+                c_scores = scores[inds]
+                c_dets = np.hstack((c_bboxes,
+                                    c_scores[:, np.newaxis])).astype(np.float32,
+                                                                    copy=False)
+                all_boxes[j][i] = c_dets
+
+        done += len(batch)
+        print('im_detect: {:d}/{:d} {:.3f}s'.format(done,
                                                     num_images, detect_time))
 
+    totals = profiler.stage_totals()
+    if 'nms' in totals:
+        print('NMS {:s}: {:.3f}ms per image, postprocess {:.3f}ms per image, im_detect {:.3f}ms per image'.format(
+            args.nms, totals['nms']['ms'] / num_images, totals['postprocess']['ms'] / num_images,
+            1000. * _t['im_detect'].total_time / num_images))
+    profiler.disable()
+
     with open(det_file, 'wb') as f:
         pickle.dump(all_boxes, f, pickle.HIGHEST_PROTOCOL)
 
@@ -395,47 +444,72 @@ def test_net(save_folder, net, cuda, dataset, transform, top_k, thresh=0.05):
 
 
 def evaluate_detections(box_list, output_dir, dataset):
+    if args.dataset == 'COCO':
+        do_coco_eval(box_list, dataset)
+        return
     write_voc_results_file(box_list, dataset)
     do_python_eval(output_dir)
 
 
+def do_coco_eval(box_list, dataset):
+    stats = coco_eval(box_list, dataset.index, dataset.ids)
+    print('AP@[.5:.95] = {:.4f}'.format(stats['AP']))
+    print('AP@.5 = {:.4f}, AP@.75 = {:.4f}'.format(stats['AP50'], stats['AP75']))
+    print('AP small = {:.4f}, medium = {:.4f}, large = {:.4f}'.format(stats['APs'], stats['APm'], stats['APl']))
+    print('AR@100 = {:.4f}'.format(stats['AR100']))
+    # the COCO metric, AP@[.5:.95], is the one reported as the mean AP
+    print('Mean AP = {:.4f}'.format(stats['AP']))
+    print('NMS: {:s}'.format(args.nms))
+
+
 if __name__ == '__main__':
     num_classes = len(labelmap)
 
-    if args.version == 'yolo_v1':
-        from models.yolo_v1 import myYOLOv1
-        cfg = config.voc_af
-        net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=num_classes, conf_thresh=0.01, trainable=False).to(device)
-        print('Let us test yolo-v1 on the VOC0712 dataset ......')
-    
-    elif args.version == 'yolo_anchor':
-        from models.yolo_anchor import myYOLOv1
-        cfg = config.voc_ab
-        net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=num_classes, conf_thresh=0.01, trainable=False, anchor_size=config.ANCHOR_SIZE).to(device)
-        print('Let us test yolo-anchor on the VOC0712 dataset ......')
-        
-    elif args.version == 'yolo_v1_ms':
-        from models.yolo_v1_ms import myYOLOv1
-        cfg = config.voc_af
-        net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=num_classes, conf_thresh=0.0, trainable=False)
-        print('Let us test yolo-v1-ms on the VOC0712 dataset ......')
-    
-    else:
-        print('Unknown Version !!!')
-        exit()
+    net, cfg = build_model(args.version, device, args.dataset, backbone=args.backbone,
+                           num_classes=num_classes, conf_thresh=args.confidence_threshold)
+    net = net.to(device)
+    print('Let us test {} on the {} dataset ......'.format(args.version, args.dataset))
 
     # load net
-    net.load_state_dict(torch.load(args.trained_model))
+    load_weights(net, args.trained_model, device)
     net.eval()
+    net.nms_type = args.nms
+    net.top_k = args.top_k
+    if args.fold_bn:
+        net = fold_bn(net)
+    if args.quantize:
+        if args.dataset == 'COCO':
+            # the train sets of COCO are not always there, calibrate on the first images of the eval set
+            calibset = build_dataset('COCO', train=False, root=args.coco_root, image_set=args.coco_set,
+                                     transform=BaseTransform(net.input_size, dataset_mean))
+        else:
+            calibset = build_dataset('VOC', train=False, root=args.voc_root, image_set=[('2007', 'trainval')],
+                                     transform=BaseTransform(net.input_size, dataset_mean))
+        net = quantize_detector(net, calibration_inputs(calibset, args.calib_images))
     print('Finished loading model!')
     # load data
-    dataset = VOCDetection(args.voc_root, [('2007', set_type)],
-                           BaseTransform(net.input_size, dataset_mean),
-                           VOCAnnotationTransform())
+    dataset = build_dataset(args.dataset, train=False,
+                            root=args.coco_root if args.dataset == 'COCO' else args.voc_root,
+                            image_set=args.coco_set if args.dataset == 'COCO' else [('2007', set_type)],
+                            transform=BaseTransform(net.input_size, dataset_mean, keep_ratio=args.rect))
     if args.cuda:
         net = net.to(device)
         cudnn.benchmark = True
+    channels_last = False
+    if args.cpu_mode:
+        net, channels_last = setup_cpu(net, args.version, args.backbone, args.threads, args.interop_threads)
+    tta = None
+    batches = None
+    if args.tta:
+        tta = TTA(net, tta_sizes(net.input_size, args.tta_scales), flip=args.tta_flip,
+                  merge=args.tta_merge, mean=dataset_mean)
+    elif args.rect:
+        # sorted by aspect ratio, so a batch is padded as little as possible
+        batches = list(GroupedBatchSampler(dataset.image_sizes(), args.batch_size, shuffle=False))
+    elif args.batch_size > 1:
+        batches = [list(range(i, min(i + args.batch_size, len(dataset))))
+                   for i in range(0, len(dataset), args.batch_size)]
     # evaluation
     test_net(args.save_folder, net, args.cuda, dataset,
              BaseTransform(net.input_size, dataset_mean), args.top_k,
-             thresh=args.confidence_threshold)
+             thresh=args.confidence_threshold, channels_last=channels_last, tta=tta, batches=batches)
@@ -0,0 +1,71 @@
+"""Export a trained detector, postprocess included, to TorchScript and ONNX.
+
+    python export.py -v yolo_v1 -bk r18 --trained_model weights/yolo_v1_250.pth --check 5
+"""
+import os
+import argparse
+import torch
+from data import config, VOC_CLASSES
+from utils.export import export_torchscript, export_onnx, check_parity
+from utils.checkpoint import load_weights
+from utils.fold_bn import fold_bn
+from models.factory import build_model
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Detection Export')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbone', type=str, default=config.RUNTIME['backbone'],
+                    help='r18, r50, d19')
+parser.add_argument('--trained_model', default='weights_yolo_v1/resnet-18/yolo_v1_VOC_250.pth',
+                    type=str, help='Trained state_dict file path to open')
+parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'],
+                    help='torchscript, onnx')
+parser.add_argument('--output_dir', default='export/', type=str,
+                    help='Directory the exported models are written to')
+parser.add_argument('--fold_bn', action='store_true', default=False,
+                    help='Fold BatchNorm into the convolutions before exporting')
+parser.add_argument('--opset', default=11, type=int,
+                    help='ONNX opset version')
+parser.add_argument('--check', default=0, type=int,
+                    help='Compare the exported models with the eager one on N random inputs')
+
+args = parser.parse_args()
+
+
+def main():
+    # export on cpu, so the traced constants (grids, anchors) live on the host
+    device = torch.device('cpu')
+    num_classes = len(VOC_CLASSES)
+
+    net, cfg = build_model(args.version, device, 'VOC', backbone=args.backbone,
+                           num_classes=num_classes, conf_thresh=0.01)
+
+    load_weights(net, args.trained_model, device)
+    net.eval()
+    if args.fold_bn:
+        net = fold_bn(net)
+    print('Finished loading model!')
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    name = os.path.join(args.output_dir, args.version + '_' + args.backbone)
+    torchscript_path, onnx_path = None, None
+    if 'torchscript' in args.formats:
+        torchscript_path = name + '.pt'
+        export_torchscript(net, torchscript_path)
+    if 'onnx' in args.formats:
+        onnx_path = name + '.onnx'
+        export_onnx(net, onnx_path, opset_version=args.opset)
+
+    if args.check > 0:
+        h, w = net.input_size
+        inputs = [torch.randn(1, 3, h, w) for _ in range(args.check)]
+        if check_parity(net, inputs, torchscript_path, onnx_path):
+            print('The exported models match the eager model.')
+        else:
+            print('WARNING: the exported models differ from the eager model!')
+
+
+if __name__ == '__main__':
+    main()
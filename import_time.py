@@ -0,0 +1,90 @@
+"""Import time of the model and data packages, and a guard on what they import.
+
+Every run imports torch and then the packages in a fresh interpreter with
+`-X importtime`, and reports the time spent on the packages beyond torch
+itself and the slowest modules they pulled in. It exits with an error when
+a heavy package (cv2, torchvision, matplotlib, ...) gets imported at module
+load, or when the median time beyond torch exceeds --budget_ms, so a new
+top-level import in a model or in data/ cannot slip into the cold start.
+
+    python import_time.py
+    python import_time.py --modules models.yolo_anchor data --budget_ms 300
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+parser = argparse.ArgumentParser(description='Import time guard')
+parser.add_argument('--modules', nargs='+',
+                    default=['models.yolo_v1', 'models.yolo_anchor', 'models.yolo_v1_ms', 'data', 'backbone'],
+                    help='Modules to import')
+parser.add_argument('--forbidden', nargs='+',
+                    default=['cv2', 'torchvision', 'matplotlib', 'PIL', 'scipy', 'thop', 'onnx', 'onnxruntime', 'tools'],
+                    help='Packages the modules must not import at load time')
+parser.add_argument('--budget_ms', type=float, default=200.,
+                    help='Maximum median import time beyond torch')
+parser.add_argument('--runs', type=int, default=5,
+                    help='Fresh interpreters to time')
+parser.add_argument('--top', type=int, default=10,
+                    help='Slowest modules to list')
+
+args = parser.parse_args()
+
+CHILD = '''
+import sys, time, json, importlib
+import torch
+before = set(sys.modules)
+t0 = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+ms = (time.perf_counter() - t0) * 1000.
+print(json.dumps({'ms': ms, 'new': sorted(set(sys.modules) - before)}))
+'''
+
+
+def run_once():
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD] + args.modules,
+                          cwd=os.path.dirname(os.path.abspath(__file__)),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    # "import time: self [us] | cumulative | imported package"
+    self_us = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        self_us[fields[2].strip()] = int(fields[0])
+    result['self_ms'] = {name: self_us.get(name, 0) / 1000. for name in result['new']}
+    return result
+
+
+def main():
+    runs = [run_once() for _ in range(args.runs)]
+    times = sorted(r['ms'] for r in runs)
+    median = times[len(times) // 2]
+    new = runs[-1]['new']
+    print('Imported {:s} in {:.1f}ms beyond torch (median of {:d}, max {:.1f}ms), {:d} new modules'.format(
+        ', '.join(args.modules), median, len(runs), times[-1], len(new)))
+    slowest = sorted(runs[-1]['self_ms'].items(), key=lambda kv: -kv[1])[:args.top]
+    for name, ms in slowest:
+        print('    {:<40s}{:>8.1f}ms'.format(name, ms))
+
+    failed = False
+    heavy = sorted(m for m in new if m.split('.')[0] in args.forbidden)
+    if heavy:
+        print('FAILED: heavy packages imported at load time: ' +
+              ', '.join(sorted(set(m.split('.')[0] for m in heavy))))
+        failed = True
+    if median > args.budget_ms:
+        print('FAILED: {:.1f}ms beyond torch is over the budget of {:.1f}ms'.format(median, args.budget_ms))
+        failed = True
+    if not failed:
+        print('ok')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Load generator for serve.py.
+
+Keeps `--concurrency` requests in flight against the server for `--requests`
+requests in total and reports the throughput and the p50/p95/p99 latency, plus
+the batch sizes the server formed (from GET /stats).
+
+    python loadgen.py --url http://127.0.0.1:8000 --concurrency 16 --requests 500 --image_dir images/
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+import numpy as np
+import cv2
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Server Load Generator')
+parser.add_argument('--url', type=str, default='http://127.0.0.1:8000',
+                    help='Address of serve.py')
+parser.add_argument('--concurrency', type=int, default=8,
+                    help='Requests in flight at any time')
+parser.add_argument('--requests', type=int, default=200,
+                    help='Total number of requests')
+parser.add_argument('--image_dir', type=str, default=None,
+                    help='Directory of images to post (default: random 500x375 jpgs)')
+parser.add_argument('--output', type=str, default=None,
+                    help='Optional JSON file the results are written to')
+
+args = parser.parse_args()
+
+
+def load_images(image_dir, num_random=16):
+    """Encoded images to post, read from `image_dir` or generated."""
+    if image_dir is not None:
+        names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        images = []
+        for name in names:
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                images.append(f.read())
+        return images
+    rng = np.random.RandomState(0)
+    return [cv2.imencode('.jpg', rng.randint(0, 256, (375, 500, 3), dtype=np.uint8))[1].tobytes()
+            for _ in range(num_random)]
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def worker(images, counter, lock, latencies, errors):
+    url = args.url + '/detect'
+    while True:
+        with lock:
+            i = counter[0]
+            if i >= args.requests:
+                return
+            counter[0] += 1
+        t0 = time.perf_counter()
+        try:
+            post(url, images[i % len(images)])
+        except (urllib.error.URLError, OSError):
+            with lock:
+                errors.append(i)
+            continue
+        latency = time.perf_counter() - t0
+        with lock:
+            latencies.append(latency)
+
+
+def main():
+    images = load_images(args.image_dir)
+    if len(images) == 0:
+        print('No images found in {:s}'.format(args.image_dir))
+        return
+    with urllib.request.urlopen(args.url + '/stats') as response:
+        stats_before = json.loads(response.read())
+
+    counter, lock, latencies, errors = [0], threading.Lock(), [], []
+    threads = [threading.Thread(target=worker, args=(images, counter, lock, latencies, errors))
+               for _ in range(args.concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with urllib.request.urlopen(args.url + '/stats') as response:
+        stats_after = json.loads(response.read())
+    batches = {k: v - stats_before['batches'].get(k, 0) for k, v in stats_after['batches'].items()}
+    batches = {k: v for k, v in sorted(batches.items(), key=lambda kv: int(kv[0])) if v > 0}
+
+    ms = np.array(latencies) * 1000. if len(latencies) > 0 else np.zeros(1)
+    report = {'concurrency': args.concurrency,
+              'requests': args.requests,
+              'errors': len(errors),
+              'elapsed_s': elapsed,
+              'requests_per_sec': len(latencies) / elapsed,
+              'latency_ms': {'p50': float(np.percentile(ms, 50)),
+                             'p95': float(np.percentile(ms, 95)),
+                             'p99': float(np.percentile(ms, 99)),
+                             'mean': float(ms.mean())},
+              'batches': batches}
+    print('{:d} requests, concurrency {:d}: {:.1f} req/s | p50 {:.1f}ms p95 {:.1f}ms p99 {:.1f}ms | {:d} errors'.format(
+        args.requests, args.concurrency, report['requests_per_sec'],
+        report['latency_ms']['p50'], report['latency_ms']['p95'], report['latency_ms']['p99'], len(errors)))
+    print('batch sizes: ' + ' '.join('{:s}x{:d}'.format(k, v) for k, v in batches.items()))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Saved load test results to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
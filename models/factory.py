@@ -0,0 +1,43 @@
+"""Builds the detectors from the registry of data/config.py.
+
+Every entry point goes through `build_model`, so a version gets the same
+config, anchor boxes and backbone in training, evaluation, export and
+serving. Only the module of the requested version is imported.
+
+    net, cfg = build_model('yolo_anchor', device, dataset='VOC', backbone=args.backbone)
+"""
+import importlib
+from data import config
+
+
+def build_model(version, device, dataset='VOC', trainable=False, backbone=None, num_classes=None,
+                input_size=None, **kwargs):
+    """
+        Input:
+            version : str -> a key of config.MODELS.
+            dataset : str -> a key of config.DATASETS, selects the config of the model.
+            backbone : str -> default: config.RUNTIME['backbone'].
+            num_classes : int -> default: the classes of the dataset.
+            input_size : list -> [H, W], default: the min_dim of the config.
+            kwargs -> passed to the model, e.g. conf_thresh, nms_type, hr.
+        Output:
+            net : nn.Module -> the detector.
+            cfg : dict -> its config.
+    """
+    cfg = config.get_cfg(version, dataset)
+    entry = config.MODELS[version]
+    if backbone is None:
+        backbone = config.RUNTIME['backbone']
+    if backbone not in entry['backbones']:
+        raise ValueError('{} has no {} backbone, only {}'.format(version, backbone, ', '.join(entry['backbones'])))
+    if num_classes is None:
+        num_classes = config.DATASETS[dataset]['num_classes']
+    if input_size is None:
+        input_size = cfg['min_dim']
+    if entry['anchor']:
+        kwargs.setdefault('anchor_size', config.ANCHOR_SIZE)
+
+    model_class = importlib.import_module(entry['module']).myYOLOv1
+    net = model_class(device, input_size=input_size, num_classes=num_classes, trainable=trainable,
+                      backbone=backbone, **kwargs)
+    return net, cfg
@@ -1,44 +1,43 @@
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
-from torch.autograd import Variable
-from torchvision import models
-import torch.utils.model_zoo as model_zoo
-from utils import *
-from backbone import *
+from utils.modules import conv_set, branch
+from utils.profiler import profile_stage, to_host
+from utils.nms import multiclass_nms
+from utils.detect import topk_candidates
+from backbone import resnet18, resnet50, darknet19
 import numpy as np
-import tools
 
 class myYOLOv1(nn.Module):
-    def __init__(self, device, input_size=None, num_classes=20, trainable=False, conf_thresh=0.01, nms_thresh=0.45, anchor_size=None, hr=False, backbone='r18'):
+    def __init__(self, device, input_size=None, num_classes=20, trainable=False, conf_thresh=0.01, nms_thresh=0.45, nms_type='nms', top_k=None, anchor_size=None, hr=False, backbone='r18'):
         super(myYOLOv1, self).__init__()
         self.device = device
         self.num_classes = num_classes
         self.trainable = trainable
         self.conf_thresh = conf_thresh
         self.nms_thresh = nms_thresh
+        self.nms_type = nms_type
+        # candidates decoded per image, by score (None: all)
+        self.top_k = top_k
         self.anchor_size = torch.tensor(anchor_size)
         self.anchor_number = len(anchor_size)
         self.stride = 32
+        self.grid_cache = {}
         if not trainable:
-            self.grid_cell, self.all_anchor_wh = self.set_init(input_size)
-            self.input_size = input_size
-            self.scale = np.array([[input_size[1], input_size[0], input_size[1], input_size[0]]])
-            self.scale_torch = torch.tensor(self.scale.copy()).float()
+            self.set_input_size(input_size)
 
 
         if backbone == 'r18':
-            self.backbone = resnet18(pretrained=True)
+            self.backbone = resnet18(pretrained=trainable)
             ch = 512
             m_ch = 256
   
         elif backbone == 'r50':
-            self.backbone = resnet50(pretrained=True)
+            self.backbone = resnet50(pretrained=trainable)
             ch = 2048
             m_ch = 512
         
         elif backbone == 'd19':
-            self.backbone = darknet19(pretrained=True)
+            self.backbone = darknet19(pretrained=trainable)
             ch = 1024
             m_ch = 512
 
@@ -46,10 +45,24 @@ class myYOLOv1(nn.Module):
         self.branch = branch(ch, leakyReLU=True)
         self.pred = nn.Conv2d(ch, self.anchor_number*(1 + 4 + self.num_classes), 1)
 
+    def set_input_size(self, input_size):
+        """
+            Set up the grids and scales for `input_size`. The grids are cached per
+            input size, so switching between resolutions, e.g. for test-time
+            augmentation, does not rebuild them.
+        """
+        key = tuple(input_size)
+        if key not in self.grid_cache:
+            self.grid_cache[key] = self.set_init(input_size)
+        self.grid_cell, self.all_anchor_wh = self.grid_cache[key]
+        self.input_size = input_size
+        self.scale = np.array([[input_size[1], input_size[0], input_size[1], input_size[0]]])
+        self.scale_torch = torch.tensor(self.scale.copy()).float().to(self.device)
+
     def set_init(self, input_size):
         s = self.stride
-        ws = self.input_size[1] // s
-        hs = self.input_size[0] // s
+        ws = input_size[1] // s
+        hs = input_size[0] // s
         # [1, H*W, 1, 2]
         grid_cell = torch.zeros(1, hs*ws, self.anchor_number, 2).to(self.device)
         # [1, 1, anchor_n, 2]
@@ -63,28 +76,33 @@ class myYOLOv1(nn.Module):
 
         return grid_cell, all_anchor_wh
         
-    def decode_boxes(self, xywh_pred):
+    @profile_stage('decode_boxes')
+    def decode_boxes(self, xywh_pred, index=None):
         """
             Input:
                 xywh_pred : [B, H*W, anchor_n, 4] containing [tx, ty, tw, th]
+                index : if given, xywh_pred is [B, K, 4] holding only the boxes in index
+                        of the flattened H*W*anchor_n (see topk_candidates)
             Output:
                 bbox_pred : [B, H*W, anchor_n, 4] containing [c_x, c_y, w, h]
         """
+        if index is not None:
+            grid_cell = self.grid_cell.view(1, -1, 2)[:, index]
+            anchor_wh = self.all_anchor_wh.view(1, -1, 2)[:, index]
+            c_xy_pred = torch.sigmoid(xywh_pred[:, :, :2]) + grid_cell
+            b_wh_pred = torch.exp(xywh_pred[:, :, 2:]) * anchor_wh
+            return torch.cat([c_xy_pred - b_wh_pred / 2, c_xy_pred + b_wh_pred / 2], -1) * self.stride
+
         # b_x = sigmoid(tx) + gride_x,  b_y = sigmoid(ty) + gride_y
         B, HW, ab_n, _ = xywh_pred.size()
         c_xy_pred = torch.sigmoid(xywh_pred[:, :, :, :2]) + self.grid_cell
         # b_w = anchor_w * exp(tw),     b_h = anchor_h * exp(th)
         b_wh_pred = torch.exp(xywh_pred[:, :, :, 2:]) * self.all_anchor_wh
-        # [H*W, anchor_n, 4] -> [H*W*anchor_n, 4]
-        bbox_pred = torch.cat([c_xy_pred, b_wh_pred], -1).view(B, HW*ab_n, 4)
-
         # [center_x, center_y, w, h] -> [xmin, ymin, xmax, ymax]
-        output = torch.zeros(bbox_pred.size())
-        output[:, :, 0] = (bbox_pred[:, :, 0] - bbox_pred[:, :, 2] / 2) * self.stride
-        output[:, :, 1] = (bbox_pred[:, :, 1] - bbox_pred[:, :, 3] / 2) * self.stride
-        output[:, :, 2] = (bbox_pred[:, :, 0] + bbox_pred[:, :, 2] / 2) * self.stride
-        output[:, :, 3] = (bbox_pred[:, :, 1] + bbox_pred[:, :, 3] / 2) * self.stride
-        
+        output = torch.cat([c_xy_pred - b_wh_pred / 2, c_xy_pred + b_wh_pred / 2], -1) * self.stride
+        # [B, H*W, anchor_n, 4] -> [B, H*W*anchor_n, 4]
+        output = output.view(B, HW*ab_n, 4)
+
         return output
 
     def clip_boxes(self, boxes, im_shape):
@@ -104,37 +122,7 @@ class myYOLOv1(nn.Module):
         boxes[:, 3::4] = np.maximum(np.minimum(boxes[:, 3::4], im_shape[0] - 1), 0)
         return boxes
 
-    def nms(self, dets, scores):
-        """"Pure Python NMS baseline."""
-        x1 = dets[:, 0]  #xmin
-        y1 = dets[:, 1]  #ymin
-        x2 = dets[:, 2]  #xmax
-        y2 = dets[:, 3]  #ymax
-
-        areas = (x2 - x1) * (y2 - y1)                 # the size of bbox
-        order = scores.argsort()[::-1]                        # sort bounding boxes by decreasing order
-
-        keep = []                                             # store the final bounding boxes
-        while order.size > 0:
-            i = order[0]                                      #the index of the bbox with highest confidence
-            keep.append(i)                                    #save it to keep
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(1e-28, xx2 - xx1)
-            h = np.maximum(1e-28, yy2 - yy1)
-            inter = w * h
-
-            # Cross Area / (bbox + particular area - Cross Area)
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-            #reserve all the boundingbox whose ovr less than thresh
-            inds = np.where(ovr <= self.nms_thresh)[0]
-            order = order[inds + 1]
-
-        return keep
-
+    @profile_stage('postprocess')
     def postprocess(self, all_local, all_conf, exchange=True, im_shape=None):
         """
         bbox_pred: (HxW*anchor_n, 4), bsize = 1
@@ -154,17 +142,8 @@ class myYOLOv1(nn.Module):
         cls_inds = cls_inds[keep]
 
         # NMS
-        keep = np.zeros(len(bbox_pred), dtype=np.int)
-        for i in range(self.num_classes):
-            inds = np.where(cls_inds == i)[0]
-            if len(inds) == 0:
-                continue
-            c_bboxes = bbox_pred[inds]
-            c_scores = scores[inds]
-            c_keep = self.nms(c_bboxes, c_scores)
-            keep[inds[c_keep]] = 1
-
-        keep = np.where(keep > 0)
+        keep, scores = multiclass_nms(bbox_pred, scores, cls_inds, self.nms_type,
+                                      self.nms_thresh, self.conf_thresh)
         bbox_pred = bbox_pred[keep]
         scores = scores[keep]
         cls_inds = cls_inds[keep]
@@ -203,12 +182,16 @@ class myYOLOv1(nn.Module):
             with torch.no_grad():
                 # batch size = 1                
                 all_obj = torch.sigmoid(obj_pred)[0]           # 0 is because that these is only 1 batch.
-                all_bbox = self.decode_boxes(xywh_pred)[0] / self.scale_torch
                 all_class = (torch.softmax(cls_pred[0, :, :], 1) * all_obj)
+                box_pred = xywh_pred[:1]
+                # only decode the top-k candidates
+                index = topk_candidates(all_class, self.top_k)
+                if index is not None:
+                    all_class = all_class[index]
+                    box_pred = box_pred.view(1, -1, 4)[:, index]
+                all_bbox = self.decode_boxes(box_pred, index)[0] / self.scale_torch
                 # separate box pred and class conf
-                all_obj = all_obj.to('cpu').numpy()
-                all_class = all_class.to('cpu').numpy()
-                all_bbox = all_bbox.to('cpu').numpy()
+                all_class, all_bbox = to_host(all_class, all_bbox)
 
                 bboxes, scores, cls_inds = self.postprocess(all_bbox, all_class)
                 # clip the boxes
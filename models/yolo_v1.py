@@ -1,42 +1,41 @@
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
-from torch.autograd import Variable
-from torchvision import models
-import torch.utils.model_zoo as model_zoo
-from utils import *
-from backbone import *
+from utils.modules import conv_set, branch
+from utils.profiler import profile_stage, to_host
+from utils.nms import multiclass_nms
+from utils.detect import topk_candidates
+from backbone import resnet18, resnet50, darknet19
 import numpy as np
-import tools
 
 class myYOLOv1(nn.Module):
-    def __init__(self, device, input_size=None, num_classes=20, trainable=False, conf_thresh=0.01, nms_thresh=0.45, hr=False, backbone='r18'):
+    def __init__(self, device, input_size=None, num_classes=20, trainable=False, conf_thresh=0.01, nms_thresh=0.45, nms_type='nms', top_k=None, hr=False, backbone='r18'):
         super(myYOLOv1, self).__init__()
         self.device = device
         self.num_classes = num_classes
         self.trainable = trainable
         self.conf_thresh = conf_thresh
         self.nms_thresh = nms_thresh
+        self.nms_type = nms_type
+        # candidates decoded per image, by score (None: all)
+        self.top_k = top_k
         self.stride = 32
+        self.grid_cache = {}
         if not trainable:
-            self.grid_cell = self.set_init(input_size)
-            self.input_size = input_size
-            self.scale = np.array([[input_size[1], input_size[0], input_size[1], input_size[0]]])
-            self.scale_torch = torch.tensor(self.scale.copy()).float()
+            self.set_input_size(input_size)
 
         # we use resnet as backbone
         if backbone == 'r18':
-            self.backbone = resnet18(pretrained=True)
+            self.backbone = resnet18(pretrained=trainable)
             ch = 512
             m_ch = 256
   
         elif backbone == 'r50':
-            self.backbone = resnet50(pretrained=True)
+            self.backbone = resnet50(pretrained=trainable)
             ch = 2048
             m_ch = 512
         
         elif backbone == 'd19':
-            self.backbone = darknet19(pretrained=True)
+            self.backbone = darknet19(pretrained=trainable)
             ch = 1024
             m_ch = 512
 
@@ -44,6 +43,20 @@ class myYOLOv1(nn.Module):
         self.branch = branch(ch, leakyReLU=True)
         self.pred = nn.Conv2d(ch, 1 + self.num_classes + 4, 1)
     
+    def set_input_size(self, input_size):
+        """
+            Set up the grids and scales for `input_size`. The grids are cached per
+            input size, so switching between resolutions, e.g. for test-time
+            augmentation, does not rebuild them.
+        """
+        key = tuple(input_size)
+        if key not in self.grid_cache:
+            self.grid_cache[key] = self.set_init(input_size)
+        self.grid_cell = self.grid_cache[key]
+        self.input_size = input_size
+        self.scale = np.array([[input_size[1], input_size[0], input_size[1], input_size[0]]])
+        self.scale_torch = torch.tensor(self.scale.copy()).float().to(self.device)
+
     def set_init(self, input_size):
         s = self.stride
         ws = input_size[1] // s
@@ -59,22 +72,22 @@ class myYOLOv1(nn.Module):
         
         return grid_cell
 
-    def decode_boxes(self, pred):
+    @profile_stage('decode_boxes')
+    def decode_boxes(self, pred, index=None):
         """
         input box :  [delta_x, delta_y, sqrt(w), sqrt(h)]
         output box : [xmin, ymin, xmax, ymax]
+        index : if given, pred only holds the cells in index (see topk_candidates)
         """
-        output = torch.zeros(pred.size())
-        pred[:, :, :2] = torch.sigmoid(pred[:, :, :2])
-        pred[:, :, 2:] = torch.relu(pred[:, :, 2:])
-        # [delta_x, delta_y, w, h] -> [c_x, c_y, w, h]
-        pred = self.grid_cell + pred
+        grid_cell = self.grid_cell if index is None else self.grid_cell[:, index]
+        # [delta_x, delta_y] -> [c_x, c_y]
+        c_xy = (torch.sigmoid(pred[:, :, :2]) + grid_cell[:, :, :2]) * self.stride
+        # w, h are relative to the input size
+        b_wh = torch.cat([torch.relu(pred[:, :, 2:3]) * self.input_size[1],
+                          torch.relu(pred[:, :, 3:4]) * self.input_size[0]], -1)
         # [c_x, c_y, w, h] -> [xmin, ymin, xmax, ymax]
-        output[:, :, 0] = pred[:, :, 0]*self.stride - pred[:, :, 2]*self.input_size[1] / 2
-        output[:, :, 1] = pred[:, :, 1]*self.stride - pred[:, :, 3]*self.input_size[0] / 2
-        output[:, :, 2] = pred[:, :, 0]*self.stride + pred[:, :, 2]*self.input_size[1] / 2
-        output[:, :, 3] = pred[:, :, 1]*self.stride + pred[:, :, 3]*self.input_size[0] / 2
-        
+        output = torch.cat([c_xy - b_wh / 2, c_xy + b_wh / 2], -1)
+
         return output
 
     def clip_boxes(self, boxes, im_shape):
@@ -94,37 +107,7 @@ class myYOLOv1(nn.Module):
         boxes[:, 3::4] = np.maximum(np.minimum(boxes[:, 3::4], im_shape[0] - 1), 0)
         return boxes
 
-    def nms(self, dets, scores):
-        """"Pure Python NMS baseline."""
-        x1 = dets[:, 0]  #xmin
-        y1 = dets[:, 1]  #ymin
-        x2 = dets[:, 2]  #xmax
-        y2 = dets[:, 3]  #ymax
-
-        areas = (x2 - x1) * (y2 - y1)                 # the size of bbox
-        order = scores.argsort()[::-1]                        # sort bounding boxes by decreasing order
-
-        keep = []                                             # store the final bounding boxes
-        while order.size > 0:
-            i = order[0]                                      #the index of the bbox with highest confidence
-            keep.append(i)                                    #save it to keep
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(1e-28, xx2 - xx1)
-            h = np.maximum(1e-28, yy2 - yy1)
-            inter = w * h
-
-            # Cross Area / (bbox + particular area - Cross Area)
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-            #reserve all the boundingbox whose ovr less than thresh
-            inds = np.where(ovr <= self.nms_thresh)[0]
-            order = order[inds + 1]
-
-        return keep
-
+    @profile_stage('postprocess')
     def postprocess(self, all_local, all_conf, exchange=True, im_shape=None):
         """
         bbox_pred: (HxW, 4), bsize = 1
@@ -144,17 +127,8 @@ class myYOLOv1(nn.Module):
         cls_inds = cls_inds[keep]
 
         # NMS
-        keep = np.zeros(len(bbox_pred), dtype=np.int)
-        for i in range(self.num_classes):
-            inds = np.where(cls_inds == i)[0]
-            if len(inds) == 0:
-                continue
-            c_bboxes = bbox_pred[inds]
-            c_scores = scores[inds]
-            c_keep = self.nms(c_bboxes, c_scores)
-            keep[inds[c_keep]] = 1
-
-        keep = np.where(keep > 0)
+        keep, scores = multiclass_nms(bbox_pred, scores, cls_inds, self.nms_type,
+                                      self.nms_thresh, self.conf_thresh)
         bbox_pred = bbox_pred[keep]
         scores = scores[keep]
         cls_inds = cls_inds[keep]
@@ -173,7 +147,9 @@ class myYOLOv1(nn.Module):
         C = self.conv_set(C_5)
         C = self.branch(C)
         prediction = self.pred(C)
-        prediction = prediction.view(prediction.shape[0], prediction.shape[1], -1).permute(0, 2, 1)
+        B, C, _, _ = prediction.size()
+        # [B, C, H, W] -> [B, H*W, C], a view when the model runs channels_last
+        prediction = prediction.permute(0, 2, 3, 1).reshape(B, -1, C)
 
         # 整理，便于训练
         if not self.trainable:
@@ -182,12 +158,16 @@ class myYOLOv1(nn.Module):
                 all_obj = torch.sigmoid(prediction[0, :, :1])
                 # mask_obj = all_obj > self.obj_thresh
                 all_class = (torch.softmax(prediction[0, :, 1:1+self.num_classes], 1)*all_obj)
-                all_local = self.decode_boxes(prediction[:, :, 1+self.num_classes:])[0] / self.scale_torch
+                box_pred = prediction[:1, :, 1+self.num_classes:]
+                # only decode the top-k candidates
+                index = topk_candidates(all_class, self.top_k)
+                if index is not None:
+                    all_class = all_class[index]
+                    box_pred = box_pred[:, index]
+                all_local = self.decode_boxes(box_pred, index)[0] / self.scale_torch
                 
                 # # separate box pred and class conf
-                all_obj = all_obj.to('cpu').numpy()
-                all_class = all_class.to('cpu').numpy()
-                all_local = all_local.to('cpu').numpy()
+                all_class, all_local = to_host(all_class, all_local)
 
                 #output = self.detect(all_local, all_conf)
                 bboxes, scores, cls_inds = self.postprocess(all_local, all_class)
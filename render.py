@@ -0,0 +1,102 @@
+"""Write annotated images of a whole VOC split, headless.
+
+The detections either come from a model run here or from the
+detections.pkl that eval_voc.py saves, in which case no model is needed.
+Images are drawn and encoded by a pool of worker processes.
+
+    python render.py -v yolo_v1 --trained_model weights.pth --set test --output_dir render/
+    python render.py --detections eval/test/detections.pkl --output_dir render/
+"""
+import time
+import pickle
+import argparse
+import numpy as np
+import torch
+from data import config, VOC_ROOT, VOC_CLASSES, BaseTransform, build_dataset
+from models import factory
+from utils.vis import render_dataset
+from utils.checkpoint import load_weights
+import tools
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Detection Renderer')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbone', type=str, default=config.RUNTIME['backbone'],
+                    help='r18, r50, d19')
+parser.add_argument('--trained_model', type=str, default=None,
+                    help='Trained state_dict file path to open')
+parser.add_argument('--detections', type=str, default=None,
+                    help='detections.pkl written by eval_voc.py, instead of running a model')
+parser.add_argument('--voc_root', default=VOC_ROOT,
+                    help='Location of VOC root directory')
+parser.add_argument('--set', default='test', type=str,
+                    help='VOC2007 image set to render')
+parser.add_argument('--output_dir', default='render/', type=str,
+                    help='Directory the annotated images are written to')
+parser.add_argument('--visual_threshold', default=0.3, type=float,
+                    help='Final confidence threshold')
+parser.add_argument('--num_workers', default=None, type=int,
+                    help='Rendering processes (0: render in this process)')
+parser.add_argument('--cuda', action='store_true', default=False,
+                    help='Run the model on cuda:0')
+
+args = parser.parse_args()
+
+
+def build_model(version, backbone, device):
+    net, _ = factory.build_model(version, device, 'VOC', backbone=backbone, num_classes=len(VOC_CLASSES),
+                                 conf_thresh=0.01)
+    return net
+
+
+def load_detections(det_file, num_images):
+    """all_boxes[cls][image] = N x 5 (x1, y1, x2, y2, score) -> (bboxes, scores, cls_inds) per image."""
+    with open(det_file, 'rb') as f:
+        all_boxes = pickle.load(f)
+    detections = []
+    for i in range(num_images):
+        dets = [np.asarray(all_boxes[j][i], dtype=np.float32).reshape(-1, 5) for j in range(len(all_boxes))]
+        cls_inds = np.concatenate([np.full(len(d), j, dtype=np.int64) for j, d in enumerate(dets)])
+        dets = np.concatenate(dets)
+        detections.append((dets[:, :4], dets[:, 4], cls_inds))
+    return detections
+
+
+def detect(net, dataset, device):
+    detections = []
+    for i in range(len(dataset)):
+        im, _, h, w = dataset.pull_item(i)
+        with torch.no_grad():
+            bboxes, scores, cls_inds = net(im.unsqueeze(0).to(device))
+        detections.append((bboxes * np.array([[w, h, w, h]]), scores, cls_inds))
+        if (i + 1) % 100 == 0:
+            print('im_detect: {:d}/{:d}'.format(i + 1, len(dataset)))
+    return detections
+
+
+def main():
+    device = torch.device('cuda:0' if args.cuda and torch.cuda.is_available() else 'cpu')
+    if args.detections is not None:
+        dataset = build_dataset('VOC', train=False, root=args.voc_root, image_set=[('2007', args.set)])
+        detections = load_detections(args.detections, len(dataset))
+    else:
+        net = build_model(args.version, args.backbone, device)
+        if args.trained_model is not None:
+            load_weights(net, args.trained_model, device)
+        net = net.to(device).eval()
+        dataset = build_dataset('VOC', train=False, root=args.voc_root, image_set=[('2007', args.set)],
+                                transform=BaseTransform(net.input_size, config.MEANS))
+        detections = detect(net, dataset, device)
+
+    image_paths = [dataset._imgpath % img_id for img_id in dataset.ids]
+    t0 = time.perf_counter()
+    count = render_dataset(image_paths, detections, args.output_dir, VOC_CLASSES, tools.CLASS_COLOR,
+                           args.visual_threshold, args.num_workers)
+    elapsed = time.perf_counter() - t0
+    print('Rendered {:d} images to {:s} in {:.2f}s ({:.1f} images/s)'.format(
+        count, args.output_dir, elapsed, count / max(elapsed, 1e-12)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Local HTTP inference server for the detectors, on the cpu.
+
+POST an encoded image (jpg, png, ...) to /detect and get the detections back
+as JSON, in pixels of the posted image:
+
+    curl --data-binary @image.jpg http://127.0.0.1:8000/detect
+    {"detections": [{"class": "dog", "score": 0.87, "bbox": [x1, y1, x2, y2]}, ...],
+     "batch_size": 3, "replica": 0, "inference_ms": 41.2}
+
+The model runs in `--replicas` worker processes, each pinned to its own
+subset of cores with as many intra-op threads as cores. Requests wait in a
+shared queue; a free replica takes the first one and then keeps collecting
+until it has `--max_batch` images or `--max_wait_ms` has passed, and runs
+them as one batch. GET /stats reports the number of requests and of batches
+per batch size.
+
+    python serve.py -v yolo_v1 -bk r18 --trained_model weights.pth --replicas 2 --max_batch 8
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import cv2
+import torch
+from data import config, VOC_CLASSES, Preprocess
+from models import factory
+from utils.detect import detect_batch
+from utils.checkpoint import load_weights
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Detection Server')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbone', type=str, default=config.RUNTIME['backbone'],
+                    help='r18, r50, d19')
+parser.add_argument('--trained_model', type=str, default=None,
+                    help='Trained state_dict file path to open')
+parser.add_argument('--conf_thresh', type=float, default=0.3,
+                    help='Confidence threshold of the returned detections')
+parser.add_argument('--host', type=str, default='127.0.0.1',
+                    help='Address to listen on')
+parser.add_argument('--port', type=int, default=8000,
+                    help='Port to listen on')
+parser.add_argument('--replicas', type=int, default=1,
+                    help='Model replicas, each in its own process')
+parser.add_argument('--cores_per_replica', type=int, default=None,
+                    help='Cores each replica is pinned to (default: all cores split evenly)')
+parser.add_argument('--max_batch', type=int, default=8,
+                    help='Largest batch a replica runs')
+parser.add_argument('--max_wait_ms', type=float, default=5.,
+                    help='How long a replica waits to fill a batch')
+parser.add_argument('--channels_last', action='store_true', default=False,
+                    help='Run the replicas in the channels_last memory format')
+parser.add_argument('--letterbox', action='store_true', default=False,
+                    help='Keep the aspect ratio of the images and pad them')
+parser.add_argument('--top_k', type=int, default=200,
+                    help='Candidates decoded per image, by score (0: all)')
+parser.add_argument('--global_top_k', type=int, default=None,
+                    help='Candidates decoded per batch, over all of its images')
+parser.add_argument('--timeout', type=float, default=30.,
+                    help='Seconds a request waits for its result')
+
+args = parser.parse_args()
+
+
+def build_model(version, backbone, conf_thresh, device):
+    net, _ = factory.build_model(version, device, 'VOC', backbone=backbone, num_classes=len(VOC_CLASSES),
+                                 conf_thresh=conf_thresh)
+    return net
+
+
+def core_subsets(replicas, cores_per_replica=None):
+    """Split the cores this process may run on into one subset per replica."""
+    cores = sorted(os.sched_getaffinity(0))
+    if cores_per_replica is None:
+        cores_per_replica = max(len(cores) // replicas, 1)
+    if replicas * cores_per_replica > len(cores):
+        print('WARNING: {:d} replicas x {:d} cores > {:d} cores, the subsets overlap.'.format(
+            replicas, cores_per_replica, len(cores)))
+    return [[cores[(r * cores_per_replica + i) % len(cores)] for i in range(cores_per_replica)]
+            for r in range(replicas)]
+
+
+def next_batch(requests, max_batch, max_wait):
+    """Block for one request, then collect more until the batch is full or `max_wait` passed."""
+    batch = [requests.get()]
+    if batch[0] is None:
+        return None
+    deadline = time.perf_counter() + max_wait
+    while len(batch) < max_batch:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            item = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            # let the other replicas see the sentinel too
+            requests.put(None)
+            break
+        batch.append(item)
+    return batch
+
+
+def replica_main(index, cores, opts, requests, results):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    device = torch.device('cpu')
+    net = build_model(opts['version'], opts['backbone'], opts['conf_thresh'], device)
+    if opts['trained_model'] is not None:
+        load_weights(net, opts['trained_model'], device)
+    net.eval()
+    net.top_k = opts['top_k']
+    memory_format = torch.channels_last if opts['channels_last'] else torch.contiguous_format
+    net = net.to(memory_format=memory_format)
+    preprocess = Preprocess(net.input_size, config.MEANS, letterbox=opts['letterbox'])
+    # the batches are preprocessed into this buffer
+    buffer = torch.empty(opts['max_batch'], 3, net.input_size[0], net.input_size[1], memory_format=memory_format)
+    results.put(('ready', index, cores))
+
+    while True:
+        batch = next_batch(requests, opts['max_batch'], opts['max_wait_ms'] / 1000.)
+        if batch is None:
+            break
+        ids, images, replies = [], [], []
+        for request_id, data in batch:
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                replies.append((request_id, {'error': 'could not decode the image'}))
+                continue
+            ids.append(request_id)
+            images.append(img)
+
+        if len(images) > 0:
+            t0 = time.perf_counter()
+            x, metas = preprocess.batch(images, out=buffer[:len(images)])
+            detections = detect_batch(net, x, opts['global_top_k'])
+            inference_ms = (time.perf_counter() - t0) * 1000.
+
+            for request_id, meta, (bboxes, scores, cls_inds) in zip(ids, metas, detections):
+                bboxes = preprocess.to_image_boxes(bboxes, meta)
+                replies.append((request_id, {
+                    'detections': [{'class': VOC_CLASSES[int(c)], 'score': float(s),
+                                    'bbox': [float(v) for v in b]}
+                                   for b, s, c in zip(bboxes, scores, cls_inds)],
+                    'batch_size': len(images),
+                    'replica': index,
+                    'inference_ms': inference_ms}))
+        # one message per batch
+        results.put((len(images), replies))
+
+
+class Server(object):
+    """Hands requests to the replica processes and the results back to the waiting handlers."""
+    def __init__(self, opts, subsets):
+        ctx = mp.get_context('spawn')
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.stats = {'requests': 0, 'errors': 0, 'batches': {}}
+        self.replicas = [ctx.Process(target=replica_main, args=(i, cores, opts, self.requests, self.results), daemon=True)
+                         for i, cores in enumerate(subsets)]
+        for p in self.replicas:
+            p.start()
+        for _ in self.replicas:
+            _, index, cores = self.results.get()
+            print('Replica {:d} ready on cores {}'.format(index, cores))
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            batch_size, replies = item
+            with self.lock:
+                if batch_size > 0:
+                    key = str(batch_size)
+                    self.stats['batches'][key] = self.stats['batches'].get(key, 0) + 1
+                slots = [(self.pending.pop(request_id, None), result) for request_id, result in replies]
+                self.stats['errors'] += sum('error' in result for _, result in replies)
+            for slot, result in slots:
+                if slot is not None:
+                    slot[1] = result
+                    slot[0].set()
+
+    def detect(self, data, timeout):
+        slot = [threading.Event(), None]
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = slot
+            self.stats['requests'] += 1
+        self.requests.put((request_id, data))
+        if not slot[0].wait(timeout):
+            with self.lock:
+                self.pending.pop(request_id, None)
+            return None
+        return slot[1]
+
+    def close(self):
+        for _ in self.replicas:
+            self.requests.put(None)
+        for p in self.replicas:
+            p.join(timeout=5)
+        self.results.put(None)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'YOLOv1Server'
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/detect':
+            return self._reply(404, {'error': 'unknown path'})
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            return self._reply(400, {'error': 'empty body'})
+        result = self.server.detector.detect(self.rfile.read(length), args.timeout)
+        if result is None:
+            return self._reply(504, {'error': 'timed out'})
+        self._reply(400 if 'error' in result else 200, result)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {'error': 'unknown path'})
+        detector = self.server.detector
+        with detector.lock:
+            stats = {'requests': detector.stats['requests'],
+                     'errors': detector.stats['errors'],
+                     'batches': dict(detector.stats['batches']),
+                     'replicas': len(detector.replicas)}
+        self._reply(200, stats)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    opts = {'version': args.version,
+            'backbone': args.backbone,
+            'trained_model': args.trained_model,
+            'conf_thresh': args.conf_thresh,
+            'max_batch': args.max_batch,
+            'max_wait_ms': args.max_wait_ms,
+            'channels_last': args.channels_last,
+            'letterbox': args.letterbox,
+            'top_k': args.top_k,
+            'global_top_k': args.global_top_k}
+    detector = Server(opts, core_subsets(args.replicas, args.cores_per_replica))
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler)
+    httpd.daemon_threads = True
+    httpd.detector = detector
+    print('Serving {:s} {:s} on http://{:s}:{:d}/detect'.format(args.version, args.backbone, args.host, args.port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        detector.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Streaming inference over a video file, a camera or a directory of images.
+
+Decoding + preprocessing, the model and drawing + encoding run as three
+pipelined stages on their own threads, connected by bounded queues, so the
+stages overlap and a slow stage applies back-pressure instead of buffering
+the whole stream. The output is an annotated video (.mp4 / .avi), a
+directory of annotated images, or a JSONL file with one line of detections
+per frame. The sustained FPS and the busy time of every stage are reported.
+
+    python stream.py -v yolo_v1 --trained_model weights.pth --input video.mp4 --output out.mp4
+    python stream.py -v yolo_v1 --trained_model weights.pth --input images/ --output dets.jsonl
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import cv2
+import torch
+from data import config, VOC_CLASSES, Preprocess
+from models import factory
+from utils.vis import draw_detections
+from utils.checkpoint import load_weights
+import tools
+
+
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+parser = argparse.ArgumentParser(description='YOLO-v1 Stream Detection')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbone', type=str, default=config.RUNTIME['backbone'],
+                    help='r18, r50, d19')
+parser.add_argument('--trained_model', type=str, default=None,
+                    help='Trained state_dict file path to open')
+parser.add_argument('--input', type=str, required=True,
+                    help='Video file, image directory or camera index')
+parser.add_argument('--output', type=str, required=True,
+                    help='Annotated video (.mp4, .avi), image directory, or .jsonl detections')
+parser.add_argument('--visual_threshold', default=0.3, type=float,
+                    help='Final confidence threshold')
+parser.add_argument('--queue_size', default=8, type=int,
+                    help='Frames each queue between two stages holds')
+parser.add_argument('--report_every', default=100, type=int,
+                    help='Print the FPS every this many frames')
+parser.add_argument('--letterbox', action='store_true', default=False,
+                    help='Keep the aspect ratio of the frames and pad them')
+parser.add_argument('--cuda', action='store_true', default=False,
+                    help='Run the model on cuda:0')
+
+args = parser.parse_args()
+
+
+def build_model(version, backbone, device):
+    net, _ = factory.build_model(version, device, 'VOC', backbone=backbone, num_classes=len(VOC_CLASSES),
+                                 conf_thresh=0.01)
+    return net
+
+
+def frames(source):
+    """A generator of (name, BGR frame) over a video file, a camera index or an image directory, and its fps."""
+    if os.path.isdir(source):
+        names = sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTS))
+
+        def read():
+            for name in names:
+                img = cv2.imread(os.path.join(source, name))
+                if img is not None:
+                    yield name, img
+        return read(), 25.
+
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not cap.isOpened():
+        raise IOError('Could not open {:s}'.format(source))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.
+
+    def read():
+        index = 0
+        while True:
+            ok, img = cap.read()
+            if not ok:
+                break
+            yield str(index), img
+            index += 1
+        cap.release()
+    return read(), fps
+
+
+class Stage(threading.Thread):
+    """A pipeline stage: applies `fn` to every item of `inq` and puts the result on `outq`.
+    None marks the end of the stream and is passed on."""
+    def __init__(self, name, fn, inq, outq=None):
+        super(Stage, self).__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inq = inq
+        self.outq = outq
+        self.busy = 0.
+        self.count = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                item = self.inq.get()
+                if item is None:
+                    break
+                t0 = time.perf_counter()
+                out = self.fn(item)
+                self.busy += time.perf_counter() - t0
+                self.count += 1
+                if self.outq is not None:
+                    self.outq.put(out)
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.outq is not None:
+                self.outq.put(None)
+            # unblock the stage before us if we stopped early
+            while self.error is not None and self.inq.get() is not None:
+                pass
+
+
+class Writer(object):
+    """Draws and writes annotated frames, or writes detections as JSONL."""
+    def __init__(self, output, fps):
+        self.output = output
+        self.fps = fps
+        self.video = None
+        self.size = None
+        self.jsonl = None
+        if output.endswith('.jsonl'):
+            self.jsonl = open(output, 'w')
+        elif not output.lower().endswith(VIDEO_EXTS):
+            os.makedirs(output, exist_ok=True)
+
+    def __call__(self, item):
+        name, img, (bboxes, scores, cls_inds) = item
+        if self.jsonl is not None:
+            keep = scores > args.visual_threshold
+            self.jsonl.write(json.dumps({
+                'frame': name,
+                'detections': [{'class': VOC_CLASSES[int(c)], 'score': float(s), 'bbox': [float(v) for v in b]}
+                               for b, s, c in zip(bboxes[keep], scores[keep], cls_inds[keep])]}) + '\n')
+            return
+        draw_detections(img, bboxes, scores, cls_inds, VOC_CLASSES, tools.CLASS_COLOR, args.visual_threshold)
+        if self.output.lower().endswith(VIDEO_EXTS):
+            if self.video is None:
+                self.size = (img.shape[1], img.shape[0])
+                fourcc = cv2.VideoWriter_fourcc(*('mp4v' if self.output.lower().endswith('.mp4') else 'XVID'))
+                self.video = cv2.VideoWriter(self.output, fourcc, self.fps, self.size)
+            if (img.shape[1], img.shape[0]) != self.size:
+                # images of a directory may differ in size, a video can not
+                img = cv2.resize(img, self.size)
+            self.video.write(img)
+        else:
+            cv2.imwrite(os.path.join(self.output, os.path.splitext(name)[0] + '.jpg'), img)
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+        if self.jsonl is not None:
+            self.jsonl.close()
+
+
+def main():
+    device = torch.device('cuda:0' if args.cuda and torch.cuda.is_available() else 'cpu')
+    net = build_model(args.version, args.backbone, device)
+    if args.trained_model is not None:
+        load_weights(net, args.trained_model, device)
+    net = net.to(device).eval()
+    transform = Preprocess(net.input_size, config.MEANS, letterbox=args.letterbox)
+
+    def preprocess(item):
+        name, img = item
+        x, meta = transform(img)
+        return name, img, x.unsqueeze(0), meta
+
+    def infer(item):
+        name, img, x, meta = item
+        with torch.no_grad():
+            bboxes, scores, cls_inds = net(x.to(device))
+        return name, img, (transform.to_image_boxes(bboxes, meta), scores, cls_inds)
+
+    source, fps = frames(args.input)
+    writer = Writer(args.output, fps)
+    source_q = queue.Queue(args.queue_size)
+    decoded_q = queue.Queue(args.queue_size)
+    detected_q = queue.Queue(args.queue_size)
+    stages = [Stage('decode', preprocess, source_q, decoded_q),
+              Stage('infer', infer, decoded_q, detected_q),
+              Stage('write', writer, detected_q)]
+    for stage in stages:
+        stage.start()
+
+    t0 = time.perf_counter()
+    read_time = 0.
+    num_frames = 0
+    while True:
+        t = time.perf_counter()
+        item = next(source, None)
+        read_time += time.perf_counter() - t
+        if item is None or any(stage.error is not None for stage in stages):
+            break
+        source_q.put(item)
+        num_frames += 1
+        if args.report_every > 0 and num_frames % args.report_every == 0:
+            # frames that made it through the whole pipeline
+            done = stages[-1].count
+            print('{:d} frames, {:.1f} FPS'.format(done, done / (time.perf_counter() - t0)))
+    source_q.put(None)
+    for stage in stages:
+        stage.join()
+    elapsed = time.perf_counter() - t0
+    writer.close()
+
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    print('Processed {:d} frames in {:.2f}s: {:.1f} FPS sustained'.format(
+        num_frames, elapsed, num_frames / max(elapsed, 1e-12)))
+    # a stage busy close to 100% of the time is the bottleneck
+    print('read: {:.1f}% busy'.format(100. * read_time / max(elapsed, 1e-12)))
+    for stage in stages:
+        print('{:s}: {:.1f}% busy, {:.2f}ms per frame'.format(
+            stage.name, 100. * stage.busy / max(elapsed, 1e-12), 1000. * stage.busy / max(stage.count, 1)))
+    print('Saved the output to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
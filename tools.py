@@ -3,7 +3,9 @@ from data import *
 import torch.nn as nn
 import torch.nn.functional as F
 
-CLASS_COLOR = [(np.random.randint(255),np.random.randint(255),np.random.randint(255)) for _ in range(len(VOC_CLASSES))]
+# a fixed seed, so every run draws a class in the same color
+_color_rng = np.random.RandomState(0)
+CLASS_COLOR = [tuple(int(c) for c in _color_rng.randint(255, size=3)) for _ in range(len(VOC_CLASSES))]
 # We use ignore thresh to decide which anchor box can be kept.
 ignore_thresh = IGNORE_THRESH
 
@@ -137,6 +139,75 @@ def set_anchors(anchor_size, stride, gride_index):
     
     return anchor_boxes
 
+def match_anchors(gt_wh, all_anchor_size):
+    """
+    Input:
+        gt_wh : ndarray -> [N, 2] sizes of the gt boxes, in grid cells.
+        all_anchor_size : list -> [[w_1, h_1], [w_2, h_2], ..., [w_n, h_n]], in grid cells.
+    Output:
+        iou : ndarray -> [N, n] IoU of every gt box and anchor box, centered at the same point.
+        mask : ndarray -> [N, n] the anchor boxes assigned to every gt box: those whose IoU is
+                          more than ignore thresh, or else the one with the highest IoU.
+    """
+    anchor_wh = np.asarray(all_anchor_size, dtype=np.float64).reshape(-1, 2)
+    gt_wh = np.asarray(gt_wh, dtype=np.float64).reshape(-1, 2)
+    S_I = np.minimum(gt_wh[:, None, 0], anchor_wh[None, :, 0]) * np.minimum(gt_wh[:, None, 1], anchor_wh[None, :, 1])
+    U = (gt_wh[:, 0] * gt_wh[:, 1])[:, None] + (anchor_wh[:, 0] * anchor_wh[:, 1])[None, :] - S_I + 1e-20
+    iou = S_I / U
+    # We only consider those anchor boxes whose IoU is more than ignore thresh,
+    mask = iou > ignore_thresh
+    # and assign the anchor box with highest IoU score to the others.
+    none = ~mask.any(1)
+    mask[none, iou[none].argmax(1)] = True
+    return iou, mask
+
+def assign_anchors(boxes, batch_index, input_size, stride, all_anchor_size):
+    """
+    The anchor boxes of all the gt boxes of a batch, as generate_txtytwth for each.
+    When several gt boxes get the same anchor box of the same grid cell, the later one
+    is kept, as gt_creator overwrites them in order.
+    Input:
+        boxes : ndarray -> [M, 4] (xmin, ymin, xmax, ymax) between 0 and 1.
+        batch_index : ndarray -> [M,] the image of every gt box.
+        input_size : list -> [h, w].
+        stride : int -> the downSample of the CNN.
+        all_anchor_size : list -> [[w_1, h_1], ..., [w_n, h_n]], in grid cells.
+    Output:
+        gt_index, batch_index, grid_y, grid_x, anchor_index : ndarray -> [P,] every kept assignment.
+        txtytwth : ndarray -> [P, 4] the training targets.
+        weight : ndarray -> [P,] the box loss weights.
+    """
+    h, w = input_size
+    hs, ws = h // stride, w // stride
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    batch_index = np.asarray(batch_index, dtype=np.int64)
+    # map the center, width and height to the feature map size
+    c_x_s = (boxes[:, 0] + boxes[:, 2]) / 2 * w / stride
+    c_y_s = (boxes[:, 1] + boxes[:, 3]) / 2 * h / stride
+    box_ws = (boxes[:, 2] - boxes[:, 0]) * w / stride
+    box_hs = (boxes[:, 3] - boxes[:, 1]) * h / stride
+    # the gride cell location
+    grid_x = np.minimum(c_x_s.astype(np.int64), ws - 1)
+    grid_y = np.minimum(c_y_s.astype(np.int64), hs - 1)
+
+    _, mask = match_anchors(np.stack([box_ws, box_hs], 1), all_anchor_size)
+    gt_index, anchor_index = np.nonzero(mask)
+    # keep the last gt box of every (image, cell, anchor) slot
+    anchor_number = mask.shape[1]
+    slot = ((batch_index[gt_index] * hs + grid_y[gt_index]) * ws + grid_x[gt_index]) * anchor_number + anchor_index
+    _, last = np.unique(slot[::-1], return_index=True)
+    keep = np.sort(len(slot) - 1 - last)
+    gt_index, anchor_index = gt_index[keep], anchor_index[keep]
+
+    anchor_wh = np.asarray(all_anchor_size, dtype=np.float64).reshape(-1, 2)[anchor_index]
+    txtytwth = np.stack([c_x_s[gt_index] - grid_x[gt_index],
+                         c_y_s[gt_index] - grid_y[gt_index],
+                         np.log(box_ws[gt_index] / anchor_wh[:, 0]),
+                         np.log(box_hs[gt_index] / anchor_wh[:, 1])], 1)
+    weight = 2.0 - (boxes[gt_index, 2] - boxes[gt_index, 0]) * (boxes[gt_index, 3] - boxes[gt_index, 1])
+    return (gt_index, batch_index[gt_index], grid_y[gt_index], grid_x[gt_index], anchor_index,
+            txtytwth, weight)
+
 def generate_txtytwth(gt_label, w, h, s, all_anchor_size):
     xmin, ymin, xmax, ymax = gt_label[:-1]
     # map it to the image
@@ -157,42 +228,20 @@ def generate_txtytwth(gt_label, w, h, s, all_anchor_size):
     # the gride cell location
     grid_x = int(c_x_s)
     grid_y = int(c_y_s)
-    # generate anchor boxes
-    anchor_boxes = set_anchors(all_anchor_size, s, [grid_y, grid_x])
-    gt_box = np.array([[0, 0, box_ws, box_hs]])
-    # compute the IoU
-    iou = compute_iou(anchor_boxes, gt_box)
-    # We only consider those anchor boxes whose IoU is more than ignore thresh,
-    iou_mask = (iou > ignore_thresh).astype(np.int) # bool -> int
+    # the anchor boxes whose IoU is more than ignore thresh, or the best one
+    _, mask = match_anchors([box_ws, box_hs], all_anchor_size)
 
     result = []
-    if iou_mask.sum() == 0:
-        # We assign the anchor box with highest IoU score.
-        index = np.argmax(iou)
+    for index in np.where(mask[0])[0]:
         p_w, p_h = all_anchor_size[index]
         tx = c_x_s - grid_x
         ty = c_y_s - grid_y
         tw = np.log(box_ws / p_w)
         th = np.log(box_hs / p_h)
         weight = 2.0 - (box_w / w) * (box_h / h)
-        
         result.append([index, grid_x, grid_y, tx, ty, tw, th, weight])
-        
-        return result
-    else:
-        # We assign any anchor box whose IoU score is higher than ignore thresh.
-        iou_ = iou * iou_mask
-        for index, iou_score in enumerate(iou_):
-            if iou_score > ignore_thresh:
-                p_w, p_h = all_anchor_size[index]
-                tx = c_x_s - grid_x
-                ty = c_y_s - grid_y
-                tw = np.log(box_ws / p_w)
-                th = np.log(box_hs / p_h)
-                weight = 2.0 - (box_w / w) * (box_h / h)
-                result.append([index, grid_x, grid_y, tx, ty, tw, th, weight])
-
-        return result 
+
+    return result
 
 def generate_dxdywh(gt_label, w, h, s):
     xmin, ymin, xmax, ymax = gt_label[:-1]
@@ -246,17 +295,15 @@ def gt_creator(input_size, stride, num_classes, label_lists=[], use_anchor=False
         anchor_number = len(all_anchor_size)
 
         gt_tensor = np.zeros([batch_size, hs, ws, anchor_number, 1+1+4+1])
-        for batch_index in range(batch_size):
-            for gt_label in label_lists[batch_index]:
-                # get a bbox coords
-                gt_class = int(gt_label[-1])
-                results = generate_txtytwth(gt_label, w, h, s, all_anchor_size)
-                for result in results:
-                    index, grid_x, grid_y, tx, ty, tw, th, weight = result
-                    gt_tensor[batch_index, grid_y, grid_x, index, 0] = 1.0
-                    gt_tensor[batch_index, grid_y, grid_x, index, 1] = gt_class
-                    gt_tensor[batch_index, grid_y, grid_x, index, 2:6] = np.array([tx, ty, tw, th])
-                    gt_tensor[batch_index, grid_y, grid_x, index, 6] = weight
+        labels = np.array([gt_label for label_list in label_lists for gt_label in label_list],
+                          dtype=np.float64).reshape(-1, 5)
+        batch_index = np.repeat(np.arange(batch_size), [len(label_list) for label_list in label_lists])
+        gt_index, b, grid_y, grid_x, index, txtytwth, weight = assign_anchors(
+            labels[:, :4], batch_index, input_size, stride, all_anchor_size)
+        gt_tensor[b, grid_y, grid_x, index, 0] = 1.0
+        gt_tensor[b, grid_y, grid_x, index, 1] = labels[gt_index, 4]
+        gt_tensor[b, grid_y, grid_x, index, 2:6] = txtytwth
+        gt_tensor[b, grid_y, grid_x, index, 6] = weight
     
         gt_tensor = gt_tensor.reshape(batch_size, hs * ws * anchor_number, 1+1+4+1)
 
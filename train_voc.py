@@ -1,9 +1,15 @@
 from data import *
 from utils.augmentations import SSDAugmentation
+from utils.telemetry import TrainTelemetry
+from utils.checkpoint import CheckpointSaver, training_state, latest_checkpoint, load_file, set_rng_state
+from utils.ema import ModelEMA
+from utils.lr_scheduler import LRScheduler, LR_POLICIES
+from models.factory import build_model
 import os
 import sys
 import time
 import random
+import subprocess
 import tools
 import torch
 import torch.nn as nn
@@ -20,40 +26,74 @@ import torchvision.transforms as TF
 parser = argparse.ArgumentParser(description='YOLO-v1 Detection')
 parser.add_argument('-v', '--version', default='yolo_v1',
                     help='yolo_v1, yolo_anchor, yolo_v1_ms')
-parser.add_argument('-d', '--dataset', default='VOC',
+parser.add_argument('-d', '--dataset', default='VOC', choices=list(DATASETS),
                     help='VOC or COCO dataset')
-parser.add_argument('-bk', '--backbone', type=str, default='r18',
+parser.add_argument('-bk', '--backbone', type=str, default=RUNTIME['backbone'],
                     help='r18, r50, d19')
 parser.add_argument('-hr', '--high_resolution', type=int, default=0,
                     help='0: use high resolution to pretrain; 1: else not.')                    
 parser.add_argument('-fl', '--use_focal', type=int, default=0,
                     help='0: use focal loss; 1: else not;')
-parser.add_argument('--batch_size', default=64, type=int, 
+parser.add_argument('--batch_size', default=RUNTIME['batch_size'], type=int, 
                     help='Batch size for training')
-parser.add_argument('--lr', default=1e-3, type=int, 
+parser.add_argument('--rect', action='store_true', default=False,
+                    help='Keep the aspect ratio of the images and batch those of similar ratio in rectangular shapes')
+parser.add_argument('--lr', default=1e-3, type=float, 
                     help='initial learning rate')
+parser.add_argument('--lr_schedule', default='step', choices=LR_POLICIES,
+                    help='step: drop by gamma at the lr_epoch of the config; cos; one_cycle')
+parser.add_argument('--min_lr', default=1e-6, type=float,
+                    help='Final learning rate of the cos and one_cycle schedules')
+parser.add_argument('--max_epoch', default=None, type=int,
+                    help='Number of epochs (default: max_epoch of the config, the lr steps are scaled to it)')
 parser.add_argument('-wp', '--warm_up', type=str, default='yes',
                     help='yes or no to choose using warmup strategy to train')
 parser.add_argument('--wp_epoch', type=int, default=6,
                     help='The upper bound of warm-up')
-parser.add_argument('--dataset_root', default=VOC_ROOT, 
-                    help='Location of VOC root directory')
-parser.add_argument('--num_classes', default=20, type=int, 
-                    help='The number of dataset classes')
+parser.add_argument('--dataset_root', default=None, 
+                    help='Location of VOC (default: VOC_ROOT) or COCO (default: COCO_ROOT) root directory')
+parser.add_argument('--coco_set', default=DATASETS['COCO']['train_set'], type=str,
+                    help='COCO image set to train on')
+parser.add_argument('--coco_eval_set', default=DATASETS['COCO']['eval_set'], type=str,
+                    help='COCO image set evaluated by --eval_every')
+parser.add_argument('--num_classes', default=None, type=int, 
+                    help='The number of dataset classes (default: 20 on VOC, 80 on COCO)')
 parser.add_argument('--momentum', default=0.9, type=float, 
                     help='Momentum value for optim')
 parser.add_argument('--weight_decay', default=5e-4, type=float, 
                     help='Weight decay for SGD')
 parser.add_argument('--gamma', default=0.1, type=float, 
                     help='Gamma update for SGD')
-parser.add_argument('--num_workers', default=8, type=int, 
+parser.add_argument('--num_workers', default=RUNTIME['num_workers'], type=int, 
                     help='Number of workers used in dataloading')
 parser.add_argument('--gpu_ind', default=0, type=int, 
                     help='To choose your gpu.')
 parser.add_argument('--save_folder', default='weights/', type=str, 
                     help='Gamma update for SGD')
+parser.add_argument('--save_every', default=10, type=int,
+                    help='Save a checkpoint every N epochs')
+parser.add_argument('--keep_checkpoints', default=3, type=int,
+                    help='Number of checkpoints kept in save_folder (0: keep all)')
+parser.add_argument('--resume', default=None, type=str,
+                    help='Checkpoint to resume training from, or "latest" for the newest one in save_folder')
+parser.add_argument('--seed', default=None, type=int,
+                    help='Seed of the data order (default: random, saved in the checkpoints)')
+parser.add_argument('--ema', action='store_true', default=False,
+                    help='Keep an exponential moving average of the weights, saved and evaluated instead of them')
+parser.add_argument('--ema_decay', default=0.9999, type=float,
+                    help='Decay of the EMA')
+parser.add_argument('--eval_every', default=0, type=int,
+                    help='Evaluate the mAP on VOC2007 test every N epochs (0: off)')
+parser.add_argument('--telemetry_every', default=50, type=int,
+                    help='Sample the step-time breakdown every N iterations (0: off)')
+parser.add_argument('--telemetry_file', default='log/telemetry.jsonl', type=str,
+                    help='JSONL file the sampled telemetry is appended to')
 
 args = parser.parse_args()
+if args.dataset_root is None:
+    args.dataset_root = COCO_ROOT if args.dataset == 'COCO' else VOC_ROOT
+if args.num_classes is None:
+    args.num_classes = DATASETS[args.dataset]['num_classes']
 
 
 
@@ -93,9 +133,9 @@ def train(model):
         use_focal = True
 
 
-    dataset = VOCDetection(root=args.dataset_root,
-                            transform=SSDAugmentation(cfg['min_dim'],
-                                                        MEANS))
+    dataset = build_dataset(args.dataset, train=True, root=args.dataset_root,
+                            image_set=args.coco_set if args.dataset == 'COCO' else None,
+                            transform=SSDAugmentation(cfg['min_dim'], MEANS, keep_ratio=args.rect))
 
     from torch.utils.tensorboard import SummaryWriter
     log_path = 'log/'
@@ -103,6 +143,7 @@ def train(model):
         os.mkdir(log_path)
 
     writer = SummaryWriter(log_path)
+    telemetry = TrainTelemetry(writer, args.telemetry_file, device, every=args.telemetry_every)
     
     print("----------------------------------------Object Detection--------------------------------------------")
     print("Let's train OD network !")
@@ -118,129 +159,183 @@ def train(model):
     print('Training on:', dataset.name)
     print('The dataset size:', len(dataset))
 
-    step_index = 0
-    epoch_size = len(dataset) // args.batch_size
+    max_epoch = args.max_epoch if args.max_epoch is not None else cfg['max_epoch']
     # each part of loss weight
     obj_w = 1.0
     cla_w = 1.0
     box_w = 5.0
 
-    data_loader = data.DataLoader(dataset, args.batch_size,
-                                  num_workers=args.num_workers,
-                                  shuffle=True, collate_fn=detection_collate,
-                                  pin_memory=True)
+    # the shuffle and the seeds of the workers are drawn from this generator,
+    # reseeded every epoch, so the data order of an epoch only depends on the
+    # seed and the epoch and a resumed run sees the same batches
+    generator = torch.Generator()
+    if args.rect:
+        # batches of images of similar aspect ratio, padded to the smallest
+        # shape that holds them, a multiple of the largest stride
+        sampler = GroupedBatchSampler(dataset.image_sizes(), args.batch_size, shuffle=True, generator=generator)
+        data_loader = data.DataLoader(dataset, batch_sampler=sampler,
+                                      num_workers=args.num_workers,
+                                      collate_fn=RectCollate(int(np.max(yolo_net.stride))),
+                                      pin_memory=True, generator=generator)
+    else:
+        data_loader = data.DataLoader(dataset, args.batch_size,
+                                      num_workers=args.num_workers,
+                                      shuffle=True, collate_fn=detection_collate,
+                                      pin_memory=True, generator=generator)
+    epoch_size = len(data_loader)
+    lr_epoch = [e * max_epoch // cfg['max_epoch'] for e in cfg['lr_epoch']]
+    scheduler = LRScheduler(optimizer, args.lr, max_epoch * epoch_size, policy=args.lr_schedule,
+                            warmup_iters=args.wp_epoch * epoch_size if args.warm_up == 'yes' else 0,
+                            milestones=[e * epoch_size for e in lr_epoch], gamma=args.gamma,
+                            min_lr=args.min_lr)
     # create batch iterator
     iteration = 0
+    start_epoch = 0
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 31)
+
+    resume = args.resume
+    if resume == 'latest':
+        resume = latest_checkpoint(args.save_folder, args.version)
+        if resume is None:
+            print('No checkpoint in %s, training from scratch.' % args.save_folder)
+    if resume is not None:
+        checkpoint = load_file(resume)
+        if checkpoint.get('version') != args.version:
+            raise ValueError('%s is a checkpoint of %s, not %s' % (resume, checkpoint.get('version'), args.version))
+        net.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        start_epoch = checkpoint['epoch'] + 1
+        iteration = checkpoint['iteration']
+        if 'lr_scheduler' in checkpoint:
+            scheduler.load_state_dict(checkpoint['lr_scheduler'])
+        else:
+            # checkpoints of the old lr handling only stored the step_index
+            print('Warning: %s has no lr_scheduler state, the lr schedule resumes at epoch %d'
+                  % (resume, start_epoch + 1))
+            scheduler.load_state_dict({'iteration': start_epoch * epoch_size})
+        seed = checkpoint['seed']
+        set_rng_state(checkpoint['rng'])
+        print('Resume training from %s at epoch %d' % (resume, start_epoch + 1))
+
+    ema = None
+    if args.ema:
+        ema = ModelEMA(net, args.ema_decay)
+        if resume is not None and 'ema' in checkpoint:
+            ema.load_state_dict(checkpoint['ema'])
+    if resume is not None:
+        del checkpoint
+
+    saver = CheckpointSaver(args.save_folder, args.version, keep=args.keep_checkpoints)
 
     # start training
-    for epoch in range(cfg['max_epoch']):
+    for epoch in range(start_epoch, max_epoch):
+        generator.manual_seed(seed + epoch)
         batch_iterator = iter(data_loader)
-        
-        # No WarmUp strategy or WarmUp tage has finished.
-        if epoch in cfg['lr_epoch']:
-            step_index += 1
-            adjust_learning_rate(optimizer, args.gamma, step_index)
 
+        telemetry.begin()
         for images, targets in batch_iterator:
-            # WarmUp strategy for learning rate
-            if args.warm_up == 'yes':
-                if epoch < args.wp_epoch:
-                    warmup_strategy(optimizer, args.gamma, epoch, epoch_size, iteration)
+            telemetry.mark('data')
+            lr = scheduler.step()
             iteration += 1
             # load train data
             # images, targets = next(batch_iterator)
             targets = [label.tolist() for label in targets]
+            # the shape of this batch, min_dim unless --rect
+            input_size = list(images.shape[-2:])
             if args.version == 'yolo_v1_ms':
-                targets = tools.multi_gt_creator(input_size=cfg['min_dim'], strides=yolo_net.stride, scale_thresholds=cfg['scale_thresh'], 
+                targets = tools.multi_gt_creator(input_size=input_size, strides=yolo_net.stride, scale_thresholds=cfg['scale_thresh'], 
                                                  num_classes=args.num_classes, label_lists=targets, use_anchor=use_anchor)
             elif args.version == 'yolo_anchor_ms':
-                targets = tools.multi_gt_creator(input_size=cfg['min_dim'], strides=yolo_net.stride, scale_thresholds=None,
+                targets = tools.multi_gt_creator(input_size=input_size, strides=yolo_net.stride, scale_thresholds=None,
                                                  num_classes=args.num_classes, label_lists=targets, use_anchor=use_anchor)
             else:
-                targets = tools.gt_creator(cfg['min_dim'], yolo_net.stride, args.num_classes, targets, use_anchor=use_anchor)
+                targets = tools.gt_creator(input_size, yolo_net.stride, args.num_classes, targets, use_anchor=use_anchor)
             
-            targets = torch.tensor(targets).float().to(device)
+            targets = torch.tensor(targets).float()
+            telemetry.mark('target')
+
+            images = images.to(device, non_blocking=True)
+            targets = targets.to(device, non_blocking=True)
+            telemetry.mark('h2d')
 
             # forward
             t0 = time.time()
-            out = net(images.to(device))
+            out = net(images)
+            telemetry.mark('forward')
             
             optimizer.zero_grad()
             
             obj_loss, class_loss, box_loss = tools.loss(out, targets, args.num_classes, use_anchor=use_anchor, use_focal=use_focal)
             # print(obj_loss.item(), class_loss.item(), box_loss.item())
             total_loss = obj_w * obj_loss + cla_w * class_loss + box_w * box_loss
+            telemetry.mark('loss')
             # viz loss
             writer.add_scalar('object loss', obj_loss.item(), iteration)
             writer.add_scalar('class loss', class_loss.item(), iteration)
             writer.add_scalar('local loss', box_loss.item(), iteration)
+            writer.add_scalar('lr', lr, iteration)
             # backprop
             total_loss.backward()
+            telemetry.mark('backward')
             optimizer.step()
+            if ema is not None:
+                ema.update()
+            telemetry.mark('optimizer')
             t1 = time.time()
 
             if iteration % 10 == 0:
                 print('timer: %.4f sec.' % (t1 - t0))
                 print('iter ' + repr(iteration) + ' || Loss: %.4f ||' % (total_loss.item()) + ' || lr: %.8f ||' % (lr), end=' ')
 
-        if (epoch + 1) % 10 == 0:
+            telemetry.end_step(iteration, images.size(0), batch_iterator)
+
+        eval_now = args.eval_every > 0 and (epoch + 1) % args.eval_every == 0
+        if (epoch + 1) % args.save_every == 0 or epoch + 1 == max_epoch or eval_now:
             print('Saving state, epoch:', epoch + 1)
-            torch.save(yolo_net.state_dict(), args.save_folder+ '/' + args.version + '_' +
-                    repr(epoch + 1) + '.pth')
-
-
-def adjust_learning_rate(optimizer, gamma, step_index):
-    global lr
-    """Sets the learning rate to the initial LR decayed by 10 at every
-        specified step
-    # Adapted from PyTorch Imagenet example:
-    # https://github.com/pytorch/examples/blob/master/imagenet/main.py
-    """
-    lr = args.lr * (gamma ** (step_index))
-    for param_group in optimizer.param_groups:
-        param_group['lr'] = lr
-
-def warmup_strategy(optimizer, gamma, epoch, epoch_size, iteration):
-    global lr
-    lr = 1e-6 + (args.lr-1e-6) * iteration / (epoch_size * (args.wp_epoch)) 
-    for param_group in optimizer.param_groups:
-        param_group['lr'] = lr
+            extra = {'ema': ema.state_dict()} if ema is not None else {}
+            saver.save(training_state(yolo_net, optimizer, epoch, iteration, lr_scheduler=scheduler.state_dict(),
+                                      seed=seed, version=args.version, **extra), epoch + 1)
+        if eval_now:
+            saver.wait()
+            evaluate(saver.path(epoch + 1), epoch + 1, writer)
+
+    saver.close()
+    telemetry.close()
+
+
+def evaluate(path, epoch, writer):
+    """mAP of a checkpoint on VOC2007 test (AP@[.5:.95] on COCO --coco_eval_set), of its EMA
+    weights when it has them, by eval_voc.py in a new process."""
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_voc.py'),
+           '-v', args.version, '-bk', args.backbone, '--trained_model', path, '-d', args.dataset,
+           '--cuda', str(torch.cuda.is_available())]
+    if args.dataset == 'COCO':
+        cmd += ['--coco_root', args.dataset_root, '--coco_set', args.coco_eval_set]
+    else:
+        cmd += ['--voc_root', args.dataset_root]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    for line in result.stdout.splitlines():
+        if line.startswith('Mean AP = '):
+            mAP = float(line[len('Mean AP = '):])
+            print('epoch %d: mAP = %.4f' % (epoch, mAP))
+            writer.add_scalar('mAP', mAP, epoch)
+            return mAP
+    print('epoch %d: evaluation failed (exit code %d)' % (epoch, result.returncode))
+    return None
+
 
 if __name__ == '__main__':
     global hr, cfg, use_anchor
 
     hr = False
-    use_anchor = False
     device = get_device()
     
     if args.high_resolution == 1:
         hr = True
 
-    if args.version == 'yolo_v1':
-        from models.yolo_v1 import myYOLOv1
-        cfg = voc_af
-        
-        yolo_net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=args.num_classes, trainable=True, hr=hr, backbone=args.backbone)
-        print('Let us train yolo-v1 on the VOC0712 dataset ......')
-    
-    elif args.version == 'yolo_anchor':
-        from models.yolo_anchor import myYOLOv1
-        cfg = voc_ab
-        use_anchor = True
-        total_anchor_size = tools.get_total_anchor_size(cfg['min_dim'], cfg['stride'])
-        
-        yolo_net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=args.num_classes, trainable=True, anchor_size=total_anchor_size, hr=hr, backbone=args.backbone)
-        print('Let us train yolo-anchor on the VOC0712 dataset ......')
-     
-    elif args.version == 'yolo_v1_ms':
-        from models.yolo_v1_ms import myYOLOv1
-        cfg = voc_af
-        
-        yolo_net = myYOLOv1(device, input_size=cfg['min_dim'], num_classes=args.num_classes, trainable=True, hr=hr, backbone=args.backbone)
-        print('Let us train yolo-v1-ms on the VOC0712 dataset ......')
-        
-    else:
-        print('Unknown Version !!!')
-        exit()
-    
+    yolo_net, cfg = build_model(args.version, device, args.dataset, trainable=True, backbone=args.backbone,
+                                num_classes=args.num_classes, hr=hr)
+    use_anchor = MODELS[args.version]['anchor']
+    print('Let us train %s on the %s dataset ......' % (args.version, args.dataset))
+
     train(yolo_net)
\ No newline at end of file
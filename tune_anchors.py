@@ -0,0 +1,150 @@
+"""Search and score the anchor boxes of yolo_anchor on the training annotations.
+
+Every candidate anchor set is scored with the assigner that training uses
+(tools.match_anchors / tools.assign_anchors) on all the gt boxes of the
+training set. The scores are:
+    bpr         best possible recall: gt boxes with an anchor above IGNORE_THRESH
+    anchors/gt  anchor boxes assigned to a gt box
+    unassigned  gt boxes that lose every anchor slot to a later gt box in the same
+                cell of the same image, so they are never trained on
+The current config.ANCHOR_SIZE is scored first. A k-means seed
+(utils/generate_ab_kmeans.py) is then refined by a genetic search that
+mutates the anchors and keeps every fitter set, on a sample of the boxes
+(--search_boxes). This is done for each candidate stride, and all the
+scores are computed on every box.
+
+    python tune_anchors.py --strides 16 32 --n_anchors 5 --generations 1000
+"""
+import time
+import json
+import argparse
+import numpy as np
+from data import config, VOC_ROOT, VOCDetection
+from utils.generate_ab_kmeans import load_boxes, anchor_box_kmeans
+import tools
+
+
+parser = argparse.ArgumentParser(description='YOLO anchor tuner')
+parser.add_argument('--voc_root', default=VOC_ROOT,
+                    help='Location of VOC root directory')
+parser.add_argument('--input_size', type=int, nargs=2, default=config.voc_ab['min_dim'],
+                    help='Training input size [H, W]')
+parser.add_argument('--strides', type=int, nargs='+', default=[config.voc_ab['stride']],
+                    help='Candidate strides of the anchor head')
+parser.add_argument('--n_anchors', type=int, default=len(config.ANCHOR_SIZE),
+                    help='Number of anchor boxes')
+parser.add_argument('--restarts', type=int, default=4,
+                    help='k-means restarts of the seed')
+parser.add_argument('--generations', type=int, default=1000,
+                    help='Generations of the genetic search')
+parser.add_argument('--mutation_prob', type=float, default=0.9,
+                    help='Probability of mutating each anchor coordinate')
+parser.add_argument('--sigma', type=float, default=0.1,
+                    help='Std of the multiplicative mutations')
+parser.add_argument('--search_boxes', type=int, default=10000,
+                    help='The genetic search runs on a random sample of this many gt boxes')
+parser.add_argument('--num_workers', type=int, default=None,
+                    help='Processes for parsing and the k-means restarts (0: run serially)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed')
+parser.add_argument('--output', type=str, default=None,
+                    help='JSON file the scores and anchors are written to')
+
+args = parser.parse_args()
+
+
+def box_wh(boxes, input_size, stride):
+    """[N, 2] sizes of the gt boxes in grid cells."""
+    return (boxes[:, 2:] - boxes[:, :2]) * np.array([input_size[1], input_size[0]], dtype=np.float64) / stride
+
+
+def fitness(wh, anchors):
+    """Mean best IoU of the gt boxes, counting only those above the ignore thresh.
+    The IoU is that of tools.match_anchors, in float32 for the search."""
+    anchors = anchors.astype(np.float32)
+    inter = np.minimum(wh[:, 0:1], anchors[:, 0]) * np.minimum(wh[:, 1:2], anchors[:, 1])
+    iou = inter / (wh[:, 0:1] * wh[:, 1:2] + anchors[:, 0] * anchors[:, 1] - inter + 1e-20)
+    best = iou.max(1)
+    return float((best * (best > tools.ignore_thresh)).mean())
+
+
+def evaluate(boxes, image_index, anchors, input_size, stride):
+    wh = box_wh(boxes, input_size, stride)
+    iou, mask = tools.match_anchors(wh, anchors)
+    best = iou.max(1)
+    gt_index = tools.assign_anchors(boxes, image_index, input_size, stride, anchors)[0]
+    unassigned = len(boxes) - len(np.unique(gt_index))
+    return {'bpr': float((best > tools.ignore_thresh).mean()),
+            'anchors_per_gt': float(mask.sum(1).mean()),
+            'unassigned': int(unassigned),
+            'unassigned_ratio': unassigned / max(len(boxes), 1),
+            'mean_best_iou': float(best.mean()),
+            'fitness': float((best * (best > tools.ignore_thresh)).mean())}
+
+
+def evolve(wh, anchors, generations, mutation_prob, sigma, rng):
+    """
+        Genetic refinement: every generation scales each anchor coordinate by a
+        random factor with probability mutation_prob, and keeps the mutant when
+        its fitness is higher.
+    """
+    anchors = np.array(anchors, dtype=np.float64)
+    wh = wh.astype(np.float32)
+    best = fitness(wh, anchors)
+    for _ in range(generations):
+        v = np.ones(anchors.shape)
+        while (v == 1).all():
+            v = ((rng.random_sample(anchors.shape) < mutation_prob) * rng.randn(*anchors.shape) * sigma + 1).clip(0.3, 3.0)
+        candidate = (anchors * v).clip(min=0.05)
+        f = fitness(wh, candidate)
+        if f > best:
+            best, anchors = f, candidate
+    return anchors[np.argsort(anchors[:, 0] * anchors[:, 1])], best
+
+
+def report(stride, name, scores):
+    print('{:>6d} {:<10s} {:>8.4f} {:>11.2f} {:>11d} {:>10.4f} {:>9.4f}'.format(
+        stride, name, scores['bpr'], scores['anchors_per_gt'], scores['unassigned'],
+        scores['mean_best_iou'], scores['fitness']))
+
+
+def main():
+    rng = np.random.RandomState(args.seed)
+    t0 = time.perf_counter()
+    dataset = VOCDetection(args.voc_root)
+    boxes, image_index = load_boxes(dataset, args.num_workers)
+    valid = ((boxes[:, 2:] - boxes[:, :2]) > 0).all(1)
+    boxes, image_index = boxes[valid], image_index[valid]
+    print('Loaded {:d} gt boxes of {:d} images in {:.2f}s'.format(
+        len(boxes), len(dataset), time.perf_counter() - t0))
+
+    # the config anchors are in cells of the configured stride
+    config_px = np.array(config.ANCHOR_SIZE, dtype=np.float64) * config.voc_ab['stride']
+    print('{:>6s} {:<10s} {:>8s} {:>11s} {:>11s} {:>10s} {:>9s}'.format(
+        'stride', 'anchors', 'bpr', 'anchors/gt', 'unassigned', 'mean IoU', 'fitness'))
+    results = []
+    for stride in args.strides:
+        t1 = time.perf_counter()
+        wh = box_wh(boxes, args.input_size, stride)
+        candidates = [('config', config_px / stride)]
+        kmeans, _ = anchor_box_kmeans(wh, args.n_anchors, restarts=args.restarts,
+                                      num_workers=args.num_workers, seed=args.seed)
+        candidates.append(('kmeans', kmeans))
+        sample = wh[rng.permutation(len(wh))[:args.search_boxes]]
+        evolved, _ = evolve(sample, kmeans, args.generations, args.mutation_prob, args.sigma, rng)
+        candidates.append(('evolved', evolved))
+        for name, anchors in candidates:
+            scores = evaluate(boxes, image_index, anchors, args.input_size, stride)
+            report(stride, name, scores)
+            results.append(dict(stride=stride, name=name, anchors=np.round(anchors, 2).tolist(), **scores))
+        print('stride {:d}: searched in {:.2f}s, ANCHOR_SIZE = ['.format(stride, time.perf_counter() - t1) +
+              ', '.join('[{:.2f}, {:.2f}]'.format(w, h) for w, h in evolved) + ']')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'input_size': args.input_size, 'num_boxes': len(boxes), 'results': results}, f, indent=2)
+        print('Saved the scores to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
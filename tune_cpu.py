@@ -0,0 +1,113 @@
+"""Find the fastest cpu execution config of a detector on this host.
+
+Sweeps intra-op threads, batch sizes and the memory format of the raw
+network and saves, per host and model, the config with the lowest batch-1
+latency (used by test_voc.py / eval_voc.py in cpu mode) and the one with the
+highest throughput to cpu_tuning.json.
+
+    python tune_cpu.py -v yolo_v1 -bk r18 d19 --threads 1 2 4 8 --batch_sizes 1 4 8
+"""
+import time
+import argparse
+import numpy as np
+import torch
+from data import config, VOC_CLASSES
+from utils.cpu_mode import TUNING_FILE, save_tuning, host_key
+from models import factory
+
+
+parser = argparse.ArgumentParser(description='YOLO-v1 CPU Tuner')
+parser.add_argument('-v', '--version', default='yolo_v1',
+                    help='yolo_v1, yolo_anchor, yolo_v1_ms')
+parser.add_argument('-bk', '--backbones', nargs='+', default=[config.RUNTIME['backbone']],
+                    help='r18, r50, d19')
+parser.add_argument('--threads', nargs='+', type=int, default=None,
+                    help='Intra-op thread counts to sweep (default: powers of two up to the core count)')
+parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 2, 4, 8],
+                    help='Batch sizes to sweep')
+parser.add_argument('--warmup', type=int, default=3,
+                    help='Untimed iterations before measuring')
+parser.add_argument('--iters', type=int, default=10,
+                    help='Timed iterations')
+parser.add_argument('--output', type=str, default=TUNING_FILE,
+                    help='JSON file the tuned configs are saved to')
+
+args = parser.parse_args()
+
+
+def build_model(version, backbone):
+    net, _ = factory.build_model(version, torch.device('cpu'), 'VOC', backbone=backbone,
+                                 num_classes=len(VOC_CLASSES))
+    # inference mode sets up the grids; the raw network is timed
+    net.trainable = True
+    return net.eval()
+
+
+def measure(net, x):
+    """Median latency in seconds of the raw network on `x`."""
+    times = []
+    with torch.no_grad():
+        for i in range(args.warmup + args.iters):
+            t0 = time.perf_counter()
+            net(x)
+            if i >= args.warmup:
+                times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def tune(version, backbone):
+    net = build_model(version, backbone)
+    h, w = net.input_size
+    results = []
+    for channels_last in (False, True):
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        net = net.to(memory_format=memory_format)
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                x = torch.randn(batch_size, 3, h, w).contiguous(memory_format=memory_format)
+                t = measure(net, x)
+                results.append({'threads': threads,
+                                'batch_size': batch_size,
+                                'channels_last': channels_last,
+                                'latency_ms': t * 1000.,
+                                'images_per_sec': batch_size / t})
+                print('{:s} {:s} threads={:d} batch={:d} {:s} | {:.2f}ms {:.1f} img/s'.format(
+                    version, backbone, threads, batch_size,
+                    'channels_last' if channels_last else 'contiguous',
+                    t * 1000., batch_size / t))
+
+    latency = min((r for r in results if r['batch_size'] == 1), key=lambda r: r['latency_ms'], default=None)
+    throughput = max(results, key=lambda r: r['images_per_sec'])
+    return {'latency': latency,
+            'throughput': throughput,
+            'input_size': [h, w],
+            'torch': torch.__version__,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main():
+    if args.threads is None:
+        cores = torch.get_num_threads()
+        args.threads = sorted(set([2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores] + [cores]))
+
+    for backbone in args.backbones:
+        best = tune(args.version, backbone)
+        if best['latency'] is None:
+            print('WARNING: no batch size 1 run, {:s} {:s} gets no latency config.'.format(args.version, backbone))
+            continue
+        save_tuning(args.version, backbone, best, args.output)
+        print('Best for {:s} {:s} on {:s}: latency {:d} threads {:s} ({:.2f}ms), '
+              'throughput {:d} threads batch {:d} {:s} ({:.1f} img/s)'.format(
+                  args.version, backbone, host_key(),
+                  best['latency']['threads'],
+                  'channels_last' if best['latency']['channels_last'] else 'contiguous',
+                  best['latency']['latency_ms'],
+                  best['throughput']['threads'], best['throughput']['batch_size'],
+                  'channels_last' if best['throughput']['channels_last'] else 'contiguous',
+                  best['throughput']['images_per_sec']))
+    print('Saved tuned configs to {:s}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
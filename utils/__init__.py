@@ -1,2 +1,9 @@
-from .augmentations import SSDAugmentation
-from .modules import *
\ No newline at end of file
+from .modules import *
+
+
+def __getattr__(name):
+    # the augmentations need cv2 and torchvision, so they are only imported when used
+    if name == 'SSDAugmentation':
+        from .augmentations import SSDAugmentation
+        return SSDAugmentation
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -4,6 +4,7 @@ import cv2
 import numpy as np
 import types
 from numpy import random
+from data.sampler import fit_size
 
 
 def intersect(box_a, box_b):
@@ -111,6 +112,18 @@ class Resize(object):
         return image, boxes, labels
 
 
+class FitResize(object):
+    """Resize to fit in size with the aspect ratio kept, for batches padded to
+    their shape by data.RectCollate."""
+    def __init__(self, size=300):
+        self.size = size
+
+    def __call__(self, image, boxes=None, labels=None):
+        h, w = fit_size(image.shape[0], image.shape[1], self.size)
+        image = cv2.resize(image, (w, h))
+        return image, boxes, labels
+
+
 class RandomSaturation(object):
     def __init__(self, lower=0.5, upper=1.5):
         self.lower = lower
@@ -398,7 +411,7 @@ class PhotometricDistort(object):
 
 
 class SSDAugmentation(object):
-    def __init__(self, size=300, mean=(104, 117, 123)):
+    def __init__(self, size=300, mean=(104, 117, 123), keep_ratio=False):
         self.mean = mean
         self.size = size
         self.augment = Compose([
@@ -409,7 +422,7 @@ class SSDAugmentation(object):
             RandomSampleCrop(),
             RandomMirror(),
             ToPercentCoords(),
-            Resize(self.size),
+            FitResize(self.size) if keep_ratio else Resize(self.size),
             SubtractMeans(self.mean)
         ])
 
@@ -0,0 +1,198 @@
+"""Saving and loading of weights and training checkpoints.
+
+`load_file` reads a file written by torch.save with mmap, so the tensors are
+paged in from the page cache as they are copied into the model, and maps
+them straight to the target device.
+
+    load_weights(net, args.trained_model, device)
+
+A training checkpoint is a dict with the model under 'model' and the rest of
+the training state (optimizer, epoch, iteration, lr step, RNG states) next
+to it; `load_weights` accepts both it and a bare state_dict, and takes the
+EMA weights of a checkpoint (under 'ema', see utils/ema.py) when it has them. `CheckpointSaver`
+copies the state to the cpu and writes it on a background thread, through a
+temporary file that is renamed in place, so an interrupted save never leaves
+a truncated checkpoint, and only the last `keep` checkpoints it wrote are kept;
+the files an earlier run left in the folder are never removed.
+
+    saver = CheckpointSaver(args.save_folder, args.version, keep=3)
+    saver.save(training_state(net, optimizer, epoch, ...), epoch + 1)
+    ...
+    saver.close()
+"""
+import os
+import re
+import queue
+import random
+import threading
+import collections
+import numpy as np
+import torch
+
+
+def load_file(path, map_location='cpu'):
+    """torch.load with mmap; files in the legacy (non-zip) format are read normally."""
+    try:
+        return torch.load(path, map_location=map_location, mmap=True)
+    except RuntimeError:
+        return torch.load(path, map_location=map_location)
+
+
+def load_weights(net, path, map_location='cpu'):
+    """Load the weights of a trained model into `net`, from a state_dict or a training checkpoint."""
+    state = load_file(path, map_location)
+    if 'ema' in state and isinstance(state['ema'], dict):
+        state = state['ema']['model']
+    elif 'model' in state and isinstance(state['model'], dict):
+        state = state['model']
+    net.load_state_dict(state)
+    return net
+
+
+def rng_state():
+    """The states of the python, numpy, torch and cuda random generators, as
+    tensors and python numbers so that torch.load(weights_only=True) reads them."""
+    kind, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {'python': random.getstate(),
+             'numpy': (kind, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    kind, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((kind, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def training_state(net, optimizer, epoch, iteration, **extra):
+    """
+        Input:
+            epoch : int -> the last finished epoch, training resumes at epoch + 1.
+            iteration : int -> iterations done so far.
+            extra -> anything else to restore, e.g. step_index=step_index.
+        Output:
+            state : dict -> the checkpoint to save.
+    """
+    state = {'model': net.state_dict(),
+             'optimizer': optimizer.state_dict(),
+             'epoch': epoch,
+             'iteration': iteration,
+             'rng': rng_state()}
+    state.update(extra)
+    return state
+
+
+def _to_cpu(obj):
+    """Copy of the tensors of a nested state on the cpu, so training can go on
+    updating the originals while it is written."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def save_file(obj, path):
+    """torch.save through a temporary file in the same directory, renamed over `path`
+    once it is on disk."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def list_checkpoints(folder, prefix):
+    """[(epoch, path), ...] of the checkpoints named <prefix>_<epoch>.pth, oldest first."""
+    if not os.path.isdir(folder):
+        return []
+    pattern = re.compile(re.escape(prefix) + r'_(\d+)\.pth$')
+    found = []
+    for name in os.listdir(folder):
+        m = pattern.match(name)
+        if m is not None:
+            found.append((int(m.group(1)), os.path.join(folder, name)))
+    return sorted(found)
+
+
+def latest_checkpoint(folder, prefix):
+    """Path of the most recently written checkpoint, or None. By mtime, not by
+    epoch: a folder may hold the higher epochs of an earlier run."""
+    found = list_checkpoints(folder, prefix)
+    return max(found, key=lambda f: os.path.getmtime(f[1]))[1] if found else None
+
+
+class CheckpointSaver(object):
+    def __init__(self, folder, prefix, keep=3):
+        """
+            Input:
+                folder : str -> the checkpoints are <folder>/<prefix>_<epoch>.pth.
+                keep : int -> the number of checkpoints of this saver kept (0: keep all);
+                       the files that were in the folder before are never removed.
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.prefix = prefix
+        self.keep = keep
+        # the paths written by this saver, oldest first
+        self.saved = collections.deque()
+        self.error = None
+        # one save in flight: a new one waits for the previous to be written,
+        # so at most one extra copy of the state is held in memory
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def path(self, epoch):
+        return os.path.join(self.folder, '{}_{}.pth'.format(self.prefix, epoch))
+
+    def save(self, state, epoch):
+        """Snapshot `state` now and write it in the background."""
+        self._raise()
+        self.queue.put((_to_cpu(state), self.path(epoch)))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            state, path = item
+            try:
+                save_file(state, path)
+                if path not in self.saved:
+                    self.saved.append(path)
+                self._prune()
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+
+    def _prune(self):
+        if self.keep <= 0:
+            return
+        while len(self.saved) > self.keep:
+            os.remove(self.saved.popleft())
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        """Block until the pending save is on disk."""
+        self.queue.join()
+        self._raise()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._raise()
@@ -0,0 +1,150 @@
+"""COCO box AP in numpy, following the matching and the 101-point precision of
+the official evaluation (pycocotools COCOeval), without depending on it.
+
+The detections of every image and class are limited to the top max_dets by
+score and matched greedily, in score order, to the gt boxes of the same class
+at IoU thresholds 0.50:0.95. A crowd gt box can absorb any number of
+detections, and the IoU with it is the intersection over the detection
+area. Crowd boxes, and gt boxes outside the area range, are ignored, as are
+the detections they absorb.
+
+    stats = coco_eval(all_boxes, dataset.index, dataset.ids)
+"""
+import numpy as np
+
+
+IOU_THRESHOLDS = np.linspace(.5, .95, 10)
+RECALL_THRESHOLDS = np.linspace(.0, 1.00, 101)
+AREA_RANGES = (('all', 0., 1e10), ('small', 0., 32. ** 2), ('medium', 32. ** 2, 96. ** 2), ('large', 96. ** 2, 1e10))
+
+
+def box_iou(dets, gts, iscrowd):
+    """[D, G] IoU of (xmin, ymin, xmax, ymax) boxes; crowd gt boxes over the detection area only."""
+    lt = np.maximum(dets[:, None, :2], gts[None, :, :2])
+    rb = np.minimum(dets[:, None, 2:], gts[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0., None), axis=2)
+    det_area = np.prod(dets[:, 2:] - dets[:, :2], axis=1)[:, None]
+    gt_area = np.prod(gts[:, 2:] - gts[:, :2], axis=1)[None, :]
+    union = np.where(iscrowd[None, :], det_area, det_area + gt_area - inter)
+    return inter / np.maximum(union, 1e-12)
+
+
+def match_image(iou, gt_ignore, iscrowd):
+    """
+        Greedy matching of the detections of one image and class, for all IoU thresholds.
+        Input:
+            iou : ndarray -> [D, G], the detections sorted by score.
+            gt_ignore : ndarray -> [G,] bool.
+            iscrowd : ndarray -> [G,] bool.
+        Output:
+            matched : ndarray -> [T, D] bool.
+            ignored : ndarray -> [T, D] bool, matched to an ignored gt box.
+    """
+    T, (D, G) = len(IOU_THRESHOLDS), iou.shape
+    matched = np.zeros((T, D), dtype=np.bool_)
+    ignored = np.zeros((T, D), dtype=np.bool_)
+    if D == 0 or G == 0:
+        return matched, ignored
+    gt_taken = np.zeros((T, G), dtype=np.bool_)
+    thresh = np.minimum(IOU_THRESHOLDS, 1 - 1e-10)[:, None]
+    rows = np.arange(T)
+    for d in range(D):
+        # a gt box can be matched once, unless it is a crowd
+        valid = (~gt_taken | iscrowd) & (iou[d] >= thresh)
+        # the best gt box that is not ignored, else the best ignored one
+        best_kept = np.where(valid & ~gt_ignore, iou[d], -1.)
+        best_ignored = np.where(valid & gt_ignore, iou[d], -1.)
+        use_kept = best_kept.max(1) >= 0
+        # the last of equal IoUs wins, as in pycocotools
+        m = np.where(use_kept, G - 1 - best_kept[:, ::-1].argmax(1), G - 1 - best_ignored[:, ::-1].argmax(1))
+        found = use_kept | (best_ignored.max(1) >= 0)
+        matched[:, d] = found
+        ignored[:, d] = found & gt_ignore[m]
+        gt_taken[rows[found], m[found]] = True
+    return matched, ignored
+
+
+def coco_eval(all_boxes, index, image_indices, max_dets=100):
+    """
+        Input:
+            all_boxes : list -> all_boxes[cls][image] = [N, 5] detections (x1, y1, x2, y2, score)
+                        in pixels, as collected by eval_voc.test_net.
+            index : dict -> the index of the image set (data.coco.load_index).
+            image_indices : ndarray -> the row in the index of every evaluated image.
+        Output:
+            stats : dict -> AP, AP50, AP75, APs, APm, APl and AR100.
+    """
+    num_classes = len(all_boxes)
+    offsets = index['offsets']
+    # scores, matched and ignored of every detection, and the number of kept gt
+    # boxes, per class and area range
+    scores = [[[] for _ in AREA_RANGES] for _ in range(num_classes)]
+    matches = [[[] for _ in AREA_RANGES] for _ in range(num_classes)]
+    ignores = [[[] for _ in AREA_RANGES] for _ in range(num_classes)]
+    npos = np.zeros((num_classes, len(AREA_RANGES)), dtype=np.int64)
+
+    for im, i in enumerate(image_indices):
+        start, end = offsets[i], offsets[i + 1]
+        image_labels = index['label'][start:end]
+        for c in range(num_classes):
+            dets = all_boxes[c][im]
+            in_class = image_labels == c
+            if len(dets) == 0 and not in_class.any():
+                continue
+            dets = dets[np.argsort(-dets[:, 4], kind='mergesort')[:max_dets]]
+            gts = index['bbox'][start:end][in_class]
+            iscrowd = index['iscrowd'][start:end][in_class]
+            gt_area = index['area'][start:end][in_class]
+            det_area = np.prod(dets[:, 2:4] - dets[:, :2], axis=1)
+            iou = box_iou(dets[:, :4], gts, iscrowd)
+            for a, (_, lo, hi) in enumerate(AREA_RANGES):
+                gt_ignore = iscrowd | (gt_area < lo) | (gt_area > hi)
+                # ignored gt boxes go last, the matching prefers the others
+                order = np.argsort(gt_ignore, kind='mergesort')
+                matched, ignored = match_image(iou[:, order], gt_ignore[order], iscrowd[order])
+                # unmatched detections outside the area range do not count
+                ignored |= ~matched & ((det_area < lo) | (det_area > hi))[None, :]
+                scores[c][a].append(dets[:, 4])
+                matches[c][a].append(matched)
+                ignores[c][a].append(ignored)
+                npos[c, a] += int((~gt_ignore).sum())
+
+    T, R = len(IOU_THRESHOLDS), len(RECALL_THRESHOLDS)
+    precision = -np.ones((T, R, num_classes, len(AREA_RANGES)))
+    recall = -np.ones((T, num_classes, len(AREA_RANGES)))
+    for c in range(num_classes):
+        for a in range(len(AREA_RANGES)):
+            if npos[c, a] == 0:
+                continue
+            if not scores[c][a]:
+                precision[:, :, c, a] = 0.
+                recall[:, c, a] = 0.
+                continue
+            order = np.argsort(-np.concatenate(scores[c][a]), kind='mergesort')
+            matched = np.concatenate(matches[c][a], axis=1)[:, order]
+            ignored = np.concatenate(ignores[c][a], axis=1)[:, order]
+            tp = np.cumsum(matched & ~ignored, axis=1).astype(np.float64)
+            fp = np.cumsum(~matched & ~ignored, axis=1).astype(np.float64)
+            for t in range(T):
+                rc = tp[t] / npos[c, a]
+                pr = tp[t] / np.maximum(tp[t] + fp[t], np.spacing(1))
+                recall[t, c, a] = rc[-1] if len(rc) else 0.
+                # precision envelope, then sampled at the recall thresholds
+                pr = np.maximum.accumulate(pr[::-1])[::-1]
+                inds = np.searchsorted(rc, RECALL_THRESHOLDS, side='left')
+                q = np.zeros(R)
+                valid = inds < len(pr)
+                q[valid] = pr[inds[valid]]
+                precision[t, :, c, a] = q
+
+    def mean_ap(iou=None, area='all'):
+        a = [name for name, _, _ in AREA_RANGES].index(area)
+        p = precision[:, :, :, a] if iou is None else precision[np.isclose(IOU_THRESHOLDS, iou), :, :, a]
+        p = p[p > -1]
+        return float(p.mean()) if p.size else -1.
+
+    r = recall[:, :, 0]
+    r = r[r > -1]
+    return {'AP': mean_ap(), 'AP50': mean_ap(.5), 'AP75': mean_ap(.75),
+            'APs': mean_ap(area='small'), 'APm': mean_ap(area='medium'), 'APl': mean_ap(area='large'),
+            'AR100': float(r.mean()) if r.size else -1.}
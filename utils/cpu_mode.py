@@ -0,0 +1,104 @@
+"""CPU execution mode: thread configuration and channels_last inference.
+
+The images come out of cv2 / BaseTransform as HWC arrays. `image_to_tensor`
+permutes them to NCHW as a view, which for one image already has the
+channels_last memory layout, so a channels_last model reads the HWC buffer
+as is and no NCHW copy is made.
+
+The best thread count / batch size per model can be measured with
+`python tune_cpu.py` and is saved per host; `setup_cpu` falls back to the
+saved config for this host when no thread count is given.
+
+    net, channels_last = setup_cpu(net, 'yolo_v1', 'r18', threads=None)
+    x = image_to_tensor(img, channels_last)
+"""
+import os
+import json
+import socket
+import numpy as np
+import torch
+
+
+TUNING_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cpu_tuning.json')
+
+
+def configure_threads(threads=None, interop_threads=None):
+    """Set the intra-op and inter-op thread pools; None keeps the torch default."""
+    if threads is not None and threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads is not None and interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            print('WARNING: inter-op threads already in use, keeping {:d}.'.format(
+                torch.get_num_interop_threads()))
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def image_to_tensor(img, channels_last=False):
+    """
+        Input:
+            img : ndarray -> [H, W, 3] float32 image, as returned by BaseTransform.
+            channels_last : bool -> keep the HWC memory layout.
+        Output:
+            x : tensor -> [1, 3, H, W].
+    """
+    x = torch.from_numpy(np.ascontiguousarray(img)).permute(2, 0, 1).unsqueeze(0)
+    if channels_last:
+        # no-op: the permuted HWC buffer is channels_last already
+        return x.contiguous(memory_format=torch.channels_last)
+    return x.contiguous()
+
+
+def to_channels_last(net):
+    return net.to(memory_format=torch.channels_last)
+
+
+def host_key():
+    return '{:s}/{:d}cpu'.format(socket.gethostname(), os.cpu_count() or 1)
+
+
+def model_key(version, backbone):
+    return '{:s}/{:s}'.format(version, backbone)
+
+
+def load_tuning(path=TUNING_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_tuning(version, backbone, config, path=TUNING_FILE):
+    """Store the tuned `config` of a model under this host, keeping the other entries."""
+    tuning = load_tuning(path)
+    tuning.setdefault(host_key(), {})[model_key(version, backbone)] = config
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(tuning, f, indent=2)
+    os.replace(tmp, path)
+
+
+def tuned_config(version, backbone, path=TUNING_FILE):
+    """The config saved by tune_cpu.py for this host and model, or None."""
+    return load_tuning(path).get(host_key(), {}).get(model_key(version, backbone))
+
+
+def setup_cpu(net, version, backbone, threads=None, interop_threads=None, channels_last=True,
+              path=TUNING_FILE):
+    """
+        Configure the thread pools and the memory format for cpu inference at
+        batch size 1. Without `threads` the latency-optimal thread count saved
+        by tune_cpu.py for this host is used, if there is one.
+    """
+    config = tuned_config(version, backbone, path)
+    if threads is None and config is not None:
+        threads = config['latency']['threads']
+        channels_last = config['latency']['channels_last']
+    threads, interop_threads = configure_threads(threads, interop_threads)
+    if channels_last:
+        net = to_channels_last(net)
+    print('CPU mode: {:d} intra-op threads, {:d} inter-op threads, {:s}.'.format(
+        threads, interop_threads, 'channels_last' if channels_last else 'contiguous'))
+    return net, channels_last
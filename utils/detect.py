@@ -0,0 +1,108 @@
+"""Batched inference with the eager detectors.
+
+In inference mode the models handle one image per forward. `detect_batch`
+runs the raw network once on a whole batch and then decodes and
+postprocesses every image the way the models' forward does, with the
+models' own decode_boxes / postprocess / clip_boxes.
+
+Before decoding, the candidates can be cut to the top-k by score
+(objectness x class probability) on the device, so only those are decoded,
+copied to the host and seen by NMS: `top_k` per image (the models'
+attribute), and `global_top_k` over a whole batch.
+"""
+import torch
+from utils.profiler import to_host
+
+
+def topk_candidates(all_class, k):
+    """
+        Input:
+            all_class : tensor -> [N, num_classes] scores of one image.
+            k : int -> number of candidates to keep, None or 0 for all.
+        Output:
+            index : tensor -> [k] indices of the best candidates in ascending order,
+                    or None when all are kept.
+    """
+    if not k or k >= all_class.size(0):
+        return None
+    index = all_class.max(1)[0].topk(k)[1]
+    # ascending, so ties are broken as without the selection
+    return index.sort()[0]
+
+
+def batch_topk_candidates(all_class, top_k=None, global_top_k=None):
+    """
+        Input:
+            all_class : tensor -> [B, N, num_classes] scores of a batch.
+            top_k : int -> candidates kept per image.
+            global_top_k : int -> candidates kept over the whole batch, after top_k.
+        Output:
+            index : list -> per image, the indices of its kept candidates in ascending
+                    order, or None when all are kept.
+    """
+    B, N, _ = all_class.size()
+    if (not top_k or top_k >= N) and (not global_top_k or global_top_k >= B * N):
+        return None
+    scores = all_class.max(2)[0]
+    mask = torch.ones_like(scores, dtype=torch.bool)
+    if top_k and top_k < N:
+        mask = torch.zeros_like(mask).scatter_(1, scores.topk(top_k, 1)[1], True)
+    if global_top_k and global_top_k < int(mask.sum()):
+        best = scores.masked_fill(~mask, -1.).view(-1).topk(global_top_k)[1]
+        mask = torch.zeros_like(mask).view(-1).index_fill_(0, best, True).view(B, N)
+    return [m.nonzero()[:, 0] for m in mask]
+
+
+def decode_batch(net, x, global_top_k=None):
+    """
+        Input:
+            net : nn.Module -> detector in inference mode, set up for the size of x.
+            x : tensor -> [B, 3, H, W] input images.
+            global_top_k : int -> decode only the best candidates of the whole batch.
+        Output:
+            decoded : list -> (all_bbox [N, 4] normalized to the input, all_class [N, num_classes])
+                      numpy arrays per image, before thresholding and NMS.
+    """
+    trainable = net.trainable
+    net.trainable = True
+    with torch.no_grad():
+        prediction = net(x)
+    net.trainable = trainable
+
+    num_classes = net.num_classes
+    anchor_number = getattr(net, 'anchor_number', 0)
+    decoded = []
+    with torch.no_grad():
+        all_obj = torch.sigmoid(prediction[:, :, :1])
+        batch_class = torch.softmax(prediction[:, :, 1:1+num_classes], 2) * all_obj
+        indices = batch_topk_candidates(batch_class, getattr(net, 'top_k', None), global_top_k)
+        for i in range(prediction.size(0)):
+            all_class = batch_class[i]
+            box_pred = prediction[i:i+1, :, 1+num_classes:]
+            index = None if indices is None else indices[i]
+            if index is not None:
+                all_class = all_class[index]
+                box_pred = box_pred[:, index]
+            elif anchor_number > 0:
+                box_pred = box_pred.view(1, -1, anchor_number, 4)
+            all_bbox = net.decode_boxes(box_pred, index)[0] / net.scale_torch
+            all_class, all_bbox = to_host(all_class, all_bbox)
+            decoded.append((all_bbox, all_class))
+    return decoded
+
+
+def postprocess(net, all_bbox, all_class):
+    """Threshold, NMS and clip one decoded image, as the models' forward does."""
+    bboxes, scores, cls_inds = net.postprocess(all_bbox, all_class)
+    bboxes *= net.scale
+    bboxes = net.clip_boxes(bboxes, net.input_size) / net.scale
+    return bboxes, scores, cls_inds
+
+
+def detect_batch(net, x, global_top_k=None):
+    """
+        Output:
+            detections : list -> (bboxes, scores, cls_inds) per image, boxes in [0, 1].
+    """
+    return [postprocess(net, all_bbox, all_class)
+            for all_bbox, all_class in decode_batch(net, x, global_top_k)]
@@ -0,0 +1,68 @@
+"""Exponential moving average of the weights of a model during training.
+
+The shadow copy is updated after every optimizer step with one fused
+multi-tensor lerp over all the floating point parameters and buffers
+(torch._foreach_lerp_), not a python loop of per-tensor ops. Integer
+buffers (num_batches_tracked) are copied. The decay ramps up over the first
+updates, so the early, random weights are forgotten quickly:
+
+    decay = decay * (1 - exp(-updates / tau))
+
+    ema = ModelEMA(net)        # after net is moved to its device
+    ...
+    optimizer.step()
+    ema.update()
+"""
+import copy
+import math
+import torch
+
+
+class ModelEMA(object):
+    def __init__(self, model, decay=0.9999, tau=2000, updates=0):
+        """
+            Input:
+                model : nn.Module -> the trained model. Its tensors are bound once
+                        here, so it must not be moved to another device afterwards.
+                decay : float -> the decay once ramped up.
+                tau : float -> updates to ramp the decay up to 1 - 1/e of it.
+        """
+        self.ema = copy.deepcopy(model).eval()
+        for p in self.ema.parameters():
+            p.requires_grad_(False)
+        self.decay = decay
+        self.tau = tau
+        self.updates = updates
+        self._bind(model)
+
+    def _bind(self, model):
+        model_state = model.state_dict()
+        ema_state = self.ema.state_dict()
+        self.ema_float, self.model_float, self.ema_other, self.model_other = [], [], [], []
+        for k, v in ema_state.items():
+            if v.is_floating_point():
+                self.ema_float.append(v)
+                self.model_float.append(model_state[k].detach())
+            else:
+                self.ema_other.append(v)
+                self.model_other.append(model_state[k])
+
+    def get_decay(self):
+        return self.decay * (1. - math.exp(-self.updates / self.tau))
+
+    @torch.no_grad()
+    def update(self):
+        self.updates += 1
+        d = self.get_decay()
+        # ema = d * ema + (1 - d) * model
+        torch._foreach_lerp_(self.ema_float, self.model_float, 1. - d)
+        for e, m in zip(self.ema_other, self.model_other):
+            e.copy_(m)
+
+    def state_dict(self):
+        return {'model': self.ema.state_dict(), 'updates': self.updates}
+
+    def load_state_dict(self, state):
+        # copied in place, so the bound tensors stay valid
+        self.ema.load_state_dict(state['model'])
+        self.updates = state['updates']
@@ -0,0 +1,137 @@
+"""TorchScript / ONNX export of the detectors, postprocess included.
+
+The eager models copy their predictions to NumPy for thresholding, NMS and
+clipping, which can't be traced. `DetectorExport` runs the network in its
+raw (training) mode and expresses decoding, the score threshold, per-class
+NMS and clipping with torch ops, so the whole detector traces into a single
+graph. Like the eager models it handles one image per forward and returns
+boxes normalized to [0, 1], scores and class indices.
+"""
+import copy
+import inspect
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision.ops import batched_nms
+
+
+class DetectorExport(nn.Module):
+    def __init__(self, net):
+        super(DetectorExport, self).__init__()
+        net = copy.deepcopy(net).eval()
+        self.num_classes = net.num_classes
+        self.conf_thresh = net.conf_thresh
+        self.nms_thresh = net.nms_thresh
+        self.anchor_number = getattr(net, 'anchor_number', 0)
+        self.input_size = net.input_size
+        # in training mode forward returns the raw [B, N, 1 + num_classes + 4] prediction
+        net.trainable = True
+        self.net = net
+
+    def forward(self, x):
+        prediction = self.net(x)
+        obj = torch.sigmoid(prediction[0, :, :1])
+        cls = torch.softmax(prediction[0, :, 1:1+self.num_classes], 1) * obj
+        box_pred = prediction[:, :, 1+self.num_classes:]
+        if self.anchor_number > 0:
+            box_pred = box_pred.view(1, -1, self.anchor_number, 4)
+        bboxes = self.net.decode_boxes(box_pred)[0]
+
+        scores, cls_inds = cls.max(1)
+        # drop the boxes without area, as multiclass_nms does
+        keep = (scores >= self.conf_thresh) & (bboxes[:, 2] > bboxes[:, 0]) & (bboxes[:, 3] > bboxes[:, 1])
+        bboxes, scores, cls_inds = bboxes[keep], scores[keep], cls_inds[keep]
+
+        keep = batched_nms(bboxes, scores, cls_inds, self.nms_thresh)
+        bboxes, scores, cls_inds = bboxes[keep], scores[keep], cls_inds[keep]
+
+        # clip to the input and normalize, as the eager postprocess does
+        h, w = self.input_size
+        bboxes = torch.stack([bboxes[:, 0].clamp(0, w - 1) / w,
+                              bboxes[:, 1].clamp(0, h - 1) / h,
+                              bboxes[:, 2].clamp(0, w - 1) / w,
+                              bboxes[:, 3].clamp(0, h - 1) / h], 1)
+        return bboxes, scores, cls_inds
+
+
+def export_torchscript(net, path):
+    model = DetectorExport(net)
+    h, w = model.input_size
+    x = torch.randn(1, 3, h, w, device=next(model.parameters()).device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, x, check_trace=False)
+    traced.save(path)
+    print('Saved TorchScript module to {:s}'.format(path))
+    return traced
+
+
+def export_onnx(net, path, opset_version=11):
+    model = DetectorExport(net)
+    h, w = model.input_size
+    x = torch.randn(1, 3, h, w, device=next(model.parameters()).device)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript-based exporter carries the symbolic of torchvision's nms
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(model, x, path, opset_version=opset_version,
+                          input_names=['image'],
+                          output_names=['boxes', 'scores', 'labels'],
+                          dynamic_axes={'boxes': {0: 'num'}, 'scores': {0: 'num'}, 'labels': {0: 'num'}},
+                          **kwargs)
+    print('Saved ONNX graph to {:s}'.format(path))
+
+
+def compare(ref, out):
+    """Max box / score difference between two (bboxes, scores, cls_inds), or None
+    if they keep a different number of detections per class. Detections are
+    matched to the nearest box of the same class, as near-equal scores may be
+    ordered differently."""
+    ref_boxes, ref_scores, ref_cls = [np.asarray(a) for a in ref]
+    out_boxes, out_scores, out_cls = [np.asarray(a) for a in out]
+    if len(ref_cls) != len(out_cls) or \
+            (np.bincount(ref_cls, minlength=1) != np.bincount(out_cls, minlength=1)).any():
+        return None
+    box_diff, score_diff = 0., 0.
+    for c in np.unique(ref_cls):
+        r, o = ref_cls == c, out_cls == c
+        dist = np.abs(ref_boxes[r][:, None, :] - out_boxes[o][None, :, :]).max(-1)
+        nearest = dist.argmin(1)
+        box_diff = max(box_diff, float(dist.min(1).max()))
+        score_diff = max(score_diff, float(np.abs(ref_scores[r] - out_scores[o][nearest]).max()))
+    return box_diff, score_diff
+
+
+def check_parity(net, inputs, torchscript_path=None, onnx_path=None):
+    """
+        Run the eager model, the TorchScript module and the ONNX graph (on cpu with
+        onnxruntime) on every input and compare their detections.
+        Input:
+            net : nn.Module -> the eager detector in inference mode, on cpu.
+            inputs : list -> [1, 3, H, W] cpu tensors.
+        Output:
+            ok : bool -> every exported model kept the same detections within 1e-4.
+    """
+    ok = True
+    runners = []
+    if torchscript_path is not None:
+        module = torch.jit.load(torchscript_path, map_location='cpu')
+        runners.append(('torchscript', lambda x: [t.numpy() for t in module(x)]))
+    if onnx_path is not None:
+        import onnxruntime
+        session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        runners.append(('onnxruntime', lambda x: session.run(None, {'image': x.numpy()})))
+
+    net.eval()
+    for i, x in enumerate(inputs):
+        with torch.no_grad():
+            ref = net(x)
+            for name, run in runners:
+                diff = compare(ref, run(x))
+                if diff is None or max(diff) > 1e-4:
+                    ok = False
+                print('input {:d} {:s}: {:d} detections, {:s}'.format(
+                    i, name, len(ref[0]),
+                    'different detections' if diff is None
+                    else 'max box diff {:.2e}, max score diff {:.2e}'.format(*diff)))
+    return ok
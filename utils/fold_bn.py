@@ -0,0 +1,125 @@
+"""Fold BatchNorm layers into the preceding convolutions for inference.
+
+In eval mode a BatchNorm2d is a per-channel affine transform, so it can be
+merged into the weight and bias of the conv right before it. `fold_bn`
+handles the two layouts used in this repo:
+
+    nn.Sequential(conv, bn, ...)       utils.Conv2d, branch.conv1x1/fusion,
+                                       darknet.Conv_BN_LeakyReLU, resnet downsample
+    self.convN ... self.bnN            resnet stem, BasicBlock, Bottleneck
+
+The folded BatchNorm is replaced by nn.Identity, so the forward code of the
+modules is unchanged.
+"""
+import copy
+import torch
+import torch.nn as nn
+
+
+def fuse_conv_bn(conv, bn):
+    """Return a conv equivalent to bn(conv(x)) with bn in eval mode."""
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                      stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                      groups=conv.groups, bias=True).to(conv.weight.device)
+    with torch.no_grad():
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        if bn.affine:
+            scale = bn.weight * scale
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        bias = (bias - bn.running_mean) * scale
+        if bn.affine:
+            bias = bias + bn.bias
+        fused.bias.copy_(bias)
+    return fused
+
+
+def _foldable(conv, bn):
+    return isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) \
+        and bn.track_running_stats and conv.out_channels == bn.num_features
+
+
+def _fold_module(module):
+    count = 0
+    if isinstance(module, nn.Sequential):
+        for i in range(len(module) - 1):
+            if _foldable(module[i], module[i + 1]):
+                module[i] = fuse_conv_bn(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+                count += 1
+
+    children = dict(module.named_children())
+    for name, child in children.items():
+        if name.startswith('bn') and ('conv' + name[2:]) in children:
+            conv = children['conv' + name[2:]]
+            if _foldable(conv, child):
+                setattr(module, 'conv' + name[2:], fuse_conv_bn(conv, child))
+                setattr(module, name, nn.Identity())
+                count += 1
+
+    for child in module.children():
+        count += _fold_module(child)
+    return count
+
+
+def fold_bn(model, inplace=False):
+    """
+        Input:
+            model : nn.Module -> a trained detector, backbone or head.
+            inplace : bool -> fold into `model` itself instead of a copy.
+        Output:
+            model : nn.Module -> the equivalent model in eval mode without foldable BatchNorm.
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model.eval()
+    count = _fold_module(model)
+    print('Folded {:d} BatchNorm layers into convolutions.'.format(count))
+    return model
+
+
+def _randomize_bn(model):
+    # fresh BatchNorm layers are identities; give them non-trivial statistics
+    for m in model.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+
+
+def check_equivalence(model, inputs, rtol=1e-5):
+    """Compare the outputs of `model` and of its folded copy on `inputs`,
+    relative to the largest output magnitude."""
+    model.eval()
+    folded = fold_bn(model)
+    remaining = sum(isinstance(m, nn.BatchNorm2d) for m in folded.modules())
+    with torch.no_grad():
+        ref, out = model(inputs), folded(inputs)
+    ref = ref if isinstance(ref, (list, tuple)) else [ref]
+    out = out if isinstance(out, (list, tuple)) else [out]
+    max_diff = max(((r - o).abs().max() / r.abs().max().clamp(min=1e-12)).item()
+                   for r, o in zip(ref, out))
+    return max_diff < rtol and remaining == 0, max_diff
+
+
+if __name__ == "__main__":
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from backbone import resnet18, resnet50, darknet19
+    from utils.modules import conv_set, branch
+
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, 224, 224)
+    cases = [
+        ('resnet18', resnet18(), x),
+        ('resnet50', resnet50(), x),
+        ('darknet19', darknet19(), x),
+        ('conv_set', conv_set(64, 32, 64, 3, leakyReLU=True), torch.randn(2, 64, 14, 14)),
+        ('branch', branch(64, leakyReLU=True), torch.randn(2, 64, 14, 14)),
+    ]
+    for name, model, inputs in cases:
+        _randomize_bn(model)
+        ok, max_diff = check_equivalence(model, inputs)
+        print('{:<10s} max relative diff = {:.2e} {:s}'.format(name, max_diff, 'ok' if ok else 'FAILED'))
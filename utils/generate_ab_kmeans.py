@@ -1,168 +1,235 @@
-from data import *
+"""k-means of the gt box sizes for the anchor boxes of yolo_anchor.
+
+The boxes are an [N, 2] array of (w, h) in grid cells of the input size.
+The distance of a box to an anchor is 1 - IoU with both centered at the same
+point, so the IoUs of all boxes to all anchors are one [N, K] array op.
+Large datasets can use mini-batch k-means, and the restarts run in parallel
+processes; the one with the lowest loss wins. The image sizes are read from
+the annotations, the images are never decoded.
+
+    python utils/generate_ab_kmeans.py --n_anchors 5 --restarts 8
+"""
+import os
+import sys
+import functools
 import numpy as np
-import random
+from concurrent.futures import ProcessPoolExecutor
+if sys.version_info[0] == 2:
+    import xml.etree.cElementTree as ET
+else:
+    import xml.etree.ElementTree as ET
 
-class Box():
-    def __init__(self, x, y, w, h):
-        self.x = x
-        self.y = y
-        self.w = w
-        self.h = h
 
-def iou(box1, box2):
-    x1, y1, w1, h1 = box1.x, box1.y, box1.w, box1.h
-    x2, y2, w2, h2 = box2.x, box2.y, box2.w, box2.h
+def wh_iou(wh, centroids):
+    """
+        Input:
+            wh : ndarray -> [N, 2] box sizes.
+            centroids : ndarray -> [K, 2] anchor sizes.
+        Output:
+            iou : ndarray -> [N, K] IoU of every box and anchor, centered at the same point.
+    """
+    inter = np.minimum(wh[:, None, 0], centroids[None, :, 0]) * np.minimum(wh[:, None, 1], centroids[None, :, 1])
+    union = (wh[:, 0] * wh[:, 1])[:, None] + (centroids[:, 0] * centroids[:, 1])[None, :] - inter
+    return inter / np.maximum(union, 1e-12)
+
+
+def assign(wh, centroids, chunk=1 << 20):
+    """Nearest anchor and its distance (1 - IoU) of every box, in chunks of boxes."""
+    groups = np.empty(len(wh), dtype=np.int64)
+    distance = np.empty(len(wh), dtype=np.float64)
+    for start in range(0, len(wh), chunk):
+        iou = wh_iou(wh[start:start + chunk], centroids)
+        groups[start:start + chunk] = iou.argmax(1)
+        distance[start:start + chunk] = 1. - iou.max(1)
+    return groups, distance
 
-    S_1 = w1 * h1
-    S_2 = w2 * h2
 
-    xmin_1, ymin_1 = x1 - w1 / 2, y1 - h1 / 2
-    xmax_1, ymax_1 = x1 + w1 / 2, y1 + h1 / 2
-    xmin_2, ymin_2 = x2 - w2 / 2, y2 - h2 / 2
-    xmax_2, ymax_2 = x2 + w2 / 2, y2 + h2 / 2
+def init_centroids(wh, n_anchors, rng):
+    """
+        We use kmeans++ to initialize centroids.
+    """
+    centroids = np.empty((n_anchors, 2), dtype=np.float64)
+    centroids[0] = wh[rng.randint(len(wh))]
+    min_distance = 1. - wh_iou(wh, centroids[:1])[:, 0]
+    for i in range(1, n_anchors):
+        # the next centroid is drawn with probability proportional to the distance
+        cumsum = np.cumsum(min_distance)
+        index = min(np.searchsorted(cumsum, cumsum[-1] * rng.random_sample(), side='right'), len(wh) - 1)
+        centroids[i] = wh[index]
+        min_distance = np.minimum(min_distance, 1. - wh_iou(wh, centroids[i:i + 1])[:, 0])
+    return centroids
 
-    I_w = min(xmax_1, xmax_2) - max(xmin_1, xmin_2)
-    I_h = min(ymax_1, ymax_2) - max(ymin_1, ymin_2)
-    if I_w < 0 or I_h < 0:
-        return 0
-    I = I_w * I_h
 
-    IoU = I / (S_1 + S_2 - I)
+def do_kmeans(wh, centroids):
+    """One Lloyd iteration. Empty clusters keep their centroid."""
+    groups, distance = assign(wh, centroids)
+    n_anchors = len(centroids)
+    counts = np.bincount(groups, minlength=n_anchors)
+    new_centroids = centroids.copy()
+    filled = counts > 0
+    new_centroids[filled, 0] = np.bincount(groups, weights=wh[:, 0], minlength=n_anchors)[filled] / counts[filled]
+    new_centroids[filled, 1] = np.bincount(groups, weights=wh[:, 1], minlength=n_anchors)[filled] / counts[filled]
+    return new_centroids, groups, distance.sum()
 
-    return IoU
 
-def init_centroids(boxes, n_anchors):
+def do_minibatch_kmeans(wh, centroids, batch_size, iters, rng, tol=1e-6):
     """
-        We use kmeans++ to initialize centroids.
+        Mini-batch k-means (Sculley, 2010): every step assigns a random batch of
+        boxes and moves each centroid towards its boxes with a rate of 1 / (boxes
+        it has seen so far).
     """
-    centroids = []
-    boxes_num = len(boxes)
-
-    centroid_index = int(np.random.choice(boxes_num, 1)[0])
-    centroids.append(boxes[centroid_index])
-    print(centroids[0].w,centroids[0].h)
-
-    for centroid_index in range(0, n_anchors-1):
-        sum_distance = 0
-        distance_thresh = 0
-        distance_list = []
-        cur_sum = 0
-
-        for box in boxes:
-            min_distance = 1
-            for centroid_i, centroid in enumerate(centroids):
-                distance = (1 - iou(box, centroid))
-                if distance < min_distance:
-                    min_distance = distance
-            sum_distance += min_distance
-            distance_list.append(min_distance)
-
-        distance_thresh = sum_distance * np.random.random()
-
-        for i in range(0, boxes_num):
-            cur_sum += distance_list[i]
-            if cur_sum > distance_thresh:
-                centroids.append(boxes[i])
-                print(boxes[i].w, boxes[i].h)
-                break
+    counts = np.zeros(len(centroids), dtype=np.float64)
+    for _ in range(iters):
+        batch = wh[rng.randint(len(wh), size=batch_size)]
+        groups, _ = assign(batch, centroids)
+        old = centroids.copy()
+        for k in np.unique(groups):
+            members = batch[groups == k]
+            counts[k] += len(members)
+            centroids[k] += (members.sum(0) - len(members) * centroids[k]) / counts[k]
+        if np.abs(centroids - old).max() < tol:
+            break
     return centroids
 
-def do_kmeans(n_anchors, boxes, centroids):
-    loss = 0
-    groups = []
-    new_centroids = []
-    # for box in centroids:
-    #     print('box: ', box.x, box.y, box.w, box.h)
-    # exit()
-    for i in range(n_anchors):
-        groups.append([])
-        new_centroids.append(Box(0, 0, 0, 0))
-    
-    for box in boxes:
-        min_distance = 1
-        group_index = 0
-        for centroid_index, centroid in enumerate(centroids):
-            distance = (1 - iou(box, centroid))
-            if distance < min_distance:
-                min_distance = distance
-                group_index = centroid_index
-        groups[group_index].append(box)
-        loss += min_distance
-        new_centroids[group_index].w += box.w
-        new_centroids[group_index].h += box.h
-
-    for i in range(n_anchors):
-        new_centroids[i].w /= max(len(groups[i]), 1)
-        new_centroids[i].h /= max(len(groups[i]), 1)
-
-    return new_centroids, groups, loss# / len(boxes)
-
-def anchor_box_kmeans(total_gt_boxes, n_anchors, loss_convergence, iters, plus=True):
+
+def run_kmeans(wh, n_anchors, loss_convergence=1e-6, iters=1000, plus=True, batch_size=None, seed=0):
+    """
+        One k-means run.
+        Output:
+            centroids : ndarray -> [K, 2] sorted by area.
+            loss : float -> mean distance (1 - IoU) of the boxes to their nearest centroid.
+    """
+    rng = np.random.RandomState(seed)
+    if plus:
+        # for mini-batch k-means, k-means++ on a sample is good enough
+        sample = wh if batch_size is None else wh[rng.randint(len(wh), size=min(len(wh), 10 * batch_size))]
+        centroids = init_centroids(sample, n_anchors, rng)
+    else:
+        centroids = wh[rng.choice(len(wh), n_anchors, replace=False)].astype(np.float64)
+
+    if batch_size is not None:
+        centroids = do_minibatch_kmeans(wh, centroids, batch_size, iters, rng)
+    else:
+        old_loss = None
+        for _ in range(iters):
+            centroids, groups, loss = do_kmeans(wh, centroids)
+            if old_loss is not None and abs(old_loss - loss) < loss_convergence:
+                break
+            old_loss = loss
+
+    centroids = centroids[np.argsort(centroids[:, 0] * centroids[:, 1])]
+    _, distance = assign(wh, centroids)
+    return centroids, float(distance.mean())
+
+
+def anchor_box_kmeans(wh, n_anchors, loss_convergence=1e-6, iters=1000, plus=True,
+                      restarts=1, batch_size=None, num_workers=None, seed=0):
     """
         This function will use k-means to get appropriate anchor boxes for train dataset.
         Input:
-            total_gt_boxes: 
-            n_anchor : int -> the number of anchor boxes.
+            wh : ndarray -> [N, 2] gt box sizes.
+            n_anchors : int -> the number of anchor boxes.
             loss_convergence : float -> threshold of iterating convergence.
-            iters: int -> the number of iterations for training kmeans.
-        Output: anchor_boxes : list -> [[w1, h1], [w2, h2], ..., [wn, hn]].
+            iters : int -> the number of iterations for training kmeans.
+            plus : bool -> initialize with kmeans++.
+            restarts : int -> independent runs, the best one is returned.
+            batch_size : int -> boxes per step of mini-batch k-means (None: full k-means).
+            num_workers : int -> processes for the restarts (0: run them here).
+        Output:
+            anchor_boxes : ndarray -> [[w1, h1], [w2, h2], ..., [wn, hn]], sorted by area.
+            mean_iou : float -> mean IoU of the boxes with their best anchor.
     """
-    boxes = total_gt_boxes
-    centroids = []
-    if plus:
-        centroids = init_centroids(boxes, n_anchors)
+    wh = np.asarray(wh, dtype=np.float64)
+    run = functools.partial(run_kmeans, wh, n_anchors, loss_convergence, iters, plus, batch_size)
+    seeds = [seed + i for i in range(restarts)]
+    if num_workers == 0 or restarts == 1:
+        runs = list(map(run, seeds))
     else:
-        total_indexs = range(len(boxes))
-        sample_indexs = random.sample(total_indexs, n_anchors)
-        for i in sample_indexs:
-            centroids.append(boxes[i])
-
-    # iterate k-means
-    centroids, groups, old_loss = do_kmeans(n_anchors, boxes, centroids)
-    iterations = 1
-    while(True):
-        centroids, groups, loss = do_kmeans(n_anchors, boxes, centroids)
-        iterations += 1
-        print("Loss = %f" % loss)
-        if abs(old_loss - loss) < loss_convergence or iterations > iters:
-            break
-        old_loss = loss
-
-        for centroid in centroids:
-            print(centroid.w, centroid.h)
-    
-    print("k-means result : ") 
-    for centroid in centroids:
-        print(centroid.w, centroid.h)
-    
-    return centroids
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            runs = list(pool.map(run, seeds))
+    for s, (centroids, loss) in zip(seeds, runs):
+        print('seed {:d}: mean IoU = {:.4f}'.format(s, 1. - loss))
+    centroids, loss = min(runs, key=lambda r: r[1])
+    return centroids, 1. - loss
+
+
+def _parse_boxes(filename, target_transform):
+    """(xmin, ymin, xmax, ymax) of the objects of one annotation, normalized by the
+    image size written in it."""
+    root = ET.parse(filename).getroot()
+    size = root.find('size')
+    width, height = int(size.find('width').text), int(size.find('height').text)
+    boxes = target_transform(root, width, height)
+    return np.array(boxes, dtype=np.float64).reshape(-1, 5)[:, :4]
+
+
+def load_boxes(dataset, num_workers=None):
+    """
+        Input:
+            dataset : VOCDetection -> only its annotations are read, with its target_transform.
+        Output:
+            boxes : ndarray -> [N, 4] gt boxes (xmin, ymin, xmax, ymax) between 0 and 1.
+            image_index : ndarray -> [N,] the image of every gt box.
+    """
+    paths = [dataset._annopath % img_id for img_id in dataset.ids]
+    parse = functools.partial(_parse_boxes, target_transform=dataset.target_transform)
+    if num_workers == 0:
+        boxes = list(map(parse, paths))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            boxes = list(pool.map(parse, paths, chunksize=64))
+    image_index = np.repeat(np.arange(len(boxes)), [len(b) for b in boxes])
+    return np.concatenate(boxes), image_index
+
+
+def load_wh(dataset, input_size, stride, num_workers=None):
+    """
+        Input:
+            dataset : VOCDetection -> only its annotations are read, with its target_transform.
+            input_size : list -> [H, W] input size of the model.
+            stride : int -> the box sizes are returned in cells of this stride.
+        Output:
+            wh : ndarray -> [N, 2] gt box sizes.
+    """
+    boxes, _ = load_boxes(dataset, num_workers)
+    wh = boxes[:, 2:] - boxes[:, :2]
+    wh *= np.array([input_size[1], input_size[0]], dtype=np.float64) / stride
+    return wh[(wh > 0).all(1)]
+
 
 if __name__ == "__main__":
-    n_anchors = 6
-    loss_convergence = 1e-6
-    iters_n = 1000
-    input_size = [416, 416] #[h, w]
-    stride = 32
-    dataset = VOCDetection(root=VOC_ROOT,
-                        transform=BaseTransform(input_size, MEANS))
-    boxes = []
+    import argparse
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from data import VOCDetection, VOC_ROOT
+
+    parser = argparse.ArgumentParser(description='Anchor box k-means')
+    parser.add_argument('--voc_root', default=VOC_ROOT,
+                        help='Location of VOC root directory')
+    parser.add_argument('--n_anchors', type=int, default=5,
+                        help='Number of anchor boxes')
+    parser.add_argument('--input_size', type=int, nargs=2, default=[416, 416],
+                        help='Input size [H, W] of the model')
+    parser.add_argument('--stride', type=int, default=32,
+                        help='The anchors are printed in cells of this stride')
+    parser.add_argument('--iters', type=int, default=1000,
+                        help='Maximum iterations of every run')
+    parser.add_argument('--restarts', type=int, default=8,
+                        help='Independent runs, the best one is kept')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='Boxes per step of mini-batch k-means (default: full k-means)')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='Processes for parsing and the restarts (0: run serially)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the first run')
+    args = parser.parse_args()
+
+    dataset = VOCDetection(root=args.voc_root)
     print("The dataset size: ", len(dataset))
-    print("Loading the dataset ...")
-    for i in range(len(dataset)):
-        img = dataset.pull_image(i)
-        w, h = img.shape[1], img.shape[0]
-        _, annotation = dataset.pull_anno(i)
-        for box_and_label in annotation:
-            box = box_and_label[:-1]
-            xmin, ymin, xmax, ymax = box
-            bx = (xmin + xmax) / 2 / w * input_size[1] / stride
-            by = (ymin + ymax) / 2 / h * input_size[0] / stride
-            bw = (xmax - xmin) / w * input_size[1] / stride
-            bh = (ymax - ymin) / h * input_size[0] / stride
-            boxes.append(Box(0, 0, bw, bh))
-    # for i in range(5):
-    #     w, h = 2*(i+1)+np.random.randint(5), 2*(i+1)+np.random.randint(5)
-    #     print(w, h)
-    #     boxes.append(Box(0, 0, w, h))
-    print("Start k-means !")
-    centroids = anchor_box_kmeans(boxes, n_anchors, loss_convergence, iters_n, plus=True)
+    print("Loading the annotations ...")
+    wh = load_wh(dataset, args.input_size, args.stride, args.num_workers)
+    print("Start k-means on {:d} boxes !".format(len(wh)))
+    centroids, mean_iou = anchor_box_kmeans(wh, args.n_anchors, iters=args.iters, restarts=args.restarts,
+                                            batch_size=args.batch_size, num_workers=args.num_workers,
+                                            seed=args.seed)
+    print("k-means result : mean IoU = {:.4f}".format(mean_iou))
+    print('ANCHOR_SIZE = [' + ', '.join('[{:.2f}, {:.2f}]'.format(w, h) for w, h in centroids) + ']')
@@ -0,0 +1,80 @@
+"""Learning rate schedules of the training loop, stepped every iteration.
+
+    step        the lr drops by gamma at each milestone (the original schedule)
+    cos         cosine annealing from the lr down to min_lr
+    one_cycle   the lr rises from lr / div_factor to lr over the first pct_start
+                of the iterations, then anneals down to min_lr, both with a cosine
+
+`step` and `cos` start with a linear warm-up from warmup_lr over warmup_iters;
+one_cycle has its own. The lr is a function of the iteration only, so the
+state to save is the iteration.
+
+    scheduler = LRScheduler(optimizer, args.lr, total_iters, policy='cos', warmup_iters=...)
+    for ...:
+        lr = scheduler.step()
+        ...
+        optimizer.step()
+"""
+import math
+
+
+LR_POLICIES = ('step', 'cos', 'one_cycle')
+
+
+class LRScheduler(object):
+    def __init__(self, optimizer, base_lr, total_iters, policy='step', warmup_iters=0, warmup_lr=1e-6,
+                 milestones=(), gamma=0.1, min_lr=0., pct_start=0.3, div_factor=25.):
+        """
+            Input:
+                base_lr : float -> the peak lr.
+                total_iters : int -> iterations of the whole training.
+                milestones : tuple -> iterations where the step policy drops the lr.
+        """
+        if policy not in LR_POLICIES:
+            raise ValueError('Unknown lr policy: {}'.format(policy))
+        self.optimizer = optimizer
+        self.base_lr = base_lr
+        self.total_iters = total_iters
+        self.policy = policy
+        self.warmup_iters = warmup_iters if policy != 'one_cycle' else 0
+        self.warmup_lr = warmup_lr
+        self.milestones = sorted(milestones)
+        self.gamma = gamma
+        self.min_lr = min_lr
+        self.pct_start = pct_start
+        self.div_factor = div_factor
+        self.iteration = 0
+
+    def get_lr(self, iteration):
+        if iteration < self.warmup_iters:
+            return self.warmup_lr + (self.base_lr - self.warmup_lr) * iteration / self.warmup_iters
+
+        if self.policy == 'step':
+            return self.base_lr * self.gamma ** sum(iteration >= m for m in self.milestones)
+
+        if self.policy == 'cos':
+            progress = (iteration - self.warmup_iters) / max(self.total_iters - self.warmup_iters, 1)
+            return self.min_lr + (self.base_lr - self.min_lr) * (1. + math.cos(math.pi * min(progress, 1.))) / 2.
+
+        # one_cycle
+        up_iters = max(int(self.pct_start * self.total_iters), 1)
+        if iteration < up_iters:
+            start, end, progress = self.base_lr / self.div_factor, self.base_lr, iteration / up_iters
+        else:
+            start, end = self.base_lr, self.min_lr
+            progress = min((iteration - up_iters) / max(self.total_iters - up_iters, 1), 1.)
+        return end + (start - end) * (1. + math.cos(math.pi * progress)) / 2.
+
+    def step(self):
+        """Set the lr of the next iteration on the optimizer and return it."""
+        lr = self.get_lr(self.iteration)
+        for param_group in self.optimizer.param_groups:
+            param_group['lr'] = lr
+        self.iteration += 1
+        return lr
+
+    def state_dict(self):
+        return {'iteration': self.iteration}
+
+    def load_state_dict(self, state):
+        self.iteration = state['iteration']
@@ -0,0 +1,183 @@
+"""Suppression methods for the postprocess of the detectors.
+
+    nms             greedy hard NMS, per class (the original behavior)
+    soft-linear     soft-NMS, scores of overlapping boxes decay by (1 - IoU)
+    soft-gaussian   soft-NMS, scores decay by exp(-IoU^2 / sigma)
+    diou            greedy NMS on IoU minus the normalized center distance
+    matrix          matrix-NMS: every score decays at once from the pairwise
+                    IoU matrix of all classes, no sequential loop
+
+`multiclass_nms` takes the thresholded candidates of one image and returns
+the indices to keep and their (possibly decayed) scores. It is profiled as
+the 'nms' stage, nested in the 'postprocess' stage of the models.
+"""
+import numpy as np
+from utils.profiler import profile_stage
+
+
+NMS_TYPES = ('nms', 'soft-linear', 'soft-gaussian', 'diou', 'matrix')
+
+
+def _iou(box, boxes):
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.maximum(xx2 - xx1, 0.) * np.maximum(yy2 - yy1, 0.)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-12)
+
+
+def hard_nms(dets, scores, thresh):
+    """"Pure Python NMS baseline."""
+    x1 = dets[:, 0]  #xmin
+    y1 = dets[:, 1]  #ymin
+    x2 = dets[:, 2]  #xmax
+    y2 = dets[:, 3]  #ymax
+
+    areas = (x2 - x1) * (y2 - y1)                 # the size of bbox
+    order = scores.argsort()[::-1]                        # sort bounding boxes by decreasing order
+
+    keep = []                                             # store the final bounding boxes
+    while order.size > 0:
+        i = order[0]                                      #the index of the bbox with highest confidence
+        keep.append(i)                                    #save it to keep
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(1e-28, xx2 - xx1)
+        h = np.maximum(1e-28, yy2 - yy1)
+        inter = w * h
+
+        # Cross Area / (bbox + particular area - Cross Area)
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        #reserve all the boundingbox whose ovr less than thresh
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return keep
+
+
+def diou_nms(dets, scores, thresh):
+    """Greedy NMS that suppresses by DIoU = IoU - d^2 / c^2, where d is the distance
+    between the box centers and c the diagonal of their enclosing box."""
+    centers = (dets[:, :2] + dets[:, 2:]) / 2.
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iou = _iou(dets[i], dets[rest])
+        d2 = ((centers[rest] - centers[i]) ** 2).sum(1)
+        enclose = np.maximum(dets[rest, 2:], dets[i, 2:]) - np.minimum(dets[rest, :2], dets[i, :2])
+        c2 = np.maximum((enclose ** 2).sum(1), 1e-12)
+        order = rest[iou - d2 / c2 <= thresh]
+    return keep
+
+
+def soft_nms(dets, scores, thresh, method='linear', sigma=0.5, score_thresh=0.001):
+    """
+        Soft-NMS: instead of removing the boxes overlapping the best one, decay
+        their scores, linearly above `thresh` or with a gaussian of the IoU.
+        Output:
+            keep : list -> indices of the boxes whose score stays above score_thresh.
+            scores : ndarray -> the decayed scores of all boxes.
+    """
+    scores = scores.astype(np.float64)
+    idx = np.arange(len(dets))
+    keep = []
+    while idx.size > 0:
+        best = idx[scores[idx].argmax()]
+        keep.append(best)
+        idx = idx[idx != best]
+        iou = _iou(dets[best], dets[idx])
+        if method == 'linear':
+            scores[idx] *= np.where(iou > thresh, 1. - iou, 1.)
+        else:
+            scores[idx] *= np.exp(-iou ** 2 / sigma)
+        idx = idx[scores[idx] >= score_thresh]
+    return keep, scores
+
+
+def matrix_nms(dets, scores, cls_inds, kernel='gaussian', sigma=0.5):
+    """
+        Matrix-NMS (SOLOv2): the score of every box decays by its IoU with each
+        higher scored box of its class, compensated by how much that box is
+        suppressed itself, all as one matrix operation.
+        Output:
+            scores : ndarray -> the decayed scores, in the input order.
+    """
+    n = len(dets)
+    if n == 0:
+        return scores
+    order = scores.argsort()[::-1]
+    boxes = dets[order]
+    xx1 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    yy1 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    xx2 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    yy2 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    inter = np.maximum(xx2 - xx1, 0.) * np.maximum(yy2 - yy1, 0.)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = inter / np.maximum(areas[:, None] + areas[None, :] - inter, 1e-12)
+    # iou[i, j] for i scored above j and of the same class
+    same_class = cls_inds[order][:, None] == cls_inds[order][None, :]
+    iou = np.triu(iou * same_class, k=1)
+    # how much box i is suppressed itself: its largest IoU with a better box
+    compensate = iou.max(0)[:, None]
+    if kernel == 'linear':
+        decay = ((1. - iou) / np.maximum(1. - compensate, 1e-12)).min(0)
+    else:
+        decay = np.exp(-(iou ** 2 - compensate ** 2) / sigma).min(0)
+    decayed = np.empty_like(scores, dtype=np.float64)
+    decayed[order] = scores[order] * decay
+    return decayed
+
+
+@profile_stage('nms')
+def multiclass_nms(dets, scores, cls_inds, nms_type='nms', thresh=0.45, score_thresh=0.001, sigma=0.5,
+                   matrix_max=2000):
+    """
+        Input:
+            dets : ndarray -> [N, 4] boxes (xmin, ymin, xmax, ymax).
+            scores : ndarray -> [N,]
+            cls_inds : ndarray -> [N,]
+            nms_type : str -> one of NMS_TYPES.
+            thresh : float -> IoU (DIoU) threshold of nms, diou and soft-linear.
+            score_thresh : float -> scores decayed below this are dropped (soft and matrix).
+            sigma : float -> width of the gaussian decay.
+            matrix_max : int -> matrix-NMS only decays the top scored candidates, the
+                         rest are dropped, so the IoU matrix stays bounded.
+        Output:
+            keep : ndarray -> sorted indices of the detections to keep, none without area.
+            scores : ndarray -> [N,] scores after suppression.
+    """
+    # boxes without area are dropped, as in the exported models: they match no
+    # object, and the IoU of two of them is 0 / 0
+    valid = np.where((dets[:, 2] > dets[:, 0]) & (dets[:, 3] > dets[:, 1]))[0]
+    if nms_type == 'matrix':
+        top = valid[np.argsort(-scores[valid], kind='stable')[:matrix_max]]
+        decayed = np.zeros(len(dets), dtype=np.float64)
+        decayed[top] = matrix_nms(dets[top], scores[top], cls_inds[top], sigma=sigma)
+        return np.where(decayed >= score_thresh)[0], decayed
+    if nms_type not in NMS_TYPES:
+        raise ValueError('Unknown nms type: {}'.format(nms_type))
+
+    keep = np.zeros(len(dets), dtype=np.int64)
+    scores = scores.copy()
+    for c in np.unique(cls_inds[valid]):
+        inds = valid[cls_inds[valid] == c]
+        c_bboxes = dets[inds]
+        c_scores = scores[inds]
+        if nms_type == 'nms':
+            c_keep = hard_nms(c_bboxes, c_scores, thresh)
+        elif nms_type == 'diou':
+            c_keep = diou_nms(c_bboxes, c_scores, thresh)
+        else:
+            c_keep, c_scores = soft_nms(c_bboxes, c_scores, thresh, nms_type[len('soft-'):], sigma, score_thresh)
+            scores[inds] = c_scores
+        keep[inds[c_keep]] = 1
+    return np.where(keep > 0)[0], scores
@@ -0,0 +1,173 @@
+"""Opt-in stage profiler for the inference path.
+
+The models mark their post-network stages with `profile_stage`, and `attach`
+adds hooks to the network stages (backbone, conv_set*, branch*, pred*).
+Nothing is recorded until `enable()` is called, so the instrumentation costs
+one flag check per stage otherwise.
+
+    from utils import profiler
+    profiler.attach(net)
+    profiler.enable()
+    net(x)
+    print(profiler.summary())
+    profiler.dump_chrome_trace('trace.json')
+"""
+import json
+import time
+import functools
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+class Profiler(object):
+    """In-process registry of stage events.
+
+    Every event stores its name, start and duration (microseconds), nesting
+    depth and the number of bytes of the tensors / arrays it returned. On
+    cuda the change of allocated device memory is recorded too.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.sync = False
+        self.events = []
+        self.handles = []
+        self._open = {}
+        self._depth = 0
+        self._t0 = time.perf_counter()
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def begin(self, key):
+        cuda_alloc = torch.cuda.memory_allocated() if self.sync else 0
+        self._open[key] = (self._now(), self._depth, cuda_alloc)
+        self._depth += 1
+
+    def end(self, key, name, output=None):
+        t1 = self._now()
+        start, depth, cuda_alloc = self._open.pop(key)
+        self._depth -= 1
+        event = {'name': name, 'ts': start, 'dur': t1 - start,
+                 'depth': depth, 'bytes': nbytes(output)}
+        if self.sync:
+            event['cuda_alloc'] = torch.cuda.memory_allocated() - cuda_alloc
+        self.events.append(event)
+
+
+PROFILER = Profiler()
+
+
+def nbytes(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, np.ndarray):
+        return output.nbytes
+    if isinstance(output, (list, tuple)):
+        return sum(nbytes(o) for o in output)
+    return 0
+
+
+def enable(sync=None):
+    """Start recording. `sync` waits for cuda at every event boundary
+    (default: when cuda is available) so device time is attributed correctly."""
+    PROFILER.enabled = True
+    PROFILER.sync = torch.cuda.is_available() if sync is None else sync
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def reset():
+    PROFILER.events = []
+    PROFILER._open = {}
+    PROFILER._depth = 0
+    PROFILER._t0 = time.perf_counter()
+
+
+def events():
+    return PROFILER.events
+
+
+def profile_stage(name):
+    """Decorator recording every call of a function as the stage `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return fn(*args, **kwargs)
+            key = object()
+            PROFILER.begin(key)
+            out = fn(*args, **kwargs)
+            PROFILER.end(key, name, out)
+            return out
+        return wrapper
+    return decorator
+
+
+@profile_stage('d2h')
+def to_host(*tensors):
+    """Copy tensors to host memory as numpy arrays."""
+    return tuple(t.to('cpu').numpy() for t in tensors)
+
+
+def attach(net):
+    """Hook the forward of `net` and of each of its direct children
+    (backbone, conv_set*, branch*, pred*) into the profiler."""
+    def pre_hook(module, inputs):
+        if PROFILER.enabled:
+            PROFILER.begin(module)
+
+    def make_hook(name):
+        def hook(module, inputs, output):
+            if PROFILER.enabled and module in PROFILER._open:
+                PROFILER.end(module, name, output)
+        return hook
+
+    for name, m in [('forward', net)] + list(net.named_children()):
+        PROFILER.handles.append(m.register_forward_pre_hook(pre_hook))
+        PROFILER.handles.append(m.register_forward_hook(make_hook(name)))
+
+
+def detach():
+    for h in PROFILER.handles:
+        h.remove()
+    PROFILER.handles = []
+
+
+def stage_totals():
+    """Total time (ms), calls and bytes per stage name, in first-seen order."""
+    totals = OrderedDict()
+    for e in PROFILER.events:
+        t = totals.setdefault(e['name'], {'calls': 0, 'ms': 0., 'bytes': 0})
+        t['calls'] += 1
+        t['ms'] += e['dur'] / 1000.
+        t['bytes'] += e['bytes']
+    return totals
+
+
+def summary():
+    """Table of the recorded stages, sorted by their first occurrence."""
+    totals = stage_totals()
+    forward_ms = totals['forward']['ms'] if 'forward' in totals else \
+        sum(t['ms'] for t in totals.values())
+    lines = ['{:<16s}{:>8s}{:>12s}{:>12s}{:>8s}{:>14s}'.format(
+        'stage', 'calls', 'total(ms)', 'mean(ms)', '%', 'bytes/call')]
+    for name, t in totals.items():
+        lines.append('{:<16s}{:>8d}{:>12.3f}{:>12.3f}{:>8.1f}{:>14d}'.format(
+            name, t['calls'], t['ms'], t['ms'] / t['calls'],
+            100. * t['ms'] / max(forward_ms, 1e-12), t['bytes'] // t['calls']))
+    return '\n'.join(lines)
+
+
+def dump_chrome_trace(path):
+    """Write the events in the Chrome trace format (chrome://tracing, Perfetto)."""
+    trace = [{'name': e['name'], 'ph': 'X', 'ts': e['ts'], 'dur': e['dur'],
+              'pid': 0, 'tid': 0,
+              'args': {k: v for k, v in e.items() if k in ('bytes', 'cuda_alloc')}}
+             for e in PROFILER.events]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
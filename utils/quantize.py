@@ -0,0 +1,94 @@
+"""Post-training static int8 quantization of the detectors for cpu inference.
+
+Every direct child of a detector (backbone, conv_set*, branch*, pred*) is a
+plain feed-forward network, so each of them is quantized with FX graph mode:
+
+    prepare_detector   insert observers (Conv+BN+ReLU are fused on the way)
+    calibrate          run the raw network over calibration images
+    convert_detector   swap in the int8 kernels
+
+The glue between the children, box decoding and the NumPy postprocess stay
+in fp32, so the quantized detector has the same forward / postprocess API
+as the float one. Quantized kernels only run on cpu.
+"""
+import copy
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def default_backend():
+    engines = torch.backends.quantized.supported_engines
+    return 'x86' if 'x86' in engines else 'fbgemm'
+
+
+def prepare_detector(net, example, backend=None):
+    """
+        Input:
+            net : nn.Module -> float detector in inference mode, on cpu.
+            example : tensor -> [1, 3, H, W] input used to trace the children.
+            backend : str -> quantized engine, 'x86', 'fbgemm' or 'qnnpack'.
+        Output:
+            net : nn.Module -> a copy of `net` whose children record activation ranges.
+    """
+    backend = backend or default_backend()
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+
+    net = copy.deepcopy(net).cpu().eval()
+    # record the inputs each child sees, to trace it with
+    examples = {}
+    handles = []
+    for name, child in net.named_children():
+        def hook(module, inputs, name=name):
+            examples[name] = inputs
+        handles.append(child.register_forward_pre_hook(hook))
+    trainable = net.trainable
+    net.trainable = True
+    with torch.no_grad():
+        net(example)
+    net.trainable = trainable
+    for h in handles:
+        h.remove()
+
+    for name, inputs in examples.items():
+        setattr(net, name, prepare_fx(getattr(net, name), qconfig_mapping, inputs))
+    return net
+
+
+def calibrate(net, inputs):
+    """Run the raw network over `inputs` so the observers see real activations."""
+    trainable = net.trainable
+    net.trainable = True
+    with torch.no_grad():
+        for x in inputs:
+            net(x)
+    net.trainable = trainable
+    return net
+
+
+def convert_detector(net):
+    for name, child in list(net.named_children()):
+        if isinstance(child, torch.fx.GraphModule):
+            setattr(net, name, convert_fx(child))
+    return net
+
+
+def quantize_detector(net, calib_inputs, backend=None):
+    """Observer insertion, calibration and conversion in one go."""
+    calib_inputs = list(calib_inputs)
+    net = prepare_detector(net, calib_inputs[0], backend)
+    calibrate(net, calib_inputs)
+    print('Calibrated on {:d} images.'.format(len(calib_inputs)))
+    return convert_detector(net)
+
+
+def calibration_inputs(dataset, num_images, seed=0):
+    """
+        Draw `num_images` preprocessed images from a detection dataset whose
+        pull_item returns (CHW tensor, target, h, w), e.g. VOCDetection with BaseTransform.
+    """
+    rng = np.random.RandomState(seed)
+    indices = rng.choice(len(dataset), min(num_images, len(dataset)), replace=False)
+    return [dataset.pull_item(int(i))[0].unsqueeze(0).float() for i in indices]
@@ -0,0 +1,113 @@
+"""Sampled throughput telemetry for the training loop.
+
+Every `every`-th iteration is split into data-wait, target-encoding, H2D,
+forward, loss, backward and optimizer time. Images/sec, the DataLoader queue
+depth and the peak memory are reported for the window since the previous
+sample. Only sampled iterations synchronize the device, so the training loop
+is otherwise left asynchronous.
+
+    telemetry = TrainTelemetry(writer, 'log/telemetry.jsonl', device, every=50)
+    telemetry.begin()
+    for images, targets in batch_iterator:
+        telemetry.mark('data')
+        ...
+        telemetry.mark('optimizer')
+        telemetry.end_step(iteration, images.size(0), batch_iterator)
+"""
+import os
+import json
+import time
+import resource
+import torch
+
+
+class TrainTelemetry(object):
+    def __init__(self, writer, jsonl_path, device, every=50):
+        self.writer = writer
+        self.device = device
+        self.every = every
+        self.file = None
+        if every > 0:
+            os.makedirs(os.path.dirname(jsonl_path) or '.', exist_ok=True)
+            self.file = open(jsonl_path, 'a')
+        self.active = False
+        self.stages = {}
+        self._last = 0.
+        self._window_start = 0.
+        self._window_images = 0
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def begin(self):
+        """Start timing, e.g. at the start of an epoch before the first batch is fetched."""
+        self._sync()
+        self._last = time.perf_counter()
+        if self._window_images == 0:
+            self._window_start = self._last
+
+    def mark(self, stage):
+        """Close `stage`: its time is the time since the previous mark."""
+        if not self.active:
+            return
+        self._sync()
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.) + now - self._last
+        self._last = now
+
+    def end_step(self, iteration, batch_size, loader_iter=None):
+        self._window_images += batch_size
+        if self.active:
+            self._report(iteration, loader_iter)
+        # decide now whether the next step is sampled, so it starts from a synced device
+        self.active = self.every > 0 and (iteration + 1) % self.every == 0
+        if self.active:
+            self._sync()
+            self.stages = {}
+        self._last = time.perf_counter()
+
+    def _report(self, iteration, loader_iter):
+        now = time.perf_counter()
+        record = {'iter': iteration}
+        for stage, t in self.stages.items():
+            record[stage + '_ms'] = t * 1000.
+        record['step_ms'] = sum(self.stages.values()) * 1000.
+        record['images_per_sec'] = self._window_images / max(now - self._window_start, 1e-12)
+        record['queue_depth'] = queue_depth(loader_iter)
+        record['peak_mem_mb'] = peak_memory_mb(self.device)
+
+        for key, value in record.items():
+            if key != 'iter' and value is not None:
+                self.writer.add_scalar('telemetry/' + key, value, iteration)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+        self._window_start = now
+        self._window_images = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def queue_depth(loader_iter):
+    """Number of batches prefetched by the DataLoader workers and not consumed yet."""
+    queue = getattr(loader_iter, '_data_queue', None)
+    if queue is None:
+        return None
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # multiprocessing queues do not implement qsize() on macOS
+        return None
+
+
+def peak_memory_mb(device):
+    """Peak device memory since the last call on cuda, peak RSS of the process otherwise."""
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device) / 1024. ** 2
+        torch.cuda.reset_peak_memory_stats(device)
+        return peak
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
@@ -0,0 +1,143 @@
+"""Test-time augmentation for the eager detectors.
+
+Every resolution runs the image and its horizontal flip as one batch of
+two. Each view is decoded and postprocessed with the model's own
+decode_boxes / postprocess, and the flipped boxes are mirrored back. The
+views are merged with weighted box fusion ('wbf') or per-class NMS ('nms')
+and clipped afterwards. The boxes of the models are normalized to the
+input, so the views of different resolutions line up without rescaling.
+The models cache their grids per input size (set_input_size), so after the
+first image TTA costs the extra network FLOPs and nothing else.
+
+    tta = TTA(net, tta_sizes(net.input_size), flip=True, merge='wbf')
+    bboxes, scores, cls_inds = tta(img)      # like net(x), boxes in [0, 1]
+"""
+import numpy as np
+import torch
+from data import config, Preprocess
+from utils.detect import decode_batch
+from utils.nms import multiclass_nms
+
+
+def tta_sizes(input_size, scales=(0.75, 1., 1.25), multiple=32):
+    """`input_size` scaled by `scales`, rounded to a multiple of the largest stride."""
+    return [[max(int(round(input_size[0] * s / multiple)), 1) * multiple,
+             max(int(round(input_size[1] * s / multiple)), 1) * multiple] for s in scales]
+
+
+def box_iou(box, boxes):
+    """IoU of one [4,] box with [K, 4] boxes."""
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.maximum(xx2 - xx1, 0.) * np.maximum(yy2 - yy1, 0.)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-12)
+
+
+def weighted_box_fusion(bboxes, scores, cls_inds, num_views, iou_thresh=0.55):
+    """
+        Weighted box fusion: per class, boxes overlapping a fused box by more than
+        `iou_thresh` are averaged into it weighted by their scores. The score of a
+        fused box is the mean score of its boxes, scaled down when fewer than
+        `num_views` views found it.
+    """
+    out_bboxes, out_scores, out_cls = [], [], []
+    for c in np.unique(cls_inds):
+        inds = np.where(cls_inds == c)[0]
+        inds = inds[np.argsort(-scores[inds])]
+        fused = np.empty((len(inds), 4), dtype=np.float64)
+        members = []
+        for i in inds:
+            k = len(members)
+            if k > 0:
+                ious = box_iou(bboxes[i], fused[:k])
+                j = ious.argmax()
+                if ious[j] > iou_thresh:
+                    members[j].append(i)
+                    w = scores[members[j]]
+                    fused[j] = (bboxes[members[j]] * w[:, None]).sum(0) / w.sum()
+                    continue
+            members.append([i])
+            fused[k] = bboxes[i]
+        for k, m in enumerate(members):
+            out_bboxes.append(fused[k])
+            out_scores.append(scores[m].mean() * min(len(m), num_views) / num_views)
+            out_cls.append(c)
+    if len(out_bboxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64)
+    return np.array(out_bboxes), np.array(out_scores), np.array(out_cls, dtype=np.int64)
+
+
+def nms_merge(net, bboxes, scores, cls_inds):
+    """Per-class NMS over the detections of all views, with the model's nms_thresh."""
+    keep, _ = multiclass_nms(bboxes, scores, cls_inds, 'nms', net.nms_thresh)
+    return bboxes[keep], scores[keep], cls_inds[keep]
+
+
+class TTA(object):
+    def __init__(self, net, input_sizes, flip=True, merge='wbf', iou_thresh=0.55, mean=config.MEANS):
+        """
+            Input:
+                net : nn.Module -> detector in inference mode.
+                input_sizes : list -> [[H, W], ...] resolutions to run, multiples of the largest stride.
+                flip : bool -> also run the horizontally flipped image.
+                merge : str -> 'wbf' or 'nms'.
+                iou_thresh : float -> IoU above which wbf fuses two boxes.
+        """
+        assert merge in ('wbf', 'nms')
+        self.net = net
+        self.base_size = net.input_size
+        self.input_sizes = input_sizes
+        self.flip = flip
+        self.merge = merge
+        self.iou_thresh = iou_thresh
+        self.views = 1 + int(flip)
+        self.preprocess = {tuple(s): Preprocess(s, mean) for s in input_sizes}
+        self.buffers = {}
+
+    def __call__(self, image):
+        """
+            Input:
+                image : ndarray -> [h, w, 3] uint8 BGR image.
+            Output:
+                bboxes, scores, cls_inds -> as returned by the models, boxes normalized to the image.
+        """
+        bboxes, scores, cls_inds = [], [], []
+        for size in self.input_sizes:
+            key = tuple(size)
+            if key not in self.buffers:
+                # a host buffer, also when eval_voc sets a cuda default tensor type;
+                # only the forward runs on the device
+                self.buffers[key] = torch.empty(self.views, 3, size[0], size[1], device='cpu',
+                                                pin_memory=torch.device(self.net.device).type == 'cuda')
+            x = self.buffers[key]
+            self.preprocess[key].fill(image, x[0].numpy())
+            if self.flip:
+                x[1] = x[0].flip(-1)
+
+            self.net.set_input_size(size)
+            for v, (all_bbox, all_class) in enumerate(decode_batch(self.net, x.to(self.net.device))):
+                # merged unclipped, clipping could make kept boxes overlap
+                b, s, c = self.net.postprocess(all_bbox, all_class)
+                if v == 1:
+                    # mirror the boxes of the flipped image back
+                    b = np.stack([1. - b[:, 2], b[:, 1], 1. - b[:, 0], b[:, 3]], 1)
+                bboxes.append(b)
+                scores.append(s)
+                cls_inds.append(c)
+        self.net.set_input_size(self.base_size)
+
+        bboxes = np.concatenate(bboxes).reshape(-1, 4)
+        scores = np.concatenate(scores)
+        cls_inds = np.concatenate(cls_inds)
+        if self.merge == 'wbf':
+            bboxes, scores, cls_inds = weighted_box_fusion(bboxes, scores, cls_inds,
+                                                           len(self.input_sizes) * self.views, self.iou_thresh)
+        else:
+            bboxes, scores, cls_inds = nms_merge(self.net, bboxes, scores, cls_inds)
+        # clip the boxes, as the models do
+        bboxes = self.net.clip_boxes(bboxes * self.net.scale, self.net.input_size) / self.net.scale
+        return bboxes, scores, cls_inds
@@ -0,0 +1,113 @@
+"""Drawing of detections, headless.
+
+Labels are blitted from cached sprites instead of being rendered with
+cv2.putText for every box: the "class: " part is rendered once per class
+and the score from per-class glyphs of its characters, so a label costs a
+few array copies. `render_dataset` writes annotated images for a whole
+split with a process pool.
+"""
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+FONT_SCALE = 0.5
+THICKNESS = 2
+LABEL_HEIGHT = 15
+
+
+class LabelSprites(object):
+    """Label images with the class color as background, cached per class and per glyph."""
+    def __init__(self, class_names, class_color):
+        self.class_names = class_names
+        self.class_color = class_color
+        self.cache = {}
+
+    def _render(self, text, color):
+        (w, _), _ = cv2.getTextSize(text, FONT, FONT_SCALE, THICKNESS)
+        sprite = np.empty((LABEL_HEIGHT, w, 3), dtype=np.uint8)
+        sprite[:] = color
+        # the baseline sits on the bottom edge, as the labels drawn at (xmin, ymin)
+        cv2.putText(sprite, text, (0, LABEL_HEIGHT), FONT, FONT_SCALE, (0, 0, 0), THICKNESS)
+        return sprite
+
+    def _get(self, cls_indx, text):
+        key = (cls_indx, text)
+        sprite = self.cache.get(key)
+        if sprite is None:
+            sprite = self._render(text, self.class_color[cls_indx])
+            self.cache[key] = sprite
+        return sprite
+
+    def label(self, cls_indx, score):
+        parts = [self._get(cls_indx, self.class_names[cls_indx] + ': ')]
+        parts += [self._get(cls_indx, c) for c in '%.3f' % score]
+        return np.hstack(parts)
+
+
+def blit(img, sprite, x, y):
+    """Copy `sprite` into `img` with its top-left corner at (x, y), clipped to the image."""
+    h, w = sprite.shape[:2]
+    H, W = img.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, W), min(y + h, H)
+    if x1 > x0 and y1 > y0:
+        img[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
+
+@functools.lru_cache(maxsize=None)
+def _sprites(class_names, class_color):
+    return LabelSprites(class_names, class_color)
+
+
+def draw_detections(img, bboxes, scores, cls_inds, class_names, class_color, thresh):
+    """
+        Draw the boxes and labels of the detections scoring above `thresh` on `img` in place.
+        Input:
+            img : ndarray -> [H, W, 3] BGR image.
+            bboxes : ndarray -> [N, 4] boxes in pixels of img, (xmin, ymin, xmax, ymax).
+            scores : ndarray -> [N,]
+            cls_inds : ndarray -> [N,]
+        Output:
+            img : ndarray -> the annotated image.
+    """
+    sprites = _sprites(tuple(class_names), tuple(tuple(c) for c in class_color))
+    for i, box in enumerate(bboxes):
+        cls_indx = int(cls_inds[i])
+        xmin, ymin, xmax, ymax = [int(v) for v in box]
+        if scores[i] > thresh:
+            cv2.rectangle(img, (xmin, ymin), (xmax, ymax), class_color[cls_indx], 2)
+            blit(img, sprites.label(cls_indx, scores[i]), xmin, abs(ymin) - LABEL_HEIGHT)
+    return img
+
+
+def _render_one(job):
+    image_path, output_path, bboxes, scores, cls_inds, class_names, class_color, thresh = job
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        return False
+    draw_detections(img, bboxes, scores, cls_inds, class_names, class_color, thresh)
+    return cv2.imwrite(output_path, img)
+
+
+def render_dataset(image_paths, detections, output_dir, class_names, class_color, thresh, num_workers=None):
+    """
+        Write an annotated copy of every image to `output_dir`.
+        Input:
+            image_paths : list -> paths of the images.
+            detections : list -> (bboxes, scores, cls_inds) per image, boxes in pixels.
+            num_workers : int -> processes to render with, 0 renders in this process.
+        Output:
+            count : int -> number of images written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(path, os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.jpg'),
+             bboxes, scores, cls_inds, tuple(class_names), tuple(tuple(c) for c in class_color), thresh)
+            for path, (bboxes, scores, cls_inds) in zip(image_paths, detections)]
+    if num_workers == 0:
+        return sum(_render_one(job) for job in jobs)
+    with ProcessPoolExecutor(num_workers) as pool:
+        return sum(pool.map(_render_one, jobs, chunksize=16))